@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+postoverlay 性能基准测试
+
+在合成的 overlay 目录上测量 overlay 复制（apply_overlay）、删除（apply_remove）与目录树生成
+（format_file_tree / write_file_tree_json）的性能，目标为普通目录，以及（root 且存在 mke2fs 时）
+loop 挂载的 ext4 镜像。每个场景在独立的子进程中运行，以便统计其内存峰值；各引擎在同一个子进程中依次运行，
+内存峰值按场景/目标统计一次，不区分引擎。耗时包含引擎为每个文件输出日志（纯文本格式，输出被丢弃）的开销，
+与命令行实际运行时一致。
+
+使用:
+python3 benchmarks/bench.py                              # 运行全部场景
+python3 benchmarks/bench.py --scenario tiny deep         # 只运行指定场景
+python3 benchmarks/bench.py --scale 0.1 --repeat 1       # 缩小数据规模，快速验证
+python3 benchmarks/bench.py --json result.json           # 保存结果（包含 git 版本）
+python3 benchmarks/bench.py --compare base.json          # 与之前保存的结果比较
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+SRC_ROOT = PROJECT_ROOT / "src"
+SEED = 20250808
+EXT4_OVERHEAD = 256 * 1024 * 1024
+
+
+def _write_file(path, size, rng):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            n = min(remaining, 1024 * 1024)
+            f.write(rng.randbytes(n))
+            remaining -= n
+
+
+def generate_tiny(root, scale, rng):
+    """大量小文件：分布在 200 个目录中，每个 0~512 字节"""
+    count = max(int(20000 * scale), 1)
+    for i in range(count):
+        _write_file(
+            root / f"d{i % 200:03d}" / f"f{i:06d}.conf", rng.randint(0, 512), rng
+        )
+
+
+def generate_huge(root, scale, rng):
+    """少量大文件"""
+    size = max(int(128 * 1024 * 1024 * scale), 1024 * 1024)
+    for i in range(3):
+        _write_file(root / "usr/share/huge" / f"blob{i}.bin", size, rng)
+
+
+def generate_deep(root, scale, rng):
+    """深层目录：多条深度为 128 的目录链，每层一个文件"""
+    chains = max(int(20 * scale), 1)
+    for chain in range(chains):
+        path = root / f"chain{chain:02d}"
+        for level in range(128):
+            path = path / f"l{level:03d}"
+            _write_file(path / "file.txt", rng.randint(16, 256), rng)
+
+
+def generate_hardlinks(root, scale, rng):
+    """硬链接：每个文件另有 3 个硬链接（overlay 复制时被展开为独立文件）"""
+    count = max(int(2000 * scale), 1)
+    for i in range(count):
+        target = root / "lib" / f"lib{i:05d}.so"
+        _write_file(target, rng.randint(1024, 16 * 1024), rng)
+        for link in range(3):
+            link_path = root / f"links{link}" / target.name
+            link_path.parent.mkdir(parents=True, exist_ok=True)
+            os.link(target, link_path)
+
+
+def generate_sparse(root, scale, rng):
+    """稀疏文件：逻辑大小很大，只有首尾各 1MiB 数据"""
+    size = max(int(512 * 1024 * 1024 * scale), 4 * 1024 * 1024)
+    for i in range(4):
+        path = root / "var/lib/sparse" / f"disk{i}.img"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(rng.randbytes(1024 * 1024))
+            f.seek(size - 1024 * 1024)
+            f.write(rng.randbytes(1024 * 1024))
+
+
+SCENARIOS = {
+    "tiny": generate_tiny,
+    "huge": generate_huge,
+    "deep": generate_deep,
+    "hardlinks": generate_hardlinks,
+    "sparse": generate_sparse,
+}
+
+
+def _tree_stats(root):
+    files = 0
+    size = 0
+    for dir_path, _, file_names in os.walk(root):
+        for name in file_names:
+            files += 1
+            size += os.lstat(os.path.join(dir_path, name)).st_size
+    return files, size
+
+
+def is_ext4_available():
+    """ext4 目标需要 root 权限、mke2fs 与 loop 设备"""
+    return (
+        os.geteuid() == 0
+        and shutil.which("mke2fs") is not None
+        and Path("/dev/loop-control").exists()
+    )
+
+
+# ======================
+# 子进程：运行单个场景
+# ======================
+
+
+def _timed(func):
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def run_case(spec):
+    """在当前（子）进程中运行一个场景，返回各引擎每次重复的耗时"""
+    sys.path.insert(0, str(SRC_ROOT))
+    import pretty
+
+    pretty.set_plain_output(True)
+
+    from mount import mount_rootfs_image, unmount_rootfs_image, wait_for_image_release
+    from overlay import apply_overlay, apply_remove, scan_overlay
+    from pretty import format_file_tree, write_file_tree_json
+
+    overlay_dir = Path(spec["overlay_dir"])
+    entries = scan_overlay(overlay_dir)
+    remove_list = sorted(os.listdir(overlay_dir))
+
+    dest = Path(spec["dest"])
+    image = None
+    if spec["target"] == "ext4":
+        image = dest.with_suffix(".img")
+        with open(image, "wb") as f:
+            f.truncate(spec["image_size"])
+        subprocess.run(
+            ["mke2fs", "-q", "-F", "-t", "ext4", str(image)],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        mount_rootfs_image(image, dest)
+    else:
+        dest.mkdir(parents=True, exist_ok=True)
+
+    timings = {"overlay": [], "tree": [], "tree-json": [], "remove": []}
+    try:
+        for _ in range(spec["repeat"]):
+            timings["overlay"].append(
+                _timed(lambda: apply_overlay(dest, overlay_dir, entries=entries))
+            )
+            if spec["target"] == "ext4":
+                # 将脏页写回镜像，使复制的耗时包含实际的文件系统写入
+                timings["overlay"][-1] += _timed(os.sync)
+            timings["tree"].append(
+                _timed(lambda: format_file_tree(dest, depth=spec["depth"]))
+            )
+            with open(os.devnull, "w") as devnull:
+                timings["tree-json"].append(
+                    _timed(
+                        lambda: write_file_tree_json(dest, devnull, depth=spec["depth"])
+                    )
+                )
+            timings["remove"].append(_timed(lambda: apply_remove(dest, remove_list)))
+    finally:
+        if image is not None:
+            unmount_rootfs_image(dest)
+            wait_for_image_release(image)
+            image.unlink()
+    return {
+        "timings": timings,
+        "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def _child_main(spec_path):
+    spec = json.loads(Path(spec_path).read_text(encoding="utf-8"))
+    # 引擎输出的日志被父进程丢弃，但格式化与写出日志的耗时计入结果
+    result = run_case(spec)
+    Path(spec["result"]).write_text(json.dumps(result), encoding="utf-8")
+    return 0
+
+
+# ======================
+# 父进程：生成数据、调度与汇总
+# ======================
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "-C", str(PROJECT_ROOT), "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(scenarios, targets, workdir, scale=1.0, repeat=3, depth=4):
+    """运行基准测试，返回 (各引擎的耗时结果, 各场景/目标的内存峰值)"""
+    results = []
+    memory = []
+    for scenario in scenarios:
+        overlay_dir = workdir / scenario / "overlay"
+        print(f"生成场景数据: {scenario} ...")
+        shutil.rmtree(workdir / scenario, ignore_errors=True)
+        SCENARIOS[scenario](overlay_dir, scale, random.Random(SEED))
+        files, size = _tree_stats(overlay_dir)
+        print(f"  - {files} 个文件, {size / (1024 * 1024):.1f}MB")
+
+        for target in targets:
+            spec_path = workdir / scenario / f"{target}.spec.json"
+            result_path = workdir / scenario / f"{target}.result.json"
+            spec = {
+                "overlay_dir": str(overlay_dir),
+                "dest": str(workdir / scenario / f"dest-{target}"),
+                "target": target,
+                "image_size": size * 2 + EXT4_OVERHEAD,
+                "repeat": repeat,
+                "depth": depth,
+                "result": str(result_path),
+            }
+            spec_path.write_text(json.dumps(spec), encoding="utf-8")
+            print(f"运行: {scenario} -> {target} ...")
+            subprocess.run(
+                [sys.executable, __file__, "--child", str(spec_path)],
+                check=True,
+                stdout=subprocess.DEVNULL,
+            )
+            case = json.loads(result_path.read_text(encoding="utf-8"))
+            memory.append(
+                {"scenario": scenario, "target": target, "max_rss_kb": case["max_rss"]}
+            )
+            for engine, timings in case["timings"].items():
+                best = min(timings)
+                results.append(
+                    {
+                        "scenario": scenario,
+                        "target": target,
+                        "engine": engine,
+                        "files": files,
+                        "bytes": size,
+                        "seconds": best,
+                        "files_per_second": files / best if best else None,
+                        "mb_per_second": (
+                            size / (1024 * 1024) / best
+                            if best and engine == "overlay"
+                            else None
+                        ),
+                    }
+                )
+        shutil.rmtree(workdir / scenario, ignore_errors=True)
+    return results, memory
+
+
+def _key(result):
+    return result["scenario"], result["target"], result["engine"]
+
+
+def _print_rows(header, rows):
+    widths = [max(len(row[i]) for row in [header, *rows]) for i in range(len(header))]
+    for row in [header, *rows]:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+
+def print_results(results, memory, baseline=None):
+    baseline = {_key(r): r for r in (baseline or [])}
+    header = ["Scenario", "Target", "Engine", "Files", "Time", "Files/s", "MB/s"]
+    if baseline:
+        header.append("vs base")
+    rows = []
+    for result in results:
+        row = [
+            result["scenario"],
+            result["target"],
+            result["engine"],
+            str(result["files"]),
+            f"{result['seconds']:.3f}s",
+            f"{result['files_per_second']:.0f}" if result["files_per_second"] else "-",
+            f"{result['mb_per_second']:.1f}" if result["mb_per_second"] else "-",
+        ]
+        if baseline:
+            base = baseline.get(_key(result))
+            row.append(
+                f"{base['seconds'] / result['seconds']:.2f}x"
+                if base and result["seconds"]
+                else "-"
+            )
+        rows.append(row)
+    _print_rows(header, rows)
+    print()
+    # 所有引擎在同一个子进程中运行，内存峰值只能按场景/目标比较
+    _print_rows(
+        ["Scenario", "Target", "Max RSS"],
+        [
+            [item["scenario"], item["target"], f"{item['max_rss_kb'] / 1024:.1f}MB"]
+            for item in memory
+        ],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="postoverlay 性能基准测试")
+    parser.add_argument(
+        "--scenario",
+        nargs="+",
+        choices=list(SCENARIOS),
+        default=list(SCENARIOS),
+        help="要运行的场景（默认：全部）",
+    )
+    parser.add_argument(
+        "--target",
+        nargs="+",
+        choices=["dir", "ext4"],
+        default=None,
+        help="复制目标（默认：dir，可用时加上 ext4）",
+    )
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="数据规模系数（默认：1.0）"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="重复次数，取最快的一次（默认：3）"
+    )
+    parser.add_argument("--depth", type=int, default=4, help="目录树深度（默认：4）")
+    parser.add_argument(
+        "--workdir", default=None, help="生成数据的目录（默认：临时目录）"
+    )
+    parser.add_argument("--json", default=None, help="将结果保存为 JSON 文件")
+    parser.add_argument("--compare", default=None, help="与之前保存的 JSON 结果比较")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return _child_main(args.child)
+
+    targets = args.target or (["dir", "ext4"] if is_ext4_available() else ["dir"])
+    if "ext4" in targets and not is_ext4_available():
+        print("错误: ext4 目标需要 root 权限、mke2fs 与 loop 设备")
+        return 1
+
+    with tempfile.TemporaryDirectory(
+        prefix="postoverlay-bench-", dir=args.workdir
+    ) as workdir:
+        results, memory = run_benchmarks(
+            args.scenario,
+            targets,
+            Path(workdir),
+            scale=args.scale,
+            repeat=max(args.repeat, 1),
+            depth=args.depth,
+        )
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))["results"]
+    print_results(results, memory, baseline)
+
+    if args.json:
+        report = {
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "scale": args.scale,
+            "repeat": args.repeat,
+            "results": results,
+            "memory": memory,
+        }
+        Path(args.json).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"结果已保存: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,13 +7,27 @@ postoverlay 项目打包脚本
 python3 build.py                  # 正常构建
 python3 build.py --venv ./        # 在当前目录创建虚拟环境
 python3 build.py --venv /opt/envs # 在指定目录创建虚拟环境
+python3 build.py --check-import-time  # 仅检查源代码的启动导入耗时
+python3 build.py --compress --optimize 2  # 压缩归档，字节码去除 assert 与文档字符串
+python3 build.py --no-bytecode    # 只打包源代码（不预编译字节码）
+python3 build.py --no-prune       # 不裁剪依赖，打包完整的 rich 与 pygments
+python3 build.py --trace-command "overlay test.img -o overlay/"  # 追加用于追踪导入的运行场景
+python3 build.py --download-wheelhouse ./wheels  # 在可联网的机器上下载依赖的 wheel
+python3 build.py --wheelhouse ./wheels  # 离线构建：只从本地 wheel 目录安装依赖
+python3 build.py --force          # 即使源代码与依赖均未变化也重新构建
 """
 
 import argparse
+import hashlib
+import json
+import os
+import shlex
 import shutil
 import subprocess
 import sys
 import tempfile
+import time
+import zipfile
 from pathlib import Path
 
 # 项目配置
@@ -27,6 +41,135 @@ BUILD_DIR = "dist"
 OUTPUT_FILE = f"{PROJECT_NAME}-{VERSION}.pyz"
 VENV_DIR_NAME = ".venv"  # 虚拟环境目录名称
 PYPI_MIRROR = "https://mirrors.aliyun.com/pypi/simple/"
+CACHE_DIR = ".build-cache"  # 依赖缓存目录，按 requirements.txt 与解释器版本区分
+IMPORT_TIME_BUDGET_MS = 80  # `--help` 启动时导入模块的耗时上限（不含解释器自身的导入）
+BYTECODE_OPTIMIZE = 1  # 字节码优化级别，与 python -O/-OO 相同
+BENCH_SCRIPT = "benchmarks/bench.py"  # 追踪导入时运行的基准测试
+# 用于追踪依赖导入的运行场景：命令行场景为参数列表，"render" 场景以 rich 输出调用所有渲染函数，
+# "bench" 场景以小规模数据运行基准测试的所有引擎，"image" 场景在临时的 ext4 镜像上完整运行一次 overlay 命令
+# （需要 root 权限、mke2fs 与 loop 设备，不满足时跳过）
+TRACE_SCENARIOS = (
+    ["--help"],
+    ["overlay", "--help"],
+    ["mount", "--help"],
+    ["job", "--help"],
+    # 不存在的镜像/任务文件：导入各子命令模块并输出错误信息
+    ["overlay", "/nonexistent/postoverlay-trace.img"],
+    ["mount", "/nonexistent/postoverlay-trace.img"],
+    ["job", "/nonexistent/postoverlay-trace.toml"],
+    "render",
+    "bench",
+    "image",
+)
+# 裁剪依赖时始终保留的路径前缀：rich 根据 UNICODE_VERSION 环境变量动态导入对应版本的字符宽度表
+PRUNE_KEEP = ("rich/_unicode_data/",)
+# 运行场景的引导脚本：argv 为 <源代码目录或 pyz> <结果文件> <场景>，结果为 {"code", "modules": {模块: 相对路径}}
+_TRACE_BOOTSTRAP = """
+import json, os, runpy, sys
+root, result_path, scenario = sys.argv[1], sys.argv[2], json.loads(sys.argv[3])
+sys.path.insert(0, root)
+code = 0
+try:
+    if isinstance(scenario, str):
+        exec(compile(SCENARIO_CODE[scenario], f"<{scenario}>", "exec"))
+    else:
+        sys.argv = [root, *scenario]
+        runpy.run_path(root, run_name="__main__")
+except SystemExit as e:
+    code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+modules = {}
+for name, module in list(sys.modules.items()):
+    path = getattr(module, "__file__", None)
+    if path and os.path.abspath(path).startswith(os.path.abspath(root) + os.sep):
+        modules[name] = os.path.relpath(os.path.abspath(path), os.path.abspath(root))
+with open(result_path, "w") as f:
+    json.dump({"code": code, "modules": modules}, f)
+"""
+# 以 rich 输出调用 pretty 中的所有渲染函数（包括 pygments 的 bash 语法高亮）
+_RENDER_SCENARIO = """
+import tempfile
+import pretty
+pretty.set_plain_output(False)
+pretty.print_header("postoverlay")
+for printer in (pretty.print_info, pretty.print_success, pretty.print_warning,
+                pretty.print_error, pretty.print_debug):
+    printer("[info]trace[/info]")
+pretty.print_separator()
+pretty.print_shell_code("ls -l /")
+pretty.print_shell_output("output", success=False)
+pretty.print_stream_line("line", "stderr")
+pretty.print_shell_command("ls -l /", stdout="out", stderr="err", return_code=1, resource_usage="usage")
+pretty.print_table(["a", "b"], [[1, "[success]ok[/success]"]])
+with tempfile.TemporaryDirectory() as tmp:
+    open(tmp + "/file.sh", "w").close()
+    pretty.print_file_tree(tmp, depth=2)
+try:
+    raise RuntimeError("trace")
+except RuntimeError as e:
+    pretty.print_exception_info(e)
+with pretty.ProgressManager() as progress:
+    task = progress.add_task("trace", total=1)
+    progress.update(task)
+    progress.complete_task(task, "done")
+pretty.print_footer()
+pretty.print_quote("trace", "postoverlay")
+"""
+# 以小规模数据运行基准测试（目标为普通目录，可用时加上 ext4 镜像），引擎从 root 导入
+_BENCH_SCENARIO = """
+import importlib.util, pathlib, random, tempfile
+import pretty
+pretty.set_plain_output(False)
+spec = importlib.util.spec_from_file_location("bench", BENCH_PATH)
+bench = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bench)
+bench.SRC_ROOT = pathlib.Path(root)
+# run_case 默认使用纯文本输出，这里保持 rich 输出
+pretty.set_plain_output = lambda plain=True: None
+with tempfile.TemporaryDirectory() as tmp:
+    tmp = pathlib.Path(tmp)
+    for name in ("tiny", "hardlinks", "sparse"):
+        bench.SCENARIOS[name](tmp / name / "overlay", 0.005, random.Random(bench.SEED))
+        for target in ["dir", "ext4"] if bench.is_ext4_available() else ["dir"]:
+            bench.run_case({
+                "overlay_dir": str(tmp / name / "overlay"),
+                "dest": str(tmp / name / f"dest-{target}"),
+                "target": target,
+                "image_size": bench.EXT4_OVERHEAD,
+                "repeat": 1,
+                "depth": 4,
+            })
+"""
+# 在临时的 ext4 镜像上完整运行 overlay 命令：删除、脚本、overlay、目录树、快照、压缩输出、bmap 与报告
+_IMAGE_SCENARIO = """
+import pathlib, subprocess, tempfile
+import pretty
+# 输出不是终端时同样使用 rich 输出
+pretty.set_plain_output(False)
+with tempfile.TemporaryDirectory() as tmp:
+    tmp = pathlib.Path(tmp)
+    image = tmp / "rootfs.img"
+    with open(image, "wb") as f:
+        f.truncate(64 * 1024 * 1024)
+    subprocess.run(["mke2fs", "-q", "-F", "-t", "ext4", str(image)], check=True, stdout=subprocess.DEVNULL)
+    (tmp / "overlay/etc").mkdir(parents=True)
+    (tmp / "overlay/etc/hostname").write_text("trace\\n")
+    (tmp / "pre.sh").write_text("#!/bin/sh\\necho pre\\n")
+    sys.argv = [
+        root, "overlay", str(image), "-o", str(tmp / "overlay"), "-s", str(tmp / "pre.sh"),
+        "-r", "/lost+found", "--show-rootfs-tree", "--snapshot", "--bmap", "--output", str(tmp / "out.gz"),
+        "--resource-report", str(tmp / "report.json"), "--metrics-out", str(tmp / "metrics.prom"),
+    ]
+    runpy.run_path(root, run_name="__main__")
+"""
+
+
+def is_image_scenario_available():
+    """ "image" 场景需要 root 权限、mke2fs 与 loop 设备"""
+    return (
+        os.geteuid() == 0
+        and shutil.which("mke2fs") is not None
+        and Path("/dev/loop-control").exists()
+    )
 
 
 def create_virtual_environment(target_dir):
@@ -150,30 +293,46 @@ def copy_resources(build_dir):
         print(f"  - resources/{rel_path}")
 
 
-def install_dependencies(build_dir):
-    """安装依赖到构建目录"""
-    if not Path(REQUIREMENTS).exists():
-        print(f"依赖文件不存在: {REQUIREMENTS}, 跳过")
-        return
+def _interpreter_tag(python=sys.executable):
+    """目标解释器的版本与平台，作为依赖缓存键的一部分"""
+    result = subprocess.run(
+        [python, "-c", "import platform, sys; print(sys.version, platform.machine())"],
+        stdout=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    return result.stdout.strip()
+
+
+def dependency_key(python=sys.executable):
+    """依赖缓存的键：requirements.txt 的内容与目标解释器版本的哈希"""
+    digest = hashlib.sha256()
+    requirements_path = Path(REQUIREMENTS)
+    if requirements_path.is_file():
+        digest.update(requirements_path.read_bytes())
+    digest.update(_interpreter_tag(python).encode("utf-8"))
+    return digest.hexdigest()[:16]
 
-    print("安装Python依赖...")
 
-    # 创建临时虚拟环境
+def _pip_install(target_dir, wheelhouse=None, python=sys.executable):
+    """在临时虚拟环境中将依赖安装到 target_dir，指定 wheelhouse 时不访问网络"""
     with tempfile.TemporaryDirectory() as venv_dir:
         # 创建虚拟环境
-        subprocess.run([sys.executable, "-m", "venv", venv_dir], check=True)
+        subprocess.run([python, "-m", "venv", venv_dir], check=True)
         # 获取pip路径
         pip_path = Path(venv_dir) / "bin" / "pip"
         if not pip_path.exists():
             pip_path = Path(venv_dir) / "Scripts" / "pip.exe"
 
-        mirror_url = PYPI_MIRROR.strip()
-
-        # 修复wheel未安装的bug
-        wheel_install_cmd = [str(pip_path), "install", "wheel"]
-        if mirror_url:
-            wheel_install_cmd = [*wheel_install_cmd, "-i", mirror_url]
-        subprocess.run(wheel_install_cmd, check=False)
+        if wheelhouse:
+            index_args = ["--no-index", "--find-links", str(Path(wheelhouse).resolve())]
+        else:
+            mirror_url = PYPI_MIRROR.strip()
+            index_args = ["-i", mirror_url] if mirror_url else []
+            # 修复wheel未安装的bug
+            subprocess.run(
+                [str(pip_path), "install", "wheel", *index_args], check=False
+            )
 
         install_cmd = [
             str(pip_path),
@@ -181,42 +340,426 @@ def install_dependencies(build_dir):
             "-r",
             REQUIREMENTS,
             "--target",
-            str(build_dir),
+            str(target_dir),
+            *index_args,
         ]
+        subprocess.run(install_cmd, check=True)
 
-        if mirror_url:
-            install_cmd = [*install_cmd, "-i", mirror_url]
 
-        # 安装依赖到构建目录
-        subprocess.run(install_cmd, check=True)
+def install_dependencies(
+    build_dir, wheelhouse=None, python=sys.executable, use_cache=True
+):
+    """
+    安装依赖到构建目录
 
+    安装结果缓存在 CACHE_DIR/deps/<键> 中，requirements.txt 与解释器版本不变时直接复制缓存，
+    不再创建虚拟环境与访问索引
+    """
+    if not Path(REQUIREMENTS).exists():
+        print(f"依赖文件不存在: {REQUIREMENTS}, 跳过")
+        return
+
+    cache_path = Path(CACHE_DIR) / "deps" / dependency_key(python)
+    if use_cache and cache_path.is_dir():
+        print(f"使用依赖缓存: {cache_path}")
+        shutil.copytree(cache_path, build_dir, dirs_exist_ok=True)
+        return
+
+    print("安装Python依赖...")
+    if not use_cache:
+        _pip_install(build_dir, wheelhouse, python)
         print("依赖安装完成")
+        return
+
+    # 先安装到缓存目录下的临时目录，完成后再改名，中断的安装不会留下不完整的缓存
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=cache_path.parent) as temp_dir:
+        install_path = Path(temp_dir) / "site-packages"
+        _pip_install(install_path, wheelhouse, python)
+        os.replace(install_path, cache_path)
+    print(f"依赖安装完成，已缓存: {cache_path}")
+    shutil.copytree(cache_path, build_dir, dirs_exist_ok=True)
+
+
+def download_wheelhouse(wheelhouse, python=sys.executable):
+    """下载依赖（及其依赖）的 wheel 到 wheelhouse，供离线构建使用"""
+    mirror_url = PYPI_MIRROR.strip()
+    download_cmd = [
+        python,
+        "-m",
+        "pip",
+        "download",
+        "-r",
+        REQUIREMENTS,
+        "-d",
+        str(wheelhouse),
+    ]
+    if mirror_url:
+        download_cmd = [*download_cmd, "-i", mirror_url]
+    subprocess.run(download_cmd, check=True)
+    print(f"依赖已下载到: {wheelhouse}")
+
+
+def _iter_build_inputs():
+    """参与构建的源代码、资源文件与追踪导入时运行的基准测试（不含 __pycache__ 与虚拟环境）"""
+    for root in (Path(SRC_ROOT), Path(RESOURCE_DIR), Path(BENCH_SCRIPT).parent):
+        if not root.is_dir():
+            continue
+        for path in sorted(root.rglob("*")):
+            if path.is_file() and not {"__pycache__", VENV_DIR_NAME} & set(path.parts):
+                yield root, path
+
+
+def build_hash(dep_key, options):
+    """源代码、资源文件、依赖、构建选项与本脚本的哈希，均未变化时不需要重新构建"""
+    digest = hashlib.sha256()
+    for root, path in _iter_build_inputs():
+        digest.update(
+            f"{root.name}/{path.relative_to(root).as_posix()}\0".encode("utf-8")
+        )
+        digest.update(path.read_bytes())
+    digest.update(dep_key.encode("utf-8"))
+    digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    digest.update(Path(__file__).read_bytes())
+    return digest.hexdigest()
+
+
+def _build_stamp_path():
+    return Path(BUILD_DIR) / f".{OUTPUT_FILE}.sha256"
+
+
+def compile_bytecode(build_dir, python=sys.executable, optimize=BYTECODE_OPTIMIZE):
+    """
+    使用目标解释器将构建目录中的所有 .py 编译为字节码
+
+    zip 中无法写入 __pycache__，不预编译时每次运行都要重新编译全部源代码（包括 rich 与 pygments）。
+    这里使用 legacy 布局（foo.py -> foo.pyc，zipimport 只查找这种文件名），并使用 unchecked-hash 模式，
+    归档中不包含源代码时也不需要校验源文件的时间戳
+    """
+    print(f"编译字节码 (optimize={optimize}): {python}")
+    subprocess.run(
+        [
+            python,
+            "-m",
+            "compileall",
+            "-q",
+            "-b",
+            "-o",
+            str(optimize),
+            "--invalidation-mode",
+            "unchecked-hash",
+            # 字节码中记录相对路径，traceback 中显示为 utils.py、rich/console.py 等
+            "-s",
+            str(build_dir),
+            str(build_dir),
+        ],
+        check=True,
+    )
 
 
-def create_zipapp(build_dir, output_file):
-    """创建可执行的 .pyz 文件"""
+def _archive_files(build_dir, bytecode, keep_source):
+    """列出要写入归档的文件，返回 [(文件路径, 归档内路径)]"""
+    files = []
+    for path in sorted(Path(build_dir).rglob("*")):
+        if not path.is_file() or "__pycache__" in path.parts:
+            continue
+        if bytecode:
+            # 有对应 .pyc 的源文件只在 keep_source 时保留
+            if (
+                path.suffix == ".py"
+                and path.with_suffix(".pyc").is_file()
+                and not keep_source
+            ):
+                continue
+        elif path.suffix == ".pyc":
+            continue
+        files.append((path, path.relative_to(build_dir).as_posix()))
+    return files
+
+
+def write_archive(
+    build_dir, output_path, bytecode=True, compressed=False, keep_source=False
+):
+    """
+    将构建目录写入可执行的 zip 归档
+
+    不使用 zipapp.create_archive：它要求存在 __main__.py，而只包含字节码时入口为 __main__.pyc
+    """
+    output_path = Path(output_path)
+    compression = zipfile.ZIP_DEFLATED if compressed else zipfile.ZIP_STORED
+    with open(output_path, "wb") as f:
+        f.write(b"#!/usr/bin/env python3\n")
+        with zipfile.ZipFile(f, "w", compression=compression) as archive:
+            for path, name in _archive_files(build_dir, bytecode, keep_source):
+                archive.write(path, name)
+    # 设置可执行权限
+    output_path.chmod(0o755)
+    return output_path
+
+
+def run_trace_scenario(root, scenario, python=sys.executable):
+    """
+    在源代码目录或 pyz（root）上运行一个场景，返回 (退出码, {模块: 相对路径})，只包含 root 中的模块
+
+    rich 输出通过 FORCE_COLOR 强制启用，与在终端中运行时导入的模块相同
+    """
+    root = Path(root).resolve()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        result_path = Path(temp_dir) / "trace.json"
+        scenario_code = {
+            "render": _RENDER_SCENARIO,
+            "bench": _BENCH_SCENARIO.replace(
+                "BENCH_PATH", repr(str(Path(BENCH_SCRIPT).resolve()))
+            ),
+            "image": _IMAGE_SCENARIO,
+        }
+        bootstrap = _TRACE_BOOTSTRAP.replace("SCENARIO_CODE", repr(scenario_code))
+        subprocess.run(
+            [
+                python,
+                "-c",
+                bootstrap,
+                str(root),
+                str(result_path),
+                json.dumps(scenario),
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            cwd=temp_dir,
+            env={**os.environ, "FORCE_COLOR": "1", "TERM": "xterm-256color"},
+            check=False,
+        )
+        if not result_path.is_file():
+            raise RuntimeError(f"场景运行失败: {scenario}")
+        result = json.loads(result_path.read_text(encoding="utf-8"))
+    return result["code"], result["modules"]
+
+
+def trace_imports(build_dir, scenarios, python=sys.executable):
+    """运行所有场景，返回 ({场景: (退出码, 模块列表)}, 被导入的文件的相对路径集合)"""
+    results = {}
+    used_files = set()
+    for scenario in scenarios:
+        code, modules = run_trace_scenario(build_dir, scenario, python)
+        results[json.dumps(scenario)] = (code, sorted(modules))
+        used_files.update(Path(path).as_posix() for path in modules.values())
+        print(f"  - {scenario}: 导入 {len(modules)} 个模块")
+    return results, used_files
+
+
+def _dependency_entries(build_dir):
+    """构建目录中由 pip 安装的顶层条目（本项目的源代码与资源文件之外）"""
+    own = {path.name for path in Path(SRC_ROOT).iterdir()} | {"resources"}
+    return [entry for entry in Path(build_dir).iterdir() if entry.name not in own]
+
+
+def prune_dependencies(build_dir, used_files, keep=PRUNE_KEEP):
+    """
+    删除依赖中未被导入的模块
+
+    被导入模块所在包中的数据文件保留；没有任何模块被导入的包整体删除（包括其 .dist-info），
+    console script（bin/）在 zipapp 中无法使用，一并删除
+    """
+    removed_size = 0
+    removed_files = 0
+    for entry in _dependency_entries(build_dir):
+        if entry.name.endswith(".dist-info"):
+            continue
+        if entry.name == "bin" or (entry.is_file() and entry.suffix == ".py"):
+            paths = [entry] if entry.is_file() else list(entry.rglob("*"))
+            if entry.name == "bin" or entry.name not in used_files:
+                removed_size += sum(p.stat().st_size for p in paths if p.is_file())
+                removed_files += sum(1 for p in paths if p.is_file())
+                shutil.rmtree(entry) if entry.is_dir() else entry.unlink()
+            continue
+        if not entry.is_dir():
+            continue
+        package_used = any(used.startswith(f"{entry.name}/") for used in used_files)
+        for path in sorted(entry.rglob("*"), reverse=True):
+            rel_path = path.relative_to(build_dir).as_posix()
+            if path.is_file():
+                if package_used and (
+                    path.suffix != ".py"
+                    or rel_path in used_files
+                    or rel_path.startswith(keep)
+                ):
+                    continue
+                removed_size += path.stat().st_size
+                removed_files += 1
+                path.unlink()
+            elif path.is_dir() and not any(path.iterdir()):
+                path.rmdir()
+        if not any(entry.iterdir()):
+            entry.rmdir()
+
+    # 删除对应包已被整体删除的 .dist-info
+    for entry in _dependency_entries(build_dir):
+        if not entry.name.endswith(".dist-info") or not (entry / "RECORD").is_file():
+            continue
+        top_levels = set()
+        for line in (entry / "RECORD").read_text(encoding="utf-8").splitlines():
+            top_level = line.split(",", 1)[0].split("/", 1)[0]
+            if top_level and not top_level.endswith(".dist-info") and top_level != "..":
+                top_levels.add(top_level)
+        if top_levels and not any(
+            (Path(build_dir) / name).exists() for name in top_levels
+        ):
+            shutil.rmtree(entry)
+
+    print(
+        f"裁剪依赖: 删除 {removed_files} 个文件 ({removed_size / 1024 / 1024:.1f} MiB)"
+    )
+
+
+def verify_archive(target, traced, python=sys.executable):
+    """
+    在最终的 pyz 上重新运行所有场景，退出码与导入的模块都应与追踪时相同（缺少模块时导入会失败），
+    返回是否通过
+    """
+    passed = True
+    for key, (code, modules) in traced.items():
+        scenario = json.loads(key)
+        try:
+            result_code, result_modules = run_trace_scenario(target, scenario, python)
+        except RuntimeError as e:
+            print(f"错误: {e}")
+            passed = False
+            continue
+        missing = sorted(set(modules) - set(result_modules))
+        if result_code != code or missing:
+            print(
+                f"错误: 场景 {scenario} 运行结果不一致 (退出码 {result_code}, 预期 {code})"
+            )
+            for name in missing:
+                print(f"  - 缺少模块: {name}")
+            passed = False
+    return passed
+
+
+def create_zipapp(
+    build_dir,
+    output_file,
+    bytecode=True,
+    compressed=False,
+    optimize=BYTECODE_OPTIMIZE,
+    keep_source=False,
+    python=sys.executable,
+    prune=True,
+    trace_commands=(),
+    wheelhouse=None,
+    use_cache=True,
+):
+    """创建可执行的 .pyz 文件，返回 (输出路径, 追踪结果)，不裁剪依赖时追踪结果为 None"""
     print(f"创建可执行文件: {output_file}")
 
     # 安装依赖
-    install_dependencies(build_dir)
+    install_dependencies(build_dir, wheelhouse, python, use_cache)
+
+    # 追踪运行时实际导入的模块并裁剪依赖
+    traced = None
+    if prune:
+        print("追踪导入的模块...")
+        scenarios = [*TRACE_SCENARIOS, *(shlex.split(c) for c in trace_commands)]
+        if not is_image_scenario_available():
+            print("警告: 需要 root 权限、mke2fs 与 loop 设备，跳过 image 场景")
+            scenarios.remove("image")
+        traced, used_files = trace_imports(build_dir, scenarios, python)
+        prune_dependencies(build_dir, used_files)
+
+    # 预编译字节码
+    if bytecode:
+        compile_bytecode(build_dir, python, optimize)
 
     # 确保输出目录存在
     output_path = Path(BUILD_DIR) / output_file
     output_path.parent.mkdir(parents=True, exist_ok=True)
 
-    # # 创建zipapp文件
-    import zipapp
-
-    zipapp.create_archive(
-        build_dir,
-        output_path,
-        interpreter="/usr/bin/env python3",
+    write_archive(build_dir, output_path, bytecode, compressed, keep_source)
+    size = output_path.stat().st_size / 1024 / 1024
+    print(f"创建成功: {output_path} ({size:.1f} MiB)")
+
+    return output_path, traced
+
+
+def measure_startup_time(target, args=("--help",), runs=5, python=sys.executable):
+    """统计运行 target 的耗时（毫秒），取 runs 次中最短的一次"""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(
+            [python, str(target), *args],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+
+def report_startup_time(source_target, bytecode_target, python=sys.executable):
+    """输出只含源代码与预编译字节码两种归档的启动耗时"""
+    before = measure_startup_time(source_target, python=python)
+    after = measure_startup_time(bytecode_target, python=python)
+    print(
+        f"启动耗时 (--help): 源代码 {before:.1f}ms -> 字节码 {after:.1f}ms ({after - before:+.1f}ms)"
     )
-    # 设置可执行权限
-    output_path.chmod(0o755)
-    print(f"创建成功: {output_path}")
 
-    return output_path
+
+def _parse_import_time(stderr):
+    """解析 -X importtime 的输出，返回顶层导入的 {模块: 累计耗时(微秒)}"""
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # 顶层导入的模块名前只有一个空格
+        if not cumulative.strip().isdigit() or name.startswith("  "):
+            continue
+        imports[name.strip()] = int(cumulative)
+    return imports
+
+
+def measure_import_time(target, args=("--help",), runs=3):
+    """
+    统计运行 target 时导入模块的耗时，取 runs 次中总耗时最短的一次
+
+    返回 (总耗时(毫秒), [(模块, 耗时(毫秒))])，解释器启动时本身就会导入的模块不计入
+    """
+
+    def _run(command):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", *command],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+        return _parse_import_time(result.stderr)
+
+    baseline = _run(["-c", "pass"])
+    measurements = []
+    for _ in range(runs):
+        imports = {
+            name: cumulative / 1000
+            for name, cumulative in _run([str(target), *args]).items()
+            if name not in baseline
+        }
+        measurements.append((sum(imports.values()), imports))
+    total, imports = min(measurements, key=lambda item: item[0])
+    ranked = sorted(imports.items(), key=lambda item: item[1], reverse=True)
+    return total, ranked
+
+
+def check_import_time(target, budget_ms=IMPORT_TIME_BUDGET_MS, top=10):
+    """检查启动时的导入耗时是否超出预算，返回是否通过"""
+    total, ranked = measure_import_time(target)
+    print(f"启动导入耗时: {total:.1f}ms (预算: {budget_ms}ms) - {target}")
+    for name, elapsed in ranked[:top]:
+        print(f"  - {name}: {elapsed:.1f}ms")
+    if budget_ms and total > budget_ms:
+        print(f"错误: 启动导入耗时超出预算 {budget_ms}ms")
+        return False
+    return True
 
 
 def generate_install_script(zipapp_path):
@@ -257,10 +800,44 @@ echo "运行命令: {PROJECT_NAME} --help"
     print(f"安装脚本已生成: {script_path}")
 
 
-def build():
-    """执行完整构建流程"""
+def build(
+    import_budget=IMPORT_TIME_BUDGET_MS,
+    bytecode=True,
+    compressed=False,
+    optimize=BYTECODE_OPTIMIZE,
+    keep_source=False,
+    python=sys.executable,
+    prune=True,
+    trace_commands=(),
+    wheelhouse=None,
+    use_cache=True,
+    force=False,
+):
+    """执行完整构建流程，源代码、依赖与构建选项均未变化时跳过构建"""
     print(f"开始构建 {PROJECT_NAME} v{VERSION}")
 
+    options = {
+        "output": OUTPUT_FILE,
+        "bytecode": bytecode,
+        "compressed": compressed,
+        "optimize": optimize,
+        "keep_source": keep_source,
+        "python": python,
+        "prune": prune,
+        "trace_commands": list(trace_commands),
+    }
+    current_hash = build_hash(dependency_key(python), options)
+    stamp_path = _build_stamp_path()
+    output_path = Path(BUILD_DIR) / OUTPUT_FILE
+    if (
+        not force
+        and output_path.is_file()
+        and stamp_path.is_file()
+        and stamp_path.read_text(encoding="utf-8").strip() == current_hash
+    ):
+        print(f"源代码与依赖均未变化，跳过构建: {output_path}")
+        return
+
     # 清理构建目录
     clean_build()
 
@@ -275,11 +852,43 @@ def build():
         copy_resources(build_path)
 
         # 创建zipapp
-        zipapp_path = create_zipapp(build_path, OUTPUT_FILE)
+        zipapp_path, traced = create_zipapp(
+            build_path,
+            OUTPUT_FILE,
+            bytecode,
+            compressed,
+            optimize,
+            keep_source,
+            python,
+            prune,
+            trace_commands,
+            wheelhouse,
+            use_cache,
+        )
 
         # 生成安装脚本
         generate_install_script(zipapp_path)
 
+        # 与只含源代码的归档对比启动耗时
+        if bytecode:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                source_path = write_archive(
+                    build_path, Path(temp_dir) / OUTPUT_FILE, False, compressed
+                )
+                report_startup_time(source_path, zipapp_path, python)
+
+    # 确认裁剪后的 pyz 仍能运行所有场景
+    if traced is not None:
+        print("验证裁剪后的可执行文件...")
+        if not verify_archive(zipapp_path, traced, python):
+            sys.exit(1)
+
+    # 检查启动导入耗时
+    if import_budget and not check_import_time(zipapp_path, import_budget):
+        sys.exit(1)
+
+    # 所有检查通过后才记录哈希，失败的构建下次会重新执行
+    stamp_path.write_text(current_hash + "\n", encoding="utf-8")
     print("构建完成!")
 
 
@@ -311,6 +920,83 @@ def main():
         help=f"指定输出文件名（默认：{OUTPUT_FILE}）",
     )
 
+    parser.add_argument(
+        "--import-budget",
+        type=float,
+        default=IMPORT_TIME_BUDGET_MS,
+        help=f"启动导入耗时上限，单位毫秒，0 表示不检查（默认：{IMPORT_TIME_BUDGET_MS}）",
+    )
+    parser.add_argument(
+        "--no-bytecode",
+        action="store_true",
+        help="不预编译字节码，只打包源代码",
+    )
+    parser.add_argument(
+        "--optimize",
+        type=int,
+        choices=(0, 1, 2),
+        default=BYTECODE_OPTIMIZE,
+        help=f"字节码优化级别，1 去除 assert，2 另外去除文档字符串（默认：{BYTECODE_OPTIMIZE}）",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="使用 deflate 压缩归档",
+    )
+    parser.add_argument(
+        "--keep-source",
+        action="store_true",
+        help="在字节码之外保留源代码（目标解释器版本不同时回退到源代码，traceback 中可显示源代码行）",
+    )
+    parser.add_argument(
+        "--python",
+        default=sys.executable,
+        help="目标解释器，用于编译字节码并测量启动耗时（默认：当前解释器）",
+    )
+    parser.add_argument(
+        "--no-prune",
+        action="store_true",
+        help="不裁剪依赖，打包完整的依赖项",
+    )
+    parser.add_argument(
+        "--trace-command",
+        action="append",
+        default=[],
+        metavar="ARGS",
+        help='追加一个追踪导入时运行的命令行场景（如 "overlay test.img -o overlay/"），可多次指定',
+    )
+    parser.add_argument(
+        "--wheelhouse",
+        default=None,
+        help="离线构建：只从该目录中的 wheel 安装依赖（pip --no-index --find-links）",
+    )
+    parser.add_argument(
+        "--download-wheelhouse",
+        default=None,
+        metavar="DIR",
+        help="下载依赖的 wheel 到指定目录后退出，供离线构建使用",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"不使用依赖缓存（{CACHE_DIR}），重新安装依赖",
+    )
+    parser.add_argument(
+        "--clean-cache",
+        action="store_true",
+        help="清理依赖缓存",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="即使源代码与依赖均未变化也重新构建",
+    )
+    parser.add_argument(
+        "--check-import-time",
+        action="store_true",
+        help="仅检查源代码目录中 __main__.py 的启动导入耗时",
+    )
+
     args = parser.parse_args()
 
     # 处理 --venv 选项
@@ -327,12 +1013,39 @@ def main():
     if args.output and args.output.strip():
         OUTPUT_FILE = args.output
 
-    # 处理 --clean 选项
+    if args.download_wheelhouse:
+        download_wheelhouse(args.download_wheelhouse, args.python)
+        sys.exit(0)
+
+    if args.wheelhouse and not Path(args.wheelhouse).is_dir():
+        print(f"错误：wheel 目录不存在: {args.wheelhouse}")
+        sys.exit(1)
+
+    if args.check_import_time:
+        budget = args.import_budget or IMPORT_TIME_BUDGET_MS
+        sys.exit(0 if check_import_time(Path(SRC_ROOT) / "__main__.py", budget) else 1)
+
+    # 处理 --clean 与 --clean-cache 选项
+    if args.clean_cache and Path(CACHE_DIR).exists():
+        print(f"清理依赖缓存: {CACHE_DIR}")
+        shutil.rmtree(CACHE_DIR)
     if args.clean:
         clean_build()
         print("清理完成")
-    else:
-        build()
+    elif not args.clean_cache:
+        build(
+            args.import_budget,
+            bytecode=not args.no_bytecode,
+            compressed=args.compress,
+            optimize=args.optimize,
+            keep_source=args.keep_source,
+            python=args.python,
+            prune=not args.no_prune,
+            trace_commands=args.trace_command,
+            wheelhouse=args.wheelhouse,
+            use_cache=not args.no_cache,
+            force=args.force or args.no_cache,
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,198 @@
+"""
+usage: postoverlay job [-h] [-j JOBS] [--dry-run] [--resource-report RESOURCE_REPORT] [--metrics-out METRICS_OUT]
+                       [--metrics-format {json,prometheus}]
+                       job_file
+
+positional arguments:
+  job_file              path to a TOML job file describing the images, overlays, remove lists, scripts, actions,
+                        mount profiles and outputs
+
+options:
+  -h, --help            show this help message and exit
+  -j JOBS, --jobs JOBS  maximum number of images processed in parallel, overrides `jobs` in the job file (default:
+                        cpu count)
+  --dry-run             validate the job file and print the schedule without processing any image
+  --resource-report RESOURCE_REPORT
+                        write the wall time, cpu time, max rss and i/o bytes of every phase and command to this json file
+  --metrics-out METRICS_OUT
+                        write per-phase wall time, counters and per-file copy/remove latency histograms to this file
+  --metrics-format {json,prometheus}
+                        format of the metrics file, prometheus (textfile collector) for `.prom` files and json otherwise
+                        when not specified
+
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from api import Session, SessionError
+from jobfile import JobFileError, build_schedule, load_job_file
+from metrics import get_metrics, merge_metrics, write_metrics
+from overlay import build_overlay_plan
+from privileged import get_privileged_helper
+from resources import extend_usage_records, get_usage_records, write_usage_report
+from stepcache import StepCache
+from utils import c_error, c_exception_info, c_info, c_table
+
+
+def print_schedule(schedule):
+    rows = []
+    for group_index, group in enumerate(schedule.groups):
+        for index in group:
+            job = schedule.jobs[index]
+            rows.append(
+                [
+                    group_index + 1,
+                    job.image,
+                    job.profile or "",
+                    len(job.overlays),
+                    len(job.pre_scripts) + len(job.post_scripts),
+                    len(job.pre_actions) + len(job.post_actions),
+                    job.output or "",
+                ]
+            )
+    c_table(
+        ["Group", "Image", "Profile", "Overlays", "Scripts", "Actions", "Output"],
+        rows,
+        title=f"Job Schedule - {len(schedule.jobs)} image(s), {schedule.workers} worker(s)",
+    )
+    c_info(
+        f"{len(schedule.overlays)} overlay director(ies) will be scanned once "
+        f"and shared by all images"
+    )
+
+
+def run_image_job(job, plans, jobs=None):
+    """在一个会话中处理一个镜像的所有步骤，返回 (退出码, 失败的步骤数)"""
+    step_cache = None
+    if job.options["step_cache"]:
+        cache_dir, cache_size = job.options["step_cache"]
+        step_cache = StepCache(cache_dir, cache_size * 1024 * 1024)
+    session = Session(
+        job.image,
+        qemu_bin=job.options["qemu_bin"],
+        unshare=job.options["unshare"],
+        snapshot=job.options["snapshot"],
+        step_cache=step_cache,
+        stream=job.options["stream"],
+        script_timeout=job.options["script_timeout"],
+        jobs=jobs,
+    )
+    results = []
+    try:
+        with session:
+            session.mount()
+            results.append(session.remove(job.remove))
+            for script_path in job.pre_scripts:
+                results.append(session.run_script(script_path, "pre-overlay"))
+            for action in job.pre_actions:
+                results.append(session.run_action(action, "pre-overlay"))
+            for overlay_dir in job.overlays:
+                results.append(session.overlay(plans[overlay_dir]))
+            for script_path in job.post_scripts:
+                results.append(session.run_script(script_path, "post-overlay"))
+            for action in job.post_actions:
+                results.append(session.run_action(action, "post-overlay"))
+    except SessionError as e:
+        c_info("process terminated")
+        return e.return_code, 0
+
+    if job.output:
+        session.write_output(
+            job.output, fmt=job.output_format, level=job.compress_level
+        )
+    if job.bmap:
+        session.write_bmap()
+    failed = sum(1 for result in results if not result.ok)
+    return (1 if failed else 0), failed
+
+
+def run_group(group_jobs, plans, jobs=None, reset=False):
+    """
+    依次处理一组镜像（位于同一个镜像文件中），返回 (每个镜像的结果, 资源记录, 指标)
+
+    reset 为 True 时（在会被复用的工作进程中）先清除之前处理的镜像的资源记录与指标
+    """
+    if reset:
+        get_usage_records(reset=True)
+        get_metrics(reset=True)
+    results = []
+    for job in group_jobs:
+        started = time.monotonic()
+        error = ""
+        try:
+            ret_code, failed = run_image_job(job, plans, jobs)
+        except Exception as e:
+            c_exception_info(e)
+            ret_code, failed = 1, 0
+            error = f"{type(e).__name__}: {e}"
+        results.append((job, ret_code, failed, time.monotonic() - started, error))
+    return results, get_usage_records(), get_metrics()
+
+
+def job_main(args):
+    try:
+        jobs, file_workers = load_job_file(args.job_file)
+    except JobFileError as e:
+        c_error(str(e))
+        c_info("process terminated")
+        return 1
+    schedule = build_schedule(jobs, args.jobs or file_workers)
+    print_schedule(schedule)
+    if args.dry_run:
+        return 0
+
+    try:
+        # 多个镜像共用的 overlay 目录只扫描与计算摘要一次
+        plans = {
+            overlay_dir: build_overlay_plan(overlay_dir)
+            for overlay_dir in schedule.overlays
+        }
+        # 各组的输出/bmap 生成平分 CPU；-j/jobs 只限制并行处理的镜像数，与该预算无关
+        cpu_jobs = max((os.cpu_count() or 1) // schedule.workers, 1)
+        groups = [
+            [schedule.jobs[index] for index in group] for group in schedule.groups
+        ]
+        if len(groups) == 1:
+            results, _, _ = run_group(groups[0], plans, cpu_jobs)
+        else:
+            c_info(
+                f"processing {len(groups)} group(s) of rootfs image(s) "
+                f"with {schedule.workers} worker process(es)"
+            )
+            # 在父进程中启动特权辅助进程（只提示一次密码），各工作进程共用它
+            get_privileged_helper().start()
+            results = []
+            with ProcessPoolExecutor(max_workers=schedule.workers) as executor:
+                futures = [
+                    executor.submit(run_group, group, plans, cpu_jobs, True)
+                    for group in groups
+                ]
+                for future in futures:
+                    group_results, records, metrics = future.result()
+                    extend_usage_records(records)
+                    merge_metrics(metrics)
+                    results.extend(group_results)
+
+        rows = []
+        for job, ret_code, failed, elapsed, error in results:
+            status = (
+                "[success]OK[/success]" if ret_code == 0 else "[error]FAILED[/error]"
+            )
+            rows.append([job.image, status, ret_code, failed, f"{elapsed:.1f}s", error])
+        c_table(
+            ["Image", "Status", "Exit Code", "Failed Steps", "Time", "Error"],
+            rows,
+            title="Job Result",
+        )
+        return 0 if all(result[1] == 0 for result in results) else 1
+    finally:
+        if args.resource_report:
+            c_info(
+                f"resource report written: {write_usage_report(args.resource_report)}"
+            )
+        if args.metrics_out:
+            c_info(
+                f"metrics written: {write_metrics(args.metrics_out, args.metrics_format)}"
+            )
@@ -25,6 +25,13 @@ sudo postoverlay mount rootfs.img -m /mnt/rootfs
 sudo postoverlay mount rootfs.img -m /mnt/rootfs -q aarch64-static
 ```
 
+`job`命令
+
+```bash
+sudo postoverlay job images.toml
+sudo postoverlay job images.toml --dry-run
+```
+
 作者：zimolab
 更新：2025/8/8
 协议：GPL 3.0
@@ -34,12 +41,16 @@ sudo postoverlay mount rootfs.img -m /mnt/rootfs -q aarch64-static
 import argparse
 import sys
 
-import __mount_command__
-import __overlay_command__
-from pretty import print_separator
-from helpers import InvalidArgumentError
+from actions import ACTIONS
+from metrics import METRICS_FORMATS
+from output import OUTPUT_FORMATS
+from pretty import DEFAULT_TREE_ENTRY_LIMIT, print_separator, set_plain_output
+from profiling import DEFAULT_PROFILE_TOP, run_profiled
+from stepcache import DEFAULT_STEP_CACHE_SIZE
 from utils import c_error, c_info, c_exception_info
 
+# 子命令模块在执行时才导入，--help 等不需要加载它们
+
 
 def create_parser():
 
@@ -48,6 +59,30 @@ def create_parser():
         description="postoverlay - apply overlay to rootfs image",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
+    parser.add_argument(
+        "--plain",
+        action="store_true",
+        help="print plain text instead of rich panels and tables "
+        "(used automatically when stdout is not a terminal)",
+    )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        metavar="PROF_FILE",
+        help="run the sub-command under cProfile and write the stats to this .prof file, each processing phase is "
+        "also written to <name>.<phase>.prof and the top entries are summarized with their phase",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="with --profile, also trace memory allocations with tracemalloc and summarize them per phase",
+    )
+    parser.add_argument(
+        "--profile-top",
+        type=int,
+        default=DEFAULT_PROFILE_TOP,
+        help="number of entries in the --profile summaries",
+    )
 
     subparsers = parser.add_subparsers(dest="command", help="sub-command")
 
@@ -55,22 +90,52 @@ def create_parser():
     overlay_command_parser = subparsers.add_parser(
         "overlay", help="apply overlay to rootfs image"
     )
-    overlay_command_parser.add_argument("rootfs", help="path to the rootfs image file")
+    overlay_command_parser.add_argument(
+        "rootfs",
+        nargs="+",
+        help="path to the rootfs image file(s), several images are processed concurrently with the same overlay plan. "
+        "a partition of a whole-disk image can be given as `disk.img:partN` or `disk.img:<label>`",
+    )
     overlay_command_parser.add_argument(
         "-o", "--overlay", help="path to the overlay directory"
     )
     overlay_command_parser.add_argument(
-        "-s", "--pre-script", help="path to script to execute before applying overlay"
+        "-s",
+        "--pre-script",
+        nargs="+",
+        action="extend",
+        help="path(s) to script(s) to execute before applying overlay, a directory of scripts is executed "
+        "run-parts style, scripts with `# depends:` headers run in parallel once their dependencies succeed",
+    )
+    overlay_command_parser.add_argument(
+        "-S",
+        "--post-script",
+        nargs="+",
+        action="extend",
+        help="path(s) to script(s) to execute after applying overlay, directories are handled like -s",
+    )
+    overlay_command_parser.add_argument(
+        "--pre-action",
+        nargs="+",
+        action="extend",
+        choices=list(ACTIONS),
+        help="built-in action(s) to run with host-native tools against the rootfs after the pre-overlay scripts",
     )
     overlay_command_parser.add_argument(
-        "-S", "--post-script", help="path to script to execute after applying overlay"
+        "--post-action",
+        nargs="+",
+        action="extend",
+        choices=list(ACTIONS),
+        help="built-in action(s) to run with host-native tools against the rootfs after the post-overlay scripts, "
+        "in place of running the same tools in the emulated rootfs",
     )
     overlay_command_parser.add_argument(
         "-q",
         "--qemu-bin",
         default=None,
         nargs="?",
-        help="when specified, the qemu binary will be copied to the bin/ directory of the mount point, "
+        help="when specified, the qemu binary will be bind-mounted into the mount point (nothing is done when it is "
+        "registered to binfmt_misc with the fix-binary flag), "
         "and chroot environment will be set up for executing pre/post scripts",
     )
     overlay_command_parser.add_argument(
@@ -92,12 +157,136 @@ def create_parser():
     overlay_command_parser.add_argument(
         "--depth", action="store", type=int, default=1, help="depth of file tree"
     )
+    overlay_command_parser.add_argument(
+        "--tree-limit",
+        action="store",
+        type=int,
+        default=DEFAULT_TREE_ENTRY_LIMIT,
+        help='maximum number of entries shown per directory in the file tree, the rest are summarized in an "N more" '
+        "line (0: unlimited)",
+    )
+    overlay_command_parser.add_argument(
+        "--tree-format",
+        default="text",
+        choices=["text", "json"],
+        help="format of the file tree, json is streamed without building the tree in memory and requires "
+        "--tree-output",
+    )
+    overlay_command_parser.add_argument(
+        "--tree-output",
+        default=None,
+        help="write the file tree to this file instead of stdout, `{name}` is replaced with the name of the rootfs image",
+    )
+    overlay_command_parser.add_argument(
+        "--output",
+        default=None,
+        help="write the modified rootfs image to this file as a compressed stream or android sparse image, "
+        "`{name}` is replaced with the name of the rootfs image",
+    )
+    overlay_command_parser.add_argument(
+        "--output-format",
+        default=None,
+        choices=OUTPUT_FORMATS,
+        help="format of the output file, guessed from the file suffix when not specified",
+    )
+    overlay_command_parser.add_argument(
+        "--compress-level",
+        action="store",
+        type=int,
+        default=6,
+        help="compression level of the output file",
+    )
+    overlay_command_parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        default=None,
+        help="number of workers used to process rootfs images, run the scripts of a script directory and write the "
+        "output/bmap files (default: cpu count)",
+    )
+    overlay_command_parser.add_argument(
+        "--bmap",
+        action="store_true",
+        help="generate a bmaptool compatible block map file (<rootfs>.bmap) next to the rootfs image",
+    )
+    overlay_command_parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="take a copy-on-write snapshot of the rootfs image before mounting it and roll back to it when the run fails. "
+        "without reflink support the snapshot falls back to a sparse copy of all data in the image (or partition), "
+        "which needs that much free space and time up front and compares every data block on rollback",
+    )
+    overlay_command_parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="stream the output of pre/post scripts line by line while they are running",
+    )
+    overlay_command_parser.add_argument(
+        "--script-timeout",
+        action="store",
+        type=float,
+        default=None,
+        help="maximum execution time of each pre/post script in seconds, "
+        "the whole process group of the script is killed when it expires",
+    )
+    overlay_command_parser.add_argument(
+        "--log-file",
+        default=None,
+        help="append the streamed output of pre/post scripts to this file",
+    )
+    overlay_command_parser.add_argument(
+        "--unshare",
+        action="store_true",
+        help="run each chrooted script in a private mount and pid namespace, so /proc, /sys, /dev, /run "
+        "(and the qemu binary) are never mounted on the host and are torn down by the kernel",
+    )
+    overlay_command_parser.add_argument(
+        "--step-cache",
+        action="store_true",
+        help="cache the changes made by each pre/post script and action, keyed by the image digest and the "
+        "contents of all previous steps, and replay them instead of running the step again",
+    )
+    overlay_command_parser.add_argument(
+        "--step-cache-dir",
+        default=None,
+        help="directory of the step cache (default: ~/.cache/postoverlay/steps)",
+    )
+    overlay_command_parser.add_argument(
+        "--step-cache-size",
+        action="store",
+        type=int,
+        default=DEFAULT_STEP_CACHE_SIZE // (1024 * 1024),
+        help="maximum size of the step cache in MiB, least recently used entries are evicted first",
+    )
+    overlay_command_parser.add_argument(
+        "--resource-report",
+        default=None,
+        help="write the wall time, cpu time, max rss and i/o bytes of every phase and command to this json file",
+    )
+    overlay_command_parser.add_argument(
+        "--metrics-out",
+        default=None,
+        help="write per-phase wall time, counters (files, bytes, errors, subprocesses) and per-file copy/remove "
+        "latency histograms to this file",
+    )
+    overlay_command_parser.add_argument(
+        "--metrics-format",
+        default=None,
+        choices=METRICS_FORMATS,
+        help="format of the metrics file, prometheus (textfile collector) for `.prom` files and json otherwise "
+        "when not specified",
+    )
 
     # 子命令：mount
     mount_command_parser = subparsers.add_parser(
         "mount", help="mount rootfs image file to  specified directory"
     )
-    mount_command_parser.add_argument("rootfs", help="path to the rootfs image file")
+    mount_command_parser.add_argument(
+        "rootfs",
+        help="path to the rootfs image file, a partition of a whole-disk image can be given as `disk.img:partN` "
+        "or `disk.img:<label>`",
+    )
     mount_command_parser.add_argument(
         "-m", "--mount-point", default=None, type=str, help="mount point"
     )
@@ -106,21 +295,84 @@ def create_parser():
         "--qemu-bin",
         default=None,
         nargs="?",
-        help="when specified, the qemu binary will be copied to the bin/ directory of the mount point, "
+        help="when specified, the qemu binary will be bind-mounted into the mount point (nothing is done when it is "
+        "registered to binfmt_misc with the fix-binary flag), "
         "and chroot environment will be set up",
     )
 
+    # 子命令：job
+    job_command_parser = subparsers.add_parser(
+        "job", help="process several rootfs images as described by a TOML job file"
+    )
+    job_command_parser.add_argument(
+        "job_file",
+        help="path to a TOML job file describing the images, overlays, remove lists, scripts, actions, "
+        "mount profiles and outputs",
+    )
+    job_command_parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        default=None,
+        help="maximum number of images processed in parallel, overrides `jobs` in the job file "
+        "(default: cpu count)",
+    )
+    job_command_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="validate the job file and print the schedule without processing any image",
+    )
+    job_command_parser.add_argument(
+        "--resource-report",
+        default=None,
+        help="write the wall time, cpu time, max rss and i/o bytes of every phase and command to this json file",
+    )
+    job_command_parser.add_argument(
+        "--metrics-out",
+        default=None,
+        help="write per-phase wall time, counters and per-file copy/remove latency histograms to this file",
+    )
+    job_command_parser.add_argument(
+        "--metrics-format",
+        default=None,
+        choices=METRICS_FORMATS,
+        help="format of the metrics file, prometheus (textfile collector) for `.prom` files and json otherwise "
+        "when not specified",
+    )
+
     return parser
 
 
 def main():
     parser = create_parser()
     args = parser.parse_args()
+    if args.plain:
+        set_plain_output(True)
+    if args.profile:
+        return run_profiled(
+            lambda: dispatch_command(parser, args),
+            args.profile,
+            memory=args.profile_memory,
+            top=args.profile_top,
+        )
+    return dispatch_command(parser, args)
+
+
+def dispatch_command(parser, args):
     command = args.command or ""
     if command == "overlay":
+        import __overlay_command__
+
         return __overlay_command__.main(args)
     elif command == "mount":
+        import __mount_command__
+
         return __mount_command__.mount_main(args)
+    elif command == "job":
+        import __job_command__
+
+        return __job_command__.job_main(args)
     else:
         if command:
             c_error(f"unknown command: {command}")
@@ -134,9 +386,10 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         c_info("process terminated by user", print_message=True)
         sys.exit(1)
-    except InvalidArgumentError:
-        pass
     except Exception as exc:
-        print_separator("Exception Occurred")
-        c_exception_info(exc, print_exception=True)
-        sys.exit(1)
+        from helpers import InvalidArgumentError
+
+        if not isinstance(exc, InvalidArgumentError):
+            print_separator("Exception Occurred")
+            c_exception_info(exc, print_exception=True)
+            sys.exit(1)
@@ -2,51 +2,45 @@
 usage: postoverlay mount [-h] [-m MOUNT_POINT] [-q [QEMU_BIN]] rootfs
 
 positional arguments:
-  rootfs                path to the rootfs image file
+  rootfs                path to the rootfs image file, a partition of a whole-disk image can be given as `disk.img:partN`
+                        or `disk.img:<label>`
 
 options:
   -h, --help            show this help message and exit
   -m MOUNT_POINT, --mount-point MOUNT_POINT
                         mount point
   -q [QEMU_BIN], --qemu-bin [QEMU_BIN]
-                        when specified, the qemu binary will be copied to the bin/ directory of the mount point,
-                        and chroot environment will be set up
+                        when specified, the qemu binary will be bind-mounted into the mount point (nothing is done
+                        when it is registered to binfmt_misc with the fix-binary flag), and chroot environment will
+                        be set up
 """
 
-from pathlib import Path
-
+from api import Session, SessionError
 from helpers import check_rootfs_file, check_mount_point, check_qemu_bin
-from mount import validate_rootfs_image, mount_rootfs_image, is_rootfs_image_mounted
-from scripts import setup_qemu_for_chroot, chroot_mount
-from utils import c_info, c_error, c_success, c_shell_command
+from scripts import (
+    QEMU_MODE_BIND,
+    QEMU_MODE_BIND_PLACEHOLDER,
+    QEMU_MODE_COPY,
+    chroot_mount,
+    get_qemu_target_path,
+    setup_qemu_for_chroot,
+)
+from utils import c_info, c_error, c_shell_command
 
 
 def mount_main(args):
     check_rootfs_file(args)
     check_mount_point(args)
     check_qemu_bin(args)
-    c_info("validating rootfs image file...")
-    if not validate_rootfs_image(args.rootfs):
-        c_error(f"{args.rootfs} is not a valid rootfs image file")
-        c_info("process terminated")
-        return 1
-    else:
-        c_success(f"{args.rootfs} validated")
+    # 镜像保持挂载，会话不关闭
+    session = Session(args.rootfs)
     try:
-        c_info("start to mount rootfs image...")
-        # 挂载镜像
-        mount_point = Path(args.mount_point)
-        mount_rootfs_image(args.rootfs, mount_point)
-        if not is_rootfs_image_mounted(mount_point):
-            c_info("failed to mount rootfs image")
-            c_info("process terminated")
-            return -1
-    except Exception as e:
-        raise e
+        mount_point = session.mount(args.mount_point).mount_point
+    except SessionError as e:
+        c_info("process terminated")
+        return e.return_code
 
-    c_info(f"rootfs image mounted")
     rootfs_dir = mount_point.absolute().as_posix()
-    c_info(f"$ROOTFS = {rootfs_dir}")
 
     c_info(f"now you can access the mounted rootfs image at `{rootfs_dir}`")
     qemu_bin = args.qemu_bin or ""
@@ -60,7 +54,8 @@ def mount_main(args):
 
     try:
         c_info(f"setting up chroot environment")
-        setup_qemu_for_chroot(mount_point=mount_point, qemu_bin=qemu_bin)
+        qemu_setup = setup_qemu_for_chroot(mount_point=mount_point, qemu_bin=qemu_bin)
+        qemu_mode = qemu_setup.mode
         chroot_mount(mount_point=mount_point)
         c_info(f"chroot environment prepared")
         c_info(f"you can now run chroot commands in `{rootfs_dir}`")
@@ -75,9 +70,22 @@ def mount_main(args):
             f"sudo umount -l {rootfs_dir}/dev\n"
             f"sudo umount -l {rootfs_dir}/run"
         )
+        qemu_path = get_qemu_target_path(mount_point, qemu_bin).absolute().as_posix()
+        qemu_cleanup_cmd = ""
+        if qemu_mode in (QEMU_MODE_BIND, QEMU_MODE_BIND_PLACEHOLDER):
+            qemu_cleanup_cmd += f"# unmount qemu binary\nsudo umount {qemu_path}\n"
+        if qemu_mode in (QEMU_MODE_BIND_PLACEHOLDER, QEMU_MODE_COPY):
+            qemu_cleanup_cmd += f"# remove qemu binary\nsudo rm -f {qemu_path}\n"
+        if qemu_setup.created_dirs:
+            created_dirs = " ".join(
+                d.absolute().as_posix() for d in qemu_setup.created_dirs
+            )
+            qemu_cleanup_cmd += (
+                f"# remove directories created for qemu binary\n"
+                f"sudo rmdir {created_dirs}\n"
+            )
         c_shell_command(
-            "# remove qemu binary from $ROOTFS/usr/bin/\n"
-            f"sudo rm -f {rootfs_dir}/user/bin/{qemu_bin}\n"
+            f"{qemu_cleanup_cmd}"
             f"# umount chroot environment \n"
             f"{chroot_umount_cmd}\n"
             f"# unmount rootfs image \n"
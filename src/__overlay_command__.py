@@ -1,79 +1,131 @@
 """
-usage: postoverlay overlay [-h] [-o OVERLAY] [-s PRE_SCRIPT] [-S POST_SCRIPT] [-q [QEMU_BIN]] [-r REMOVE [REMOVE ...]] [-R REMOVE_LIST] [--show-rootfs-tree] [--depth DEPTH]
-                           rootfs
+usage: postoverlay overlay [-h] [-o OVERLAY] [-s PRE_SCRIPT [PRE_SCRIPT ...]] [-S POST_SCRIPT [POST_SCRIPT ...]]
+                           [--pre-action {ldconfig,depmod,glib-compile-schemas,fc-cache,update-mime-database} [...]]
+                           [--post-action {ldconfig,depmod,glib-compile-schemas,fc-cache,update-mime-database} [...]] [-q [QEMU_BIN]] [-r REMOVE [REMOVE ...]] [-R REMOVE_LIST] [--show-rootfs-tree] [--depth DEPTH]
+                           [--tree-limit TREE_LIMIT] [--tree-format {text,json}] [--tree-output TREE_OUTPUT]
+                           [--output OUTPUT] [--output-format {gzip,xz,zstd,sparse}] [--compress-level COMPRESS_LEVEL] [-j JOBS] [--bmap] [--snapshot]
+                           [--stream] [--script-timeout SCRIPT_TIMEOUT] [--log-file LOG_FILE] [--unshare]
+                           [--step-cache] [--step-cache-dir STEP_CACHE_DIR] [--step-cache-size STEP_CACHE_SIZE]
+                           [--resource-report RESOURCE_REPORT] [--metrics-out METRICS_OUT] [--metrics-format {json,prometheus}]
+                           rootfs [rootfs ...]
 
 positional arguments:
-  rootfs                path to the rootfs image file
+  rootfs                path to the rootfs image file(s), several images are processed concurrently with the same overlay plan.
+                        a partition of a whole-disk image can be given as `disk.img:partN` or `disk.img:<label>`
 
 options:
   -h, --help            show this help message and exit
   -o OVERLAY, --overlay OVERLAY
                         path to the overlay directory
-  -s PRE_SCRIPT, --pre-script PRE_SCRIPT
-                        path to script to execute before applying overlay
-  -S POST_SCRIPT, --post-script POST_SCRIPT
-                        path to script to execute after applying overlay
+  -s PRE_SCRIPT [PRE_SCRIPT ...], --pre-script PRE_SCRIPT [PRE_SCRIPT ...]
+                        path(s) to script(s) to execute before applying overlay, a directory of scripts is executed
+                        run-parts style, scripts with `# depends:` headers run in parallel once their dependencies succeed
+  -S POST_SCRIPT [POST_SCRIPT ...], --post-script POST_SCRIPT [POST_SCRIPT ...]
+                        path(s) to script(s) to execute after applying overlay, directories are handled like -s
+  --pre-action {ldconfig,depmod,glib-compile-schemas,fc-cache,update-mime-database} [...]
+                        built-in action(s) to run with host-native tools against the rootfs after the pre-overlay scripts
+  --post-action {ldconfig,depmod,glib-compile-schemas,fc-cache,update-mime-database} [...]
+                        built-in action(s) to run with host-native tools against the rootfs after the post-overlay
+                        scripts, in place of running the same tools in the emulated rootfs
   -q [QEMU_BIN], --qemu-bin [QEMU_BIN]
-                        when specified, the qemu binary will be copied to the bin/ directory of the mount point, and chroot environment will be set up for executing
-                        pre/post scripts
+                        when specified, the qemu binary will be bind-mounted into the mount point (nothing is done when it is registered to binfmt_misc
+                        with the fix-binary flag), and chroot environment will be set up for executing pre/post scripts
   -r REMOVE [REMOVE ...], --remove REMOVE [REMOVE ...]
                         folders/files to remove in the rootfs before applying overlay(in a space-separated list)
   -R REMOVE_LIST, --remove-list REMOVE_LIST
                         path to file containing a list of folders/files to remove in the rootfs before applying overlay
   --show-rootfs-tree    show rootfs file tree when mounted
   --depth DEPTH         depth of file tree
+  --tree-limit TREE_LIMIT
+                        maximum number of entries shown per directory in the file tree, the rest are summarized in an
+                        "N more" line (0: unlimited)
+  --tree-format {text,json}
+                        format of the file tree, json is streamed without building the tree in memory and requires
+                        --tree-output
+  --tree-output TREE_OUTPUT
+                        write the file tree to this file instead of stdout, `{name}` is replaced with the name of the
+                        rootfs image
+  --output OUTPUT       write the modified rootfs image to this file as a compressed stream or android sparse image, `{name}`
+                        is replaced with the name of the rootfs image
+  --output-format {gzip,xz,zstd,sparse}
+                        format of the output file, guessed from the file suffix when not specified
+  --compress-level COMPRESS_LEVEL
+                        compression level of the output file
+  -j JOBS, --jobs JOBS  number of worker processes used to process rootfs images and write the output/bmap files (default: cpu
+                        count)
+  --bmap                generate a bmaptool compatible block map file (<rootfs>.bmap) next to the rootfs image
+  --snapshot            take a copy-on-write snapshot of the rootfs image before mounting it and roll back to it when the
+                        run fails. without reflink support the snapshot falls back to a sparse copy of all data in the
+                        image (or partition), which needs that much free space and time up front and compares every
+                        data block on rollback
+  --stream              stream the output of pre/post scripts line by line while they are running
+  --script-timeout SCRIPT_TIMEOUT
+                        maximum execution time of each pre/post script in seconds, the whole process group of the script
+                        is killed when it expires
+  --log-file LOG_FILE   append the streamed output of pre/post scripts to this file
+  --unshare             run each chrooted script in a private mount and pid namespace, so /proc, /sys, /dev, /run
+                        (and the qemu binary) are never mounted on the host and are torn down by the kernel
+  --step-cache          cache the changes made by each pre/post script and action, keyed by the image digest and
+                        the contents of all previous steps, and replay them instead of running the step again
+  --step-cache-dir STEP_CACHE_DIR
+                        directory of the step cache (default: ~/.cache/postoverlay/steps)
+  --step-cache-size STEP_CACHE_SIZE
+                        maximum size of the step cache in MiB, least recently used entries are evicted first
+  --resource-report RESOURCE_REPORT
+                        write the wall time, cpu time, max rss and i/o bytes of every phase and command to this json file
+  --metrics-out METRICS_OUT
+                        write per-phase wall time, counters (files, bytes, errors, subprocesses) and per-file copy/remove
+                        latency histograms to this file
+  --metrics-format {json,prometheus}
+                        format of the metrics file, prometheus (textfile collector) for `.prom` files and json otherwise
+                        when not specified
 
 """
 
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 from helpers import (
-    check_rootfs_file,
+    check_rootfs_files,
     check_overlay_dir,
     check_remove_list,
     check_pre_script_file,
     check_post_script_file,
     check_qemu_bin,
-    cleanup_mount_point,
+    check_output,
+    check_tree_output,
 )
+from api import Session, SessionError
+from metrics import get_metrics, merge_metrics, write_metrics
 from mount import *
+from output import get_output_path
 from overlay import *
+from privileged import get_privileged_helper
 from scripts import *
-from utils import c_error, c_info, c_success, c_file_tree
-
-
-def apply_remove(mount_point, remove_list):
-    if not remove_list:
-        return
-    for file_path in remove_list:
-        if not file_path:
-            continue
-
-        display_path = f"$ROOTFS/{file_path.strip().lstrip('/')}"
-        c_info(f"[remove_operation]removing {display_path}...[/remove_operation]")
-
-        real_path = Path(mount_point) / file_path.strip().lstrip("/")
-        if not real_path.exists():
-            c_info(
-                f"[remove_operation]{display_path} not found, skipped[/remove_operation]"
-            )
-            continue
-        try:
-            is_dir = real_path.is_dir()
-            if is_dir:
-                shutil.rmtree(real_path)
-            else:
-                real_path.unlink()
-            c_info(
-                f"[remove_operation]{'directory' if is_dir else 'file'}{display_path} removed[/remove_operation]"
-            )
-        except Exception as e:
-            c_error(f"failed to remove {file_path}: {e}")
+from resources import (
+    extend_usage_records,
+    format_usage_columns,
+    get_usage_records,
+    write_usage_report,
+)
+from stepcache import StepCache
+from utils import (
+    c_info,
+    c_exception_info,
+    c_table,
+    open_log_file,
+    close_log_file,
+)
 
 
 def main(args):
-    check_rootfs_file(args)
+    check_rootfs_files(args)
     check_overlay_dir(args)
     check_remove_list(args)
     check_qemu_bin(args)
+    check_output(args)
+    check_tree_output(args)
 
     remove_list = []
     if args.remove_list:
@@ -82,91 +134,164 @@ def main(args):
         args.remove = []
     args.remove = [*args.remove, *remove_list]
 
-    pre_script_path = (args.pre_script or "").strip()
-    if not pre_script_path:
+    pre_script_paths = [p.strip() for p in (args.pre_script or []) if p.strip()]
+    if not pre_script_paths:
         c_warning(
             "pre-overlay script not specified, pre-overlay scripting will be skipped"
         )
-    args.pre_script = pre_script_path
+    args.pre_script = pre_script_paths
     check_pre_script_file(args)
 
-    post_script_path = (args.post_script or "").strip()
-    if not post_script_path:
+    post_script_paths = [p.strip() for p in (args.post_script or []) if p.strip()]
+    if not post_script_paths:
         c_warning(
             "post-overlay script not specified, post-overlay scripting will be skipped"
         )
-    args.post_script = post_script_path
+    args.post_script = post_script_paths
     check_post_script_file(args)
 
-    c_info("validating rootfs image file...")
-    if not validate_rootfs_image(args.rootfs):
-        c_error(f"{args.rootfs} is not a valid rootfs image file")
-        c_info("process terminated")
-        return 1
-    else:
-        c_success(f"{args.rootfs} validated")
-
-    # 创建临时挂载点
-    c_info("create temporary mount point...")
-    mount_point = tempfile.mkdtemp(prefix="postoverlay_")
-    mount_point = Path(mount_point)
-    if not mount_point.exists():
-        c_error(f"failed to create mount point: {mount_point}")
-        c_info("process terminated")
-        return 1
-    c_info(f"mount point created at: {mount_point}, rootfs image will be mounted here")
+    if args.log_file:
+        open_log_file(args.log_file)
+    try:
+        # overlay扫描、摘要计算与删除列表编译只执行一次，由所有镜像共享
+        plan = build_overlay_plan(args.overlay, args.remove)
 
+        if len(args.rootfs) == 1:
+            return process_image(args, args.rootfs[0], plan)
+        return process_images(args, plan)
+    finally:
+        if args.resource_report:
+            c_info(
+                f"resource report written: {write_usage_report(args.resource_report)}"
+            )
+        if args.metrics_out:
+            c_info(
+                f"metrics written: {write_metrics(args.metrics_out, args.metrics_format)}"
+            )
+        close_log_file()
+
+
+def _process_image_worker(args, rootfs, plan, jobs):
+    # 工作进程会被复用，先清除之前处理的镜像的资源记录与指标
+    get_usage_records(reset=True)
+    get_metrics(reset=True)
+    started = time.monotonic()
+    error = ""
     try:
-        c_info("start to mount rootfs image...")
-        # 挂载镜像
-        mount_rootfs_image(args.rootfs, mount_point)
-        if not is_rootfs_image_mounted(mount_point):
-            c_info("failed to mount rootfs image")
-            c_info("process terminated")
-            return -1
+        ret_code = process_image(args, rootfs, plan, jobs=jobs)
     except Exception as e:
-        raise e
+        c_exception_info(e)
+        ret_code = 1
+        error = f"{type(e).__name__}: {e}"
+    return (
+        rootfs,
+        ret_code,
+        time.monotonic() - started,
+        error,
+        get_usage_records(),
+        get_metrics(),
+    )
+
+
+def process_images(args, plan):
+    """在进程池中并行处理多个镜像，并输出每个镜像的处理结果"""
+    workers = get_batch_workers(args.jobs, len(args.rootfs))
+    # 各镜像的输出/bmap 生成平分剩余的 CPU
+    jobs = max((args.jobs or os.cpu_count() or 1) // workers, 1)
+    c_info(
+        f"processing {len(args.rootfs)} rootfs image(s) with {workers} worker process(es)"
+    )
+    # 在父进程中启动特权辅助进程（只提示一次密码），各工作进程共用它
+    get_privileged_helper().start()
 
-    c_info(f"rootfs image mounted")
-    c_info(f"$ROOTFS = {mount_point.as_posix()}")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_process_image_worker, args, rootfs, plan, jobs)
+            for rootfs in args.rootfs
+        ]
+        results = [future.result() for future in futures]
 
-    # 显示挂载点文件树
-    if args.show_rootfs_tree:
-        depth = args.depth
-        if not depth or depth < 1:
-            depth = 1
-        c_file_tree(mount_point, depth=depth, title="rootfs/")
+    rows = []
+    for rootfs, ret_code, elapsed, error, records, metrics in results:
+        extend_usage_records(records)
+        merge_metrics(metrics)
+        status = "[success]OK[/success]" if ret_code == 0 else "[error]FAILED[/error]"
+        rows.append([rootfs, status, ret_code, f"{elapsed:.1f}s", error])
+    c_table(
+        ["Image", "Status", "Exit Code", "Time", "Error"], rows, title="Batch Result"
+    )
+    return 0 if all(result[1] == 0 for result in results) else 1
 
+
+def process_image(args, rootfs, plan, jobs=None):
+    """对单个镜像执行完整的 overlay 流程"""
+    step_cache = None
+    if args.step_cache:
+        step_cache = StepCache(args.step_cache_dir, args.step_cache_size * 1024 * 1024)
+    session = Session(
+        rootfs,
+        qemu_bin=args.qemu_bin,
+        unshare=args.unshare,
+        snapshot=args.snapshot,
+        step_cache=step_cache,
+        stream=args.stream,
+        script_timeout=args.script_timeout,
+        jobs=jobs or args.jobs,
+    )
     try:
-        if args.remove:
-            c_info("start to apply remove operations...")
-            c_info(f"{len(args.remove)} file(s) about to be removed...")
-            apply_remove(mount_point, args.remove)
-
-        # 执行pre-overlay脚本
-        if args.pre_script:
-            c_info("start to execute pre-overlay script...")
-            execute_script(
-                mount_point=mount_point,
-                script_path=args.pre_script,
-                qemu_bin=args.qemu_bin,
-            )
+        with session:
+            session.mount()
 
-        # 执行overlay操作
-        if args.overlay:
-            c_info("start to apply overlay operations...")
-            apply_overlay(mount_point, args.overlay)
-
-        # 执行post-overlay脚本
-        if args.post_script:
-            c_info("start to execute post-overlay script...")
-            execute_script(
-                mount_point=mount_point,
-                script_path=args.post_script,
-                qemu_bin=args.qemu_bin,
-            )
-        return 0
-    except Exception as e:
-        raise e
-    finally:
-        cleanup_mount_point(mount_point, remove_dir=True)
+            # 显示挂载点文件树
+            if args.show_rootfs_tree:
+                session.show_tree(
+                    depth=args.depth,
+                    limit=args.tree_limit,
+                    tree_format=args.tree_format,
+                    output=(
+                        get_output_path(args.tree_output, rootfs)
+                        if args.tree_output
+                        else None
+                    ),
+                )
+
+            session.remove(plan.remove)
+            # 执行pre-overlay脚本
+            for script_path in args.pre_script:
+                session.run_script(script_path, "pre-overlay")
+            for action in args.pre_action or []:
+                session.run_action(action, "pre-overlay")
+            # 执行overlay操作
+            session.overlay(plan)
+            # 执行post-overlay脚本
+            for script_path in args.post_script:
+                session.run_script(script_path, "post-overlay")
+            for action in args.post_action or []:
+                session.run_action(action, "post-overlay")
+    except SessionError as e:
+        c_info("process terminated")
+        return e.return_code
+
+    # 输出压缩镜像/sparse镜像
+    if args.output:
+        session.write_output(
+            get_output_path(args.output, rootfs),
+            fmt=args.output_format,
+            level=args.compress_level,
+        )
+
+    # 生成bmap文件
+    if args.bmap:
+        session.write_bmap()
+
+    # 只在需要资源报告时输出各阶段的资源占用
+    if args.resource_report:
+        c_table(
+            ["Phase", "Wall", "CPU", "Peak RSS (cumulative)", "I/O"],
+            [
+                [name, *format_usage_columns(usage)]
+                for name, usage in session.phase_usages()
+            ],
+            title=f"Resource Usage - {rootfs}",
+        )
+    return 0
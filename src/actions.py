@@ -0,0 +1,104 @@
+import shutil
+from pathlib import Path
+
+from ldcache import generate_ld_so_cache
+from utils import c_error, c_exception_info, c_info, c_warning, run_command
+
+# 内置的 rootfs 维护操作，直接在宿主机上针对 $ROOTFS 执行，替代在 qemu 仿真环境中运行对应的工具
+
+
+def _skipped(message):
+    c_warning(message)
+    return None
+
+
+def _run_host_tool(tool, command):
+    if not shutil.which(tool):
+        c_error(f"`{tool}` not found on the host")
+        return -1, None, None, FileNotFoundError(f"`{tool}` not found on the host")
+    return run_command(command)
+
+
+def action_ldconfig(mount_point):
+    """在宿主机上生成 /etc/ld.so.cache 并创建缺失的 SONAME 链接（ld.so.cache 格式由 Python 直接生成）"""
+    try:
+        generate_ld_so_cache(mount_point)
+    except Exception as e:
+        c_exception_info(e)
+        return -1, None, None, e
+    return 0, None, None, None
+
+
+def action_depmod(mount_point):
+    """使用宿主机的 depmod -b 为 $ROOTFS 中的每个内核版本生成模块依赖"""
+    # usrmerge 的镜像中两个目录相同，按内核版本去重
+    kernel_versions = []
+    for modules_dir in ("lib/modules", "usr/lib/modules"):
+        modules_dir = Path(mount_point) / modules_dir
+        if not modules_dir.is_dir():
+            continue
+        for kernel_dir in sorted(modules_dir.iterdir()):
+            if kernel_dir.is_dir() and kernel_dir.name not in kernel_versions:
+                kernel_versions.append(kernel_dir.name)
+    if not kernel_versions:
+        return _skipped("no kernel modules found in $ROOTFS, depmod skipped")
+    result = None
+    for kernel_version in kernel_versions:
+        result = _run_host_tool(
+            "depmod", ["depmod", "-b", Path(mount_point).as_posix(), kernel_version]
+        )
+        if result[0] != 0 or result[3] is not None:
+            return result
+    return result
+
+
+def action_glib_compile_schemas(mount_point):
+    """使用宿主机的 glib-compile-schemas 编译 $ROOTFS 中的 GSettings schema（输出与架构无关）"""
+    schemas_dir = Path(mount_point) / "usr/share/glib-2.0/schemas"
+    if not schemas_dir.is_dir():
+        return _skipped(
+            "no glib schemas found in $ROOTFS, glib-compile-schemas skipped"
+        )
+    return _run_host_tool(
+        "glib-compile-schemas", ["glib-compile-schemas", schemas_dir.as_posix()]
+    )
+
+
+def action_fc_cache(mount_point):
+    """
+    使用宿主机的 fc-cache --sysroot 生成 $ROOTFS 中的字体缓存
+
+    缓存文件名包含字长与字节序，目标架构与宿主机不同时目标系统会忽略这些缓存并在运行时重新生成
+    """
+    if not (Path(mount_point) / "etc/fonts/fonts.conf").is_file():
+        return _skipped("fontconfig not found in $ROOTFS, fc-cache skipped")
+    return _run_host_tool(
+        "fc-cache", ["fc-cache", "-f", "--sysroot", Path(mount_point).as_posix()]
+    )
+
+
+def action_update_mime_database(mount_point):
+    """使用宿主机的 update-mime-database 更新 $ROOTFS 中的 MIME 数据库"""
+    mime_dir = Path(mount_point) / "usr/share/mime"
+    if not (mime_dir / "packages").is_dir():
+        return _skipped(
+            "no mime packages found in $ROOTFS, update-mime-database skipped"
+        )
+    return _run_host_tool(
+        "update-mime-database", ["update-mime-database", mime_dir.as_posix()]
+    )
+
+
+ACTIONS = {
+    "ldconfig": action_ldconfig,
+    "depmod": action_depmod,
+    "glib-compile-schemas": action_glib_compile_schemas,
+    "fc-cache": action_fc_cache,
+    "update-mime-database": action_update_mime_database,
+}
+
+
+def run_action(mount_point, name):
+    """执行内置操作，返回值与 execute_script 相同"""
+    c_info(f"running host-native action `{name}` against $ROOTFS...")
+    return ACTIONS[name](mount_point)
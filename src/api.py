@@ -0,0 +1,438 @@
+from __future__ import annotations
+
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable, Iterable, NamedTuple, Union
+
+from actions import ACTIONS, run_action
+from bmap import generate_bmap, get_bmap_path
+from helpers import cleanup_mount_point
+from metrics import inc_counter
+from mount import (
+    is_rootfs_image_mounted,
+    mount_rootfs_image,
+    validate_rootfs_image,
+    wait_for_image_release,
+)
+from output import guess_output_format, write_output_image
+from overlay import (
+    OverlayPlan,
+    apply_overlay,
+    apply_remove,
+    build_overlay_plan,
+    compile_remove_list,
+)
+from partition import PartitionNotFoundError, RootfsImage, resolve_rootfs
+from resources import ResourceUsage, get_phase_usages, measure_phase, set_usage_context
+from scripts import ChrootSession, check_script_result, execute_script
+from snapshot import ImageSnapshot
+from stepcache import StepCache, hash_image, hash_step, scan_rootfs_state
+from utils import c_error, c_file_tree, c_info, c_success, c_warning
+
+# 可在其他 Python 程序中直接使用的接口：Session 在当前进程中完成一个镜像的挂载、删除、overlay、脚本、
+# 内置操作与输出，每个操作返回结构化的结果。overlay/mount 子命令只是在它之上的参数处理与输出
+
+# 类型别名在导入时求值，使用 Union 以兼容 Python 3.10 之前的版本
+PathLike = Union[str, os.PathLike]
+
+
+class SessionError(RuntimeError):
+    """会话中的操作无法进行（镜像无效、挂载失败、会话状态不正确等），return_code 为命令行的退出码"""
+
+    def __init__(self, message: str, return_code: int = 1) -> None:
+        super().__init__(message)
+        self.return_code = return_code
+
+
+class MountResult(NamedTuple):
+    image: str
+    mount_point: Path
+    offset: int
+    size: int
+    partition: int | None
+
+
+class RemoveResult(NamedTuple):
+    removed: list[str]
+    missing: list[str]
+    failed: list[tuple[str, str]]
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+
+class OverlayResult(NamedTuple):
+    overlay_dir: Path | None
+    copied: int
+    failed: list[tuple[str, str]]
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+
+class ScriptResult(NamedTuple):
+    """脚本或内置操作的执行结果，return_code 为 None 表示被跳过（或 cached 为 True 时从步骤缓存重放）"""
+
+    name: str
+    return_code: int | None
+    stdout: str | None
+    stderr: str | None
+    error: str | None
+    cached: bool
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.return_code in (0, None)
+
+
+def _script_result(name: str, result: tuple | None, cached: bool) -> ScriptResult:
+    if result is None:
+        return ScriptResult(name, None, None, None, None, cached)
+    return_code, stdout, stderr, exc = result
+    return ScriptResult(
+        name, return_code, stdout, stderr, None if exc is None else str(exc), cached
+    )
+
+
+class Session:
+    """
+    对一个 rootfs 镜像的处理会话
+
+    mount() 挂载镜像后可以依次调用 remove()/run_script()/run_action()/overlay()/show_tree()，
+    所有脚本共享同一个 chroot 环境；close()（或退出 with 块）时清理 chroot 环境、卸载镜像，
+    启用 snapshot 时在执行失败后回滚镜像。write_output()/write_bmap() 在关闭会话后调用。
+    启用 step_cache 时各步骤的缓存键从镜像内容摘要开始按调用顺序链式计算
+    """
+
+    def __init__(
+        self,
+        image: PathLike,
+        *,
+        qemu_bin: str | None = None,
+        unshare: bool = False,
+        snapshot: bool = False,
+        step_cache: StepCache | None = None,
+        stream: bool = False,
+        script_timeout: float | None = None,
+        jobs: int | None = None,
+    ) -> None:
+        self.spec = str(image)
+        self.qemu_bin = qemu_bin or ""
+        self.unshare = unshare
+        self.snapshot = snapshot
+        self.step_cache = step_cache
+        self.stream = stream
+        self.script_timeout = script_timeout
+        self.jobs = jobs
+        self.image: RootfsImage | None = None
+        self.mount_point: Path | None = None
+        self.closed = False
+        self.released = True
+        self._owns_mount_point = False
+        self._chroot: ChrootSession | None = None
+        self._snapshot: ImageSnapshot | None = None
+        self._cache_key: str | None = None
+
+    def __enter__(self) -> "Session":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close(succeeded=exc_type is None)
+
+    @property
+    def mounted(self) -> bool:
+        return self.mount_point is not None and not self.closed
+
+    def _resolve(self) -> RootfsImage:
+        if self.image is None:
+            try:
+                self.image = resolve_rootfs(self.spec)
+            except (OSError, PartitionNotFoundError) as e:
+                c_error(str(e))
+                raise SessionError(str(e)) from e
+        return self.image
+
+    def _require_mounted(self) -> Path:
+        if not self.mounted:
+            raise SessionError(f"rootfs image is not mounted: {self.spec}")
+        return self.mount_point
+
+    def mount(self, mount_point: PathLike | None = None) -> MountResult:
+        """
+        校验并挂载镜像，未指定 mount_point 时挂载到临时目录（关闭会话时删除）
+
+        启用 step_cache 时先计算镜像内容摘要，启用 snapshot 时在挂载前创建快照
+        """
+        if self.closed:
+            raise SessionError("session already closed")
+        if self.mount_point is not None:
+            raise SessionError(f"rootfs image already mounted at {self.mount_point}")
+        set_usage_context(image=self.spec)
+        image = self._resolve()
+        # 分区镜像通过 offset/sizelimit 原地操作，不需要提取
+        sizelimit = image.size if image.partition else None
+
+        c_info("validating rootfs image file...")
+        with measure_phase("validate"):
+            valid = validate_rootfs_image(image.path, offset=image.offset)
+        if not valid:
+            inc_counter("errors", operation="validate")
+            c_error(f"{self.spec} is not a valid rootfs image file")
+            raise SessionError(f"{self.spec} is not a valid rootfs image file")
+        c_success(f"{self.spec} validated")
+
+        if self.step_cache is not None:
+            c_info("computing rootfs image digest for step cache...")
+            self._cache_key = hash_image(
+                image.path, offset=image.offset, size=image.size, jobs=self.jobs
+            )
+            c_info(f"rootfs image digest: {self._cache_key[:12]}")
+
+        if self.snapshot:
+            c_info("taking snapshot of rootfs image...")
+            self._snapshot = ImageSnapshot(
+                image.path, offset=image.offset, size=sizelimit
+            ).take()
+
+        if mount_point is None:
+            c_info("create temporary mount point...")
+            mount_point = tempfile.mkdtemp(prefix="postoverlay_")
+            self._owns_mount_point = True
+            c_info(
+                f"mount point created at: {mount_point}, rootfs image will be mounted here"
+            )
+        self.mount_point = Path(mount_point)
+
+        c_info("start to mount rootfs image...")
+        with measure_phase("mount"):
+            mount_rootfs_image(
+                image.path, self.mount_point, offset=image.offset, sizelimit=sizelimit
+            )
+        if not is_rootfs_image_mounted(self.mount_point):
+            c_info("failed to mount rootfs image")
+            raise SessionError("failed to mount rootfs image", return_code=-1)
+        c_info(f"rootfs image mounted")
+        c_info(f"$ROOTFS = {self.mount_point.as_posix()}")
+
+        self._chroot = ChrootSession(
+            self.mount_point, qemu_bin=self.qemu_bin, namespace=self.unshare
+        )
+        return MountResult(
+            image=self.spec,
+            mount_point=self.mount_point,
+            offset=image.offset,
+            size=image.size,
+            partition=image.partition.number if image.partition else None,
+        )
+
+    def _advance_step_key(self, definition: dict) -> None:
+        """不缓存的步骤（删除、overlay）只参与缓存键的计算"""
+        if self.step_cache is not None:
+            self._cache_key = hash_step(self._cache_key, definition)
+
+    def _run_step(
+        self,
+        name: str,
+        definition: dict,
+        run: Callable[[], tuple | None],
+        paths=(),
+        prepare: Callable[[], object] | None = None,
+    ) -> tuple[tuple | None, bool]:
+        """
+        执行一个可缓存的步骤，返回 (执行结果, 是否从缓存重放)
+
+        未启用步骤缓存时直接执行；命中缓存时重放变更；执行成功时保存步骤产生的变更。
+        prepare 在未命中缓存、记录执行前的状态之前调用（如准备 chroot 环境），
+        其对 $ROOTFS 的修改（复制的 qemu 等）不计入步骤的变更
+        """
+        if self.step_cache is None:
+            return run(), False
+        self._cache_key = hash_step(self._cache_key, definition, paths)
+        if self.step_cache.replay(self._cache_key, self.mount_point, name):
+            return None, True
+        if prepare is not None:
+            prepare()
+        before = scan_rootfs_state(self.mount_point)
+        result = run()
+        if result is None or (result[3] is None and result[0] == 0):
+            self.step_cache.store(self._cache_key, self.mount_point, before, name)
+        return result, False
+
+    def show_tree(
+        self,
+        depth: int = 1,
+        limit: int | None = None,
+        tree_format: str = "text",
+        output: PathLike | None = None,
+    ) -> None:
+        """显示（或写入 output）挂载点的目录树"""
+        mount_point = self._require_mounted()
+        kwargs = {} if limit is None else {"limit": limit}
+        c_file_tree(
+            mount_point,
+            depth=max(depth or 1, 1),
+            title="rootfs/",
+            tree_format=tree_format,
+            output=output,
+            **kwargs,
+        )
+
+    def remove(self, paths: Iterable[str]) -> RemoveResult:
+        """删除 rootfs 中的文件/目录（路径相对于 rootfs 根目录）"""
+        mount_point = self._require_mounted()
+        paths = compile_remove_list(paths)
+        removed, missing, failed = [], [], []
+        if paths:
+            c_info("start to apply remove operations...")
+            c_info(f"{len(paths)} file(s) about to be removed...")
+            with measure_phase("remove"):
+                removed, missing, failed = apply_remove(mount_point, paths)
+        self._advance_step_key({"step": "remove", "remove": paths})
+        return RemoveResult(removed, missing, failed)
+
+    def overlay(self, overlay: PathLike | OverlayPlan | None) -> OverlayResult:
+        """将 overlay 目录复制到 rootfs，传入 OverlayPlan 时复用已扫描的结果（不使用其中的删除列表）"""
+        mount_point = self._require_mounted()
+        plan = (
+            overlay if isinstance(overlay, OverlayPlan) else build_overlay_plan(overlay)
+        )
+        copied, failed = 0, []
+        if plan.overlay_dir:
+            c_info("start to apply overlay operations...")
+            with measure_phase("overlay"):
+                copied, failed = apply_overlay(
+                    mount_point, plan.overlay_dir, entries=plan.entries
+                )
+        self._advance_step_key({"step": "overlay", "digest": plan.digest})
+        return OverlayResult(plan.overlay_dir, copied, failed)
+
+    def run_script(self, script: PathLike, stage: str = "pre-overlay") -> ScriptResult:
+        """
+        执行脚本（或 run-parts 风格的脚本目录），指定 qemu_bin 时在 chroot 环境中执行
+
+        启用 snapshot 时脚本失败会抛出 ScriptExecutionError（关闭会话时回滚镜像），否则只返回失败的结果
+        """
+        mount_point = self._require_mounted()
+        name = f"{stage} script {script}"
+        c_info(f"start to execute {stage} script: {script}...")
+        with measure_phase(name):
+            result, cached = self._run_step(
+                name,
+                {"step": "script", "qemu_bin": self.qemu_bin},
+                lambda: execute_script(
+                    mount_point=mount_point,
+                    script_path=script,
+                    qemu_bin=self.qemu_bin,
+                    session=self._chroot,
+                    stream=self.stream,
+                    timeout=self.script_timeout,
+                    jobs=self.jobs,
+                ),
+                paths=[script],
+                prepare=self._chroot.open if self.qemu_bin else None,
+            )
+        check_script_result(
+            result, f"{stage} script", raise_error=self._snapshot is not None
+        )
+        return _script_result(name, result, cached)
+
+    def run_action(self, action: str, stage: str = "post-overlay") -> ScriptResult:
+        """使用宿主机上的工具对 rootfs 执行内置操作（ldconfig、depmod 等）"""
+        mount_point = self._require_mounted()
+        if action not in ACTIONS:
+            raise SessionError(f"unknown action: {action}")
+        name = f"{stage} action `{action}`"
+        with measure_phase(name):
+            result, cached = self._run_step(
+                name,
+                {"step": "action", "action": action},
+                lambda: run_action(mount_point, action),
+            )
+        check_script_result(result, name, raise_error=self._snapshot is not None)
+        return _script_result(name, result, cached)
+
+    def close(self, succeeded: bool = True) -> None:
+        """清理 chroot 环境并卸载镜像，启用 snapshot 时根据 succeeded 丢弃快照或回滚镜像；多次调用时只执行一次"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self._chroot is not None:
+                self._chroot.close()
+        finally:
+            if self.mount_point is not None:
+                with measure_phase("unmount"):
+                    cleanup_mount_point(
+                        self.mount_point, remove_dir=self._owns_mount_point
+                    )
+                    # 镜像被完全释放后再进行回滚或输出
+                    self.released = wait_for_image_release(
+                        self.image.path,
+                        offset=self.image.offset,
+                        sizelimit=self.image.size if self.image.partition else None,
+                    )
+            if self._snapshot is not None:
+                if not self.released:
+                    # 设备仍在回写时回滚的结果会被之后的写入破坏，保留快照由用户手动恢复
+                    c_warning(
+                        f"rootfs image is still in use, rollback skipped, "
+                        f"snapshot kept at {self._snapshot.snapshot_path}"
+                    )
+                elif succeeded:
+                    self._snapshot.discard()
+                else:
+                    self._snapshot.rollback()
+
+    def _require_released(self) -> RootfsImage:
+        if self.mounted:
+            raise SessionError(
+                "the session must be closed before writing the rootfs image"
+            )
+        if not self.released:
+            raise SessionError(f"rootfs image is still in use: {self.spec}")
+        return self._resolve()
+
+    def write_output(
+        self, path: PathLike, fmt: str | None = None, level: int | None = None
+    ) -> Path:
+        """将镜像（分区镜像时为分区）写出为压缩流（gzip/xz/zstd）或 android sparse 镜像"""
+        image = self._require_released()
+        path = Path(path)
+        fmt = fmt or guess_output_format(path)
+        if not fmt:
+            raise SessionError(f"cannot determine output format of {path}")
+        kwargs = {} if level is None else {"level": level}
+        c_info("start to write output image...")
+        with measure_phase("output"):
+            write_output_image(
+                image.path,
+                path,
+                fmt=fmt,
+                jobs=self.jobs,
+                offset=image.offset,
+                size=image.size,
+                **kwargs,
+            )
+        return path
+
+    def write_bmap(self) -> Path:
+        """在镜像旁生成 bmaptool 兼容的 bmap 文件，返回其路径"""
+        image = self._require_released()
+        bmap_path = get_bmap_path(image.path, image.partition)
+        c_info("start to generate bmap file...")
+        with measure_phase("bmap"):
+            generate_bmap(
+                image.path,
+                bmap_path=bmap_path,
+                jobs=self.jobs,
+                offset=image.offset,
+                size=image.size,
+            )
+        return bmap_path
+
+    def phase_usages(self) -> list[tuple[str, ResourceUsage]]:
+        """本会话各处理阶段的资源占用"""
+        return get_phase_usages(self.spec)
@@ -0,0 +1,138 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from image import get_image_size, iter_chunks, iter_data_ranges, read_image_range
+from utils import c_info, c_success
+
+BMAP_VERSION = "2.0"
+BMAP_BLOCK_SIZE = 4096
+# 单个区间的最大长度，过长的数据区间会被拆分以便并行计算校验和
+BMAP_MAX_RANGE_SIZE = 64 * 1024 * 1024
+_HASH_READ_SIZE = 4 * 1024 * 1024
+_ZERO_CHECKSUM = "0" * 64
+
+
+def get_bmap_path(image_path, partition=None):
+    """获取镜像文件（或其中的分区）对应的 bmap 文件路径"""
+    image_path = Path(image_path)
+    if partition is not None:
+        return image_path.with_name(f"{image_path.name}.part{partition.number}.bmap")
+    return image_path.with_name(image_path.name + ".bmap")
+
+
+def iter_mapped_block_ranges(
+    image_path, block_size=BMAP_BLOCK_SIZE, offset=0, size=None
+):
+    """
+    枚举镜像（或其中 offset 起 size 字节的区间）中已映射的块区间
+
+    返回相对于 offset 的 (first_block, last_block)
+    """
+    image_size = get_image_size(image_path) - offset if size is None else size
+    blocks_count = -(-image_size // block_size)
+    max_blocks = max(BMAP_MAX_RANGE_SIZE // block_size, 1)
+    last = -1
+    for start, length in iter_data_ranges(image_path, offset, offset + image_size):
+        start -= offset
+        first_block = max(start // block_size, last + 1)
+        last_block = min((start + length - 1) // block_size, blocks_count - 1)
+        if last_block < first_block:
+            continue
+        for first, count in iter_chunks(first_block, last_block + 1, max_blocks):
+            yield first, first + count - 1
+        last = last_block
+
+
+def _range_checksum(image_path, first_block, last_block, block_size, offset, end):
+    """计算块区间的 SHA-256 校验和，end 之后的数据不参与计算"""
+    digest = hashlib.sha256()
+    range_end = min(offset + (last_block + 1) * block_size, end)
+    for chunk_offset, length in iter_chunks(
+        offset + first_block * block_size, range_end, _HASH_READ_SIZE
+    ):
+        digest.update(read_image_range(image_path, chunk_offset, length))
+    return digest.hexdigest()
+
+
+def _format_range(first_block, last_block):
+    if first_block == last_block:
+        return f"{first_block}"
+    return f"{first_block}-{last_block}"
+
+
+def generate_bmap(
+    image_path,
+    bmap_path=None,
+    jobs=None,
+    block_size=BMAP_BLOCK_SIZE,
+    offset=0,
+    size=None,
+):
+    """
+    为镜像文件（或其中 offset 起 size 字节的区间）生成 bmaptool 兼容的 bmap 文件
+
+    数据区间通过 SEEK_DATA/SEEK_HOLE 获取，各区间的 SHA-256 校验和在进程池中并行计算
+    """
+    image_path = Path(image_path)
+    bmap_path = Path(bmap_path) if bmap_path else get_bmap_path(image_path)
+    jobs = jobs or os.cpu_count() or 1
+    image_size = get_image_size(image_path) - offset if size is None else size
+    blocks_count = -(-image_size // block_size)
+    ranges = list(iter_mapped_block_ranges(image_path, block_size, offset, image_size))
+    mapped_blocks = sum(last - first + 1 for first, last in ranges)
+
+    c_info(
+        f"generating bmap for {image_path} ({len(ranges)} range(s), "
+        f"{mapped_blocks}/{blocks_count} block(s) mapped, {jobs} worker(s))"
+    )
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(
+                _range_checksum,
+                image_path,
+                first,
+                last,
+                block_size,
+                offset,
+                offset + image_size,
+            )
+            for first, last in ranges
+        ]
+        checksums = [future.result() for future in futures]
+
+    lines = [
+        '<?xml version="1.0" ?>',
+        "<!-- This file contains the block map for an image file, which is basically",
+        "     a list of useful (mapped) block numbers in the image file. In other words,",
+        "     it lists only those blocks which contain data (boot sector, partition",
+        "     table, file-system metadata, files, directories, extents, etc). These",
+        "     blocks have to be copied to the target device. The other blocks do not",
+        "     contain any useful data and do not have to be copied to the target",
+        "     device. Generated by postoverlay. -->",
+        f'<bmap version="{BMAP_VERSION}">',
+        f"    <ImageSize> {image_size} </ImageSize>",
+        f"    <BlockSize> {block_size} </BlockSize>",
+        f"    <BlocksCount> {blocks_count} </BlocksCount>",
+        f"    <MappedBlocksCount> {mapped_blocks} </MappedBlocksCount>",
+        "    <ChecksumType> sha256 </ChecksumType>",
+        f"    <BmapFileChecksum> {_ZERO_CHECKSUM} </BmapFileChecksum>",
+        "    <BlockMap>",
+    ]
+    for (first, last), checksum in zip(ranges, checksums):
+        lines.append(
+            f'        <Range chksum="{checksum}"> {_format_range(first, last)} </Range>'
+        )
+    lines.extend(["    </BlockMap>", "</bmap>", ""])
+    content = "\n".join(lines)
+
+    # bmap 文件自身的校验和在校验和字段全为 0 的情况下计算
+    file_checksum = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    content = content.replace(
+        f"<BmapFileChecksum> {_ZERO_CHECKSUM} </BmapFileChecksum>",
+        f"<BmapFileChecksum> {file_checksum} </BmapFileChecksum>",
+    )
+    bmap_path.write_text(content, encoding="utf-8")
+    c_success(f"bmap file written: {bmap_path}")
+    return bmap_path
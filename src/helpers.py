@@ -2,6 +2,9 @@ from pathlib import Path
 
 from qemu import is_qemu_user_static_installed
 from mount import is_rootfs_image_mounted, unmount_rootfs_image
+from output import COMPRESS_LEVEL_RANGES, guess_output_format, is_zstd_available
+from partition import PartitionNotFoundError, find_partition, split_rootfs_spec
+from scripts import load_script_dir
 from utils import c_error, c_info, c_warning, c_exception_info
 
 
@@ -10,10 +13,43 @@ class InvalidArgumentError(ValueError):
 
 
 def check_rootfs_file(args):
-    if not args.rootfs or (not Path(args.rootfs).is_file()):
+    """检查 rootfs 参数，返回 (镜像文件的真实路径, 分区 offset)，非分区镜像的 offset 为 None"""
+    image_path, selector = split_rootfs_spec(args.rootfs or "")
+    if not args.rootfs or (not image_path.is_file()):
         c_error(f"rootfs image not found: {args.rootfs}")
         c_info("process terminated")
         raise InvalidArgumentError("rootfs image not found")
+    if selector is not None:
+        try:
+            partition = find_partition(image_path, selector)
+        except PartitionNotFoundError as e:
+            c_error(str(e))
+            c_info("process terminated")
+            raise InvalidArgumentError("rootfs partition not found")
+        c_info(
+            f"rootfs partition {partition.number} found in {image_path}: "
+            f"offset={partition.offset}, size={partition.size}"
+        )
+        return image_path.resolve(), partition.offset
+    return image_path.resolve(), None
+
+
+def check_rootfs_files(args):
+    rootfs_files = args.rootfs
+    if not isinstance(rootfs_files, (list, tuple)):
+        rootfs_files = [rootfs_files]
+    # 同一个镜像（分区）在一次批量处理中出现多次时，多个会话会同时挂载并修改同一份数据
+    seen = {}
+    for rootfs in rootfs_files:
+        args.rootfs = rootfs
+        image_path, offset = check_rootfs_file(args)
+        for other_offset, other in seen.get(image_path, []):
+            if offset is None or other_offset is None or offset == other_offset:
+                c_error(f"rootfs images overlap: {other} and {rootfs}")
+                c_info("process terminated")
+                raise InvalidArgumentError("duplicate rootfs image")
+        seen.setdefault(image_path, []).append((offset, rootfs))
+    args.rootfs = list(rootfs_files)
 
 
 def check_overlay_dir(args):
@@ -40,22 +76,34 @@ def check_remove_list(args):
             raise InvalidArgumentError("remove list file not found")
 
 
-def check_pre_script_file(args):
-    if args.pre_script:
-        args.pre_script = Path(args.pre_script)
-        if not args.pre_script.is_file():
-            c_error(f"pre-overlay script file not found: {args.pre_script}")
+def _check_script_files(script_files, name):
+    checked = []
+    for script_file in script_files or []:
+        script_file = Path(script_file)
+        if script_file.is_dir():
+            # 脚本目录在执行前检查依赖关系
+            try:
+                load_script_dir(script_file)
+            except (OSError, ValueError) as e:
+                c_error(f"invalid {name} script directory {script_file}: {e}")
+                c_info("process terminated")
+                raise InvalidArgumentError(f"invalid {name} script directory")
+            checked.append(script_file)
+            continue
+        if not script_file.is_file():
+            c_error(f"{name} script file not found: {script_file}")
             c_info("process terminated")
-            raise InvalidArgumentError("pre-overlay script file not found")
+            raise InvalidArgumentError(f"{name} script file not found")
+        checked.append(script_file)
+    return checked
+
+
+def check_pre_script_file(args):
+    args.pre_script = _check_script_files(args.pre_script, "pre-overlay")
 
 
 def check_post_script_file(args):
-    if args.post_script:
-        args.post_script = Path(args.post_script)
-        if not args.post_script.is_file():
-            c_error(f"post-overlay script file not found: {args.post_script}")
-            c_info("process terminated")
-            raise InvalidArgumentError("post-overlay script file not found")
+    args.post_script = _check_script_files(args.post_script, "post-overlay")
 
 
 def check_qemu_bin(args):
@@ -69,6 +117,71 @@ def check_qemu_bin(args):
             raise InvalidArgumentError("qemu-user-static not installed")
 
 
+def check_output(args):
+    args.output = (args.output or "").strip()
+    if not args.output:
+        args.output = None
+        return
+    if (
+        isinstance(args.rootfs, list)
+        and len(args.rootfs) > 1
+        and "{name}" not in args.output
+    ):
+        c_error(
+            "output file name must contain `{name}` when processing multiple rootfs images"
+        )
+        c_info("process terminated")
+        raise InvalidArgumentError("ambiguous output file name")
+    args.output = Path(args.output)
+    if not args.output.parent.is_dir():
+        c_error(f"output directory not found: {args.output.parent}")
+        c_info("process terminated")
+        raise InvalidArgumentError("output directory not found")
+    args.output_format = args.output_format or guess_output_format(args.output)
+    if not args.output_format:
+        c_error(f"cannot determine output format of {args.output}")
+        c_error("Please specify it with --output-format.")
+        c_info("process terminated")
+        raise InvalidArgumentError("output format not specified")
+    if args.output_format == "zstd" and not is_zstd_available():
+        c_error("zstd compression requires the `zstandard` module or `zstd` command")
+        c_info("process terminated")
+        raise InvalidArgumentError("zstd not available")
+    level_range = COMPRESS_LEVEL_RANGES.get(args.output_format)
+    if level_range and not level_range[0] <= args.compress_level <= level_range[1]:
+        c_error(
+            f"invalid compression level for {args.output_format}: {args.compress_level} "
+            f"(expected {level_range[0]}-{level_range[1]})"
+        )
+        c_info("process terminated")
+        raise InvalidArgumentError("invalid compression level")
+
+
+def check_tree_output(args):
+    args.tree_output = (args.tree_output or "").strip() or None
+    if args.tree_output is None:
+        # 日志同样输出到 stdout，json 目录树必须写入文件才能得到有效的 json
+        if args.show_rootfs_tree and args.tree_format == "json":
+            c_error("--tree-output must be specified for --tree-format json")
+            c_info("process terminated")
+            raise InvalidArgumentError("tree output not specified")
+        return
+    if (
+        isinstance(args.rootfs, list)
+        and len(args.rootfs) > 1
+        and "{name}" not in args.tree_output
+    ):
+        c_error(
+            "tree output file name must contain `{name}` when processing multiple rootfs images"
+        )
+        c_info("process terminated")
+        raise InvalidArgumentError("ambiguous tree output file name")
+    if not Path(args.tree_output).parent.is_dir():
+        c_error(f"tree output directory not found: {Path(args.tree_output).parent}")
+        c_info("process terminated")
+        raise InvalidArgumentError("tree output directory not found")
+
+
 def check_mount_point(args):
     args.mount_point = (args.mount_point or "").strip()
     if not args.mount_point:
@@ -0,0 +1,107 @@
+import errno
+import mmap
+import os
+import struct
+from pathlib import Path
+
+EXT_SUPERBLOCK_OFFSET = 1024
+EXT_SUPERBLOCK_MAGIC = 0xEF53
+
+
+def get_image_size(image_path):
+    """获取镜像文件大小（字节）"""
+    return os.stat(Path(image_path)).st_size
+
+
+def iter_data_ranges(image_path, start=0, end=None):
+    """
+    通过 SEEK_DATA/SEEK_HOLE 枚举镜像文件中包含数据的区间，跳过空洞
+
+    返回 (offset, length) 形式的区间，文件系统不支持时将整个区间视为数据
+    """
+    image_path = Path(image_path)
+    if end is None:
+        end = get_image_size(image_path)
+    if start >= end:
+        return
+
+    seek_data = getattr(os, "SEEK_DATA", None)
+    seek_hole = getattr(os, "SEEK_HOLE", None)
+    if seek_data is None or seek_hole is None:
+        yield start, end - start
+        return
+
+    fd = os.open(image_path, os.O_RDONLY)
+    try:
+        offset = start
+        while offset < end:
+            try:
+                data_start = os.lseek(fd, offset, seek_data)
+            except OSError as e:
+                # offset 之后不再有数据
+                if e.errno == errno.ENXIO:
+                    return
+                # 文件系统不支持 SEEK_DATA
+                yield offset, end - offset
+                return
+            if data_start >= end:
+                return
+            data_end = min(os.lseek(fd, data_start, seek_hole), end)
+            yield data_start, data_end - data_start
+            offset = data_end
+    finally:
+        os.close(fd)
+
+
+def iter_chunks(start, end, chunk_size):
+    """将 [start, end) 按 chunk_size 切分为 (offset, length) 区间"""
+    offset = start
+    while offset < end:
+        length = min(chunk_size, end - offset)
+        yield offset, length
+        offset += length
+
+
+def read_image_range(image_path, offset, length):
+    """通过 mmap 读取镜像文件中的指定区间，超出文件末尾的部分将被截断"""
+    with open(image_path, "rb") as f:
+        length = min(length, os.fstat(f.fileno()).st_size - offset)
+        if length <= 0:
+            return b""
+        aligned = offset - (offset % mmap.ALLOCATIONGRANULARITY)
+        delta = offset - aligned
+        with mmap.mmap(
+            f.fileno(), delta + length, access=mmap.ACCESS_READ, offset=aligned
+        ) as m:
+            return m[delta : delta + length]
+
+
+def read_ext_superblock(image_path, offset=0):
+    """
+    读取 offset 处 ext2/3/4 文件系统的超级块
+
+    返回包含块数量、块大小、卷标与特性标志的字典，不是 ext 文件系统时返回 None
+    """
+    sb = read_image_range(image_path, offset + EXT_SUPERBLOCK_OFFSET, 1024)
+    if len(sb) < 1024:
+        return None
+    (magic,) = struct.unpack_from("<H", sb, 0x38)
+    if magic != EXT_SUPERBLOCK_MAGIC:
+        return None
+    (blocks_count_lo,) = struct.unpack_from("<I", sb, 0x04)
+    (log_block_size,) = struct.unpack_from("<I", sb, 0x18)
+    feature_compat, feature_incompat, feature_ro_compat = struct.unpack_from(
+        "<III", sb, 0x5C
+    )
+    (blocks_count_hi,) = struct.unpack_from("<I", sb, 0x150)
+    # 64bit 特性开启时块数量的高 32 位才有效
+    if not feature_incompat & 0x80:
+        blocks_count_hi = 0
+    return {
+        "blocks_count": blocks_count_hi << 32 | blocks_count_lo,
+        "block_size": 1024 << log_block_size,
+        "volume_name": sb[0x78:0x88].split(b"\0")[0].decode("utf-8", "replace"),
+        "feature_compat": feature_compat,
+        "feature_incompat": feature_incompat,
+        "feature_ro_compat": feature_ro_compat,
+    }
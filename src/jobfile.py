@@ -0,0 +1,306 @@
+import os
+from collections import namedtuple
+from pathlib import Path
+
+from actions import ACTIONS
+from mount import get_batch_workers
+from output import (
+    COMPRESS_LEVEL_RANGES,
+    OUTPUT_FORMATS,
+    get_output_path,
+    guess_output_format,
+    is_zstd_available,
+)
+from overlay import parse_remove_list
+from partition import split_rootfs_spec
+from qemu import is_qemu_user_static_installed
+from scripts import load_script_dir
+from stepcache import DEFAULT_STEP_CACHE_SIZE
+
+# TOML 任务文件：描述多个镜像各自的 overlay、删除列表、脚本、内置操作、挂载配置（profile）与输出，
+# 由 job 子命令生成统一的执行计划。文件中的相对路径相对于任务文件所在目录
+#
+#   jobs = 4
+#
+#   [profiles.arm64]
+#   qemu_bin = "qemu-aarch64-static"
+#   unshare = true
+#
+#   [defaults]
+#   profile = "arm64"
+#   overlays = ["overlays/common"]
+#   post_actions = ["ldconfig"]
+#
+#   [[images]]
+#   path = "board-a.img"
+#   overlays = ["overlays/common", "overlays/board-a"]
+#   output = "out/{name}.zst"
+#
+# 每个镜像的选项依次由 defaults、profile 与镜像本身的设置覆盖
+
+# 挂载与执行相关的选项，可以在 profile 中定义
+PROFILE_OPTIONS = {
+    "qemu_bin": str,
+    "unshare": bool,
+    "snapshot": bool,
+    "stream": bool,
+    "script_timeout": (int, float),
+    "step_cache": bool,
+    "step_cache_dir": str,
+    "step_cache_size": int,
+}
+IMAGE_OPTIONS = {
+    **PROFILE_OPTIONS,
+    "profile": str,
+    "overlays": list,
+    "remove": list,
+    "remove_list": str,
+    "pre_scripts": list,
+    "post_scripts": list,
+    "pre_actions": list,
+    "post_actions": list,
+    "output": str,
+    "output_format": str,
+    "compress_level": int,
+    "bmap": bool,
+}
+_PATH_OPTIONS = ("step_cache_dir", "remove_list", "output")
+_PATH_LIST_OPTIONS = ("overlays", "pre_scripts", "post_scripts")
+
+# 单个镜像的任务，options 为 api.Session 的参数
+ImageJob = namedtuple(
+    "ImageJob",
+    [
+        "image",
+        "profile",
+        "overlays",
+        "remove",
+        "pre_scripts",
+        "post_scripts",
+        "pre_actions",
+        "post_actions",
+        "output",
+        "output_format",
+        "compress_level",
+        "bmap",
+        "options",
+    ],
+)
+# 执行计划：overlays 为所有镜像用到的 overlay 目录（每个只扫描一次），
+# groups 为 jobs 的下标分组，同一组的镜像位于同一个镜像文件中，需要依次处理
+JobSchedule = namedtuple("JobSchedule", ["jobs", "overlays", "groups", "workers"])
+
+
+class JobFileError(ValueError):
+    pass
+
+
+def _check_options(table, allowed, where):
+    if not isinstance(table, dict):
+        raise JobFileError(f"{where} must be a table")
+    for key, value in table.items():
+        if key not in allowed:
+            raise JobFileError(f"unknown option `{key}` in {where}")
+        expected = allowed[key]
+        # 列表选项也可以写为单个字符串
+        if expected is list and isinstance(value, str):
+            continue
+        if isinstance(value, bool) and expected is not bool:
+            raise JobFileError(f"invalid value of `{key}` in {where}: {value!r}")
+        if not isinstance(value, expected):
+            raise JobFileError(f"invalid value of `{key}` in {where}: {value!r}")
+        if expected is list and not all(isinstance(item, str) for item in value):
+            raise JobFileError(f"`{key}` in {where} must be a list of strings")
+
+
+def _resolve_path(base_dir, path):
+    path = os.path.expanduser(path)
+    return path if os.path.isabs(path) else str(Path(base_dir) / path)
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+def _check_scripts(scripts, where):
+    for script in scripts:
+        script = Path(script)
+        if script.is_dir():
+            try:
+                load_script_dir(script)
+            except (OSError, ValueError) as e:
+                raise JobFileError(f"invalid script directory {script} in {where}: {e}")
+        elif not script.is_file():
+            raise JobFileError(f"script file not found in {where}: {script}")
+
+
+def _build_image_job(entry, defaults, profiles, base_dir, where):
+    _check_options(entry, {**IMAGE_OPTIONS, "path": str}, where)
+    if "path" not in entry:
+        raise JobFileError(f"`path` not specified in {where}")
+    profile_name = entry.get("profile", defaults.get("profile"))
+    if profile_name is not None and profile_name not in profiles:
+        raise JobFileError(f"unknown profile `{profile_name}` in {where}")
+    options = {**defaults, **profiles.get(profile_name, {}), **entry}
+
+    for key in _PATH_OPTIONS:
+        if options.get(key):
+            options[key] = _resolve_path(base_dir, options[key])
+    # qemu_bin 为命令名时在 PATH 中查找
+    if options.get("qemu_bin") and "/" in options["qemu_bin"]:
+        options["qemu_bin"] = _resolve_path(base_dir, options["qemu_bin"])
+    for key in _PATH_LIST_OPTIONS:
+        options[key] = [_resolve_path(base_dir, p) for p in _as_list(options.get(key))]
+
+    image = _resolve_path(base_dir, entry["path"])
+    image_path, _ = split_rootfs_spec(image)
+    if not image_path.is_file():
+        raise JobFileError(f"rootfs image not found in {where}: {image}")
+    if options.get("qemu_bin") and not is_qemu_user_static_installed(
+        options["qemu_bin"]
+    ):
+        raise JobFileError(
+            f"qemu-user-static binary not found in {where}: {options['qemu_bin']}"
+        )
+    for overlay_dir in options["overlays"]:
+        if not Path(overlay_dir).is_dir():
+            raise JobFileError(f"overlay directory not found in {where}: {overlay_dir}")
+    _check_scripts(options["pre_scripts"] + options["post_scripts"], where)
+    remove = _as_list(options.get("remove"))
+    if options.get("remove_list"):
+        if not Path(options["remove_list"]).is_file():
+            raise JobFileError(
+                f"remove list file not found in {where}: {options['remove_list']}"
+            )
+        remove += parse_remove_list(options["remove_list"])
+    actions = {
+        key: _as_list(options.get(key)) for key in ("pre_actions", "post_actions")
+    }
+    for name in actions["pre_actions"] + actions["post_actions"]:
+        if name not in ACTIONS:
+            raise JobFileError(f"unknown action `{name}` in {where}")
+
+    output = None
+    output_format = options.get("output_format")
+    if options.get("output"):
+        output = get_output_path(options["output"], image)
+        if not output.parent.is_dir():
+            raise JobFileError(
+                f"output directory not found in {where}: {output.parent}"
+            )
+        output_format = output_format or guess_output_format(output)
+        if output_format not in OUTPUT_FORMATS:
+            raise JobFileError(f"cannot determine output format of {output} in {where}")
+        if output_format == "zstd" and not is_zstd_available():
+            raise JobFileError(
+                "zstd compression requires the `zstandard` module or `zstd` command"
+            )
+        level_range = COMPRESS_LEVEL_RANGES.get(output_format)
+        compress_level = options.get("compress_level", 6)
+        if level_range and not level_range[0] <= compress_level <= level_range[1]:
+            raise JobFileError(
+                f"invalid compression level for {output_format} in {where}: {compress_level} "
+                f"(expected {level_range[0]}-{level_range[1]})"
+            )
+
+    step_cache = None
+    if options.get("step_cache"):
+        step_cache = (
+            options.get("step_cache_dir"),
+            options.get("step_cache_size", DEFAULT_STEP_CACHE_SIZE // (1024 * 1024)),
+        )
+    return ImageJob(
+        image=image,
+        profile=profile_name,
+        overlays=options["overlays"],
+        remove=remove,
+        pre_scripts=options["pre_scripts"],
+        post_scripts=options["post_scripts"],
+        pre_actions=actions["pre_actions"],
+        post_actions=actions["post_actions"],
+        output=output,
+        output_format=output_format,
+        compress_level=options.get("compress_level", 6),
+        bmap=options.get("bmap", False),
+        options={
+            "qemu_bin": options.get("qemu_bin"),
+            "unshare": options.get("unshare", False),
+            "snapshot": options.get("snapshot", False),
+            "stream": options.get("stream", False),
+            "script_timeout": options.get("script_timeout"),
+            # (缓存目录, 大小上限(MiB))，StepCache 在处理镜像的进程中创建
+            "step_cache": step_cache,
+        },
+    )
+
+
+def load_job_file(job_path):
+    """读取并校验 TOML 任务文件，返回 (ImageJob 列表, 并行处理的镜像数上限)，出错时抛出 JobFileError"""
+    try:
+        import tomllib
+    except ImportError:
+        # Python 3.11 之前没有 tomllib，使用接口相同的 tomli
+        try:
+            import tomli as tomllib
+        except ImportError:
+            raise JobFileError(
+                "job files require Python 3.11+ or the tomli package (pip install tomli)"
+            )
+
+    job_path = Path(job_path)
+    try:
+        with open(job_path, "rb") as f:
+            data = tomllib.load(f)
+    except OSError as e:
+        raise JobFileError(f"failed to read job file {job_path}: {e}")
+    except tomllib.TOMLDecodeError as e:
+        raise JobFileError(f"invalid job file {job_path}: {e}")
+
+    images = data.pop("images", None)
+    _check_options(data, {"jobs": int, "defaults": dict, "profiles": dict}, "job file")
+    defaults = data.get("defaults", {})
+    _check_options(defaults, IMAGE_OPTIONS, "[defaults]")
+    profiles = data.get("profiles", {})
+    for name, profile in profiles.items():
+        _check_options(profile, PROFILE_OPTIONS, f"[profiles.{name}]")
+    if not images or not isinstance(images, list):
+        raise JobFileError(f"no images specified in job file {job_path}")
+
+    base_dir = job_path.resolve().parent
+    jobs = [
+        _build_image_job(
+            entry, defaults, profiles, base_dir, f"[[images]] #{index + 1}"
+        )
+        for index, entry in enumerate(images)
+    ]
+    outputs = [job.output for job in jobs if job.output is not None]
+    if len(outputs) != len(set(outputs)):
+        raise JobFileError("several images are written to the same output file")
+    return jobs, data.get("jobs")
+
+
+def build_schedule(jobs, workers=None):
+    """
+    生成执行计划
+
+    每个镜像只挂载一次并依次执行其所有步骤；位于同一个镜像文件中的任务（如同一磁盘镜像的不同分区）
+    分为一组依次处理，不同的组并行处理；所有镜像共用的 overlay 目录只扫描一次
+    """
+    overlays = []
+    for job in jobs:
+        for overlay_dir in job.overlays:
+            if overlay_dir not in overlays:
+                overlays.append(overlay_dir)
+    groups = {}
+    for index, job in enumerate(jobs):
+        image_path, _ = split_rootfs_spec(job.image)
+        groups.setdefault(os.path.realpath(image_path), []).append(index)
+    groups = list(groups.values())
+    return JobSchedule(
+        jobs=jobs,
+        overlays=overlays,
+        groups=groups,
+        workers=get_batch_workers(workers, len(groups)),
+    )
@@ -0,0 +1,344 @@
+import glob
+import os
+import struct
+from pathlib import Path
+
+from utils import c_info, c_warning
+
+LD_SO_CONF = "etc/ld.so.conf"
+LD_SO_CACHE = "etc/ld.so.cache"
+# 与 ldconfig 一致：ld.so.conf 中的目录之后再扫描系统目录
+SYSTEM_LIBRARY_DIRS = ("/lib64", "/usr/lib64", "/lib", "/usr/lib")
+
+CACHE_MAGIC_NEW = b"glibc-ld.so.cache"
+CACHE_VERSION_NEW = b"1.1"
+CACHE_FLAGS_ENDIAN_LITTLE = 2
+CACHE_FLAGS_ENDIAN_BIG = 3
+_CACHE_HEADER = struct.Struct("=17s3sIIB3xI12x")
+_CACHE_ENTRY = struct.Struct("=iIIIQ")
+
+# sysdeps/generic/ldconfig.h
+FLAG_ELF_LIBC6 = 0x0003
+FLAG_X8664_LIB64 = 0x0300
+FLAG_S390_LIB64 = 0x0400
+FLAG_POWERPC_LIB64 = 0x0500
+FLAG_X8664_LIBX32 = 0x0800
+FLAG_ARM_LIBHF = 0x0900
+FLAG_AARCH64_LIB64 = 0x0A00
+FLAG_ARM_LIBSF = 0x0B00
+FLAG_RISCV_FLOAT_ABI_SOFT = 0x0F00
+FLAG_RISCV_FLOAT_ABI_DOUBLE = 0x1000
+FLAG_LARCH_FLOAT_ABI_SOFT = 0x1100
+FLAG_LARCH_FLOAT_ABI_DOUBLE = 0x1200
+
+EM_386 = 3
+EM_PPC64 = 21
+EM_S390 = 22
+EM_ARM = 40
+EM_X86_64 = 62
+EM_AARCH64 = 183
+EM_RISCV = 243
+EM_LOONGARCH = 258
+
+EF_ARM_ABI_FLOAT_SOFT = 0x200
+EF_ARM_ABI_FLOAT_HARD = 0x400
+EF_RISCV_FLOAT_ABI = 0x6
+EF_RISCV_FLOAT_ABI_DOUBLE = 0x4
+EF_LARCH_ABI_MODIFIER_MASK = 0x7
+EF_LARCH_ABI_DOUBLE_FLOAT = 0x3
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+DT_NULL = 0
+DT_STRTAB = 5
+DT_SONAME = 14
+
+
+def read_elf_soname(file_path):
+    """
+    读取 ELF 共享库的 SONAME 与 ldconfig 缓存标志
+
+    返回 (soname, flags, little_endian)，不是 ELF 共享库或没有 SONAME 时返回 None
+    """
+    try:
+        with open(file_path, "rb") as f:
+            ident = f.read(16)
+            if len(ident) < 16 or ident[:4] != b"\x7fELF":
+                return None
+            is_64 = ident[4] == 2
+            endian = "<" if ident[5] == 1 else ">"
+            header = f.read(48 if is_64 else 36)
+            if is_64:
+                (
+                    e_type,
+                    e_machine,
+                    _,
+                    _,
+                    e_phoff,
+                    _,
+                    e_flags,
+                    _,
+                    e_phentsize,
+                    e_phnum,
+                ) = struct.unpack(endian + "HHIQQQIHHH", header[:42])
+            else:
+                (
+                    e_type,
+                    e_machine,
+                    _,
+                    _,
+                    e_phoff,
+                    _,
+                    e_flags,
+                    _,
+                    e_phentsize,
+                    e_phnum,
+                ) = struct.unpack(endian + "HHIIIIIHHH", header[:30])
+            # ET_DYN
+            if e_type != 3:
+                return None
+
+            f.seek(e_phoff)
+            phdrs = f.read(e_phentsize * e_phnum)
+            loads = []
+            dynamic = None
+            for index in range(e_phnum):
+                phdr = phdrs[index * e_phentsize : (index + 1) * e_phentsize]
+                if is_64:
+                    p_type, _, p_offset, p_vaddr, _, p_filesz, _, _ = struct.unpack(
+                        endian + "IIQQQQQQ", phdr[:56]
+                    )
+                else:
+                    p_type, p_offset, p_vaddr, _, p_filesz, _, _, _ = struct.unpack(
+                        endian + "IIIIIIII", phdr[:32]
+                    )
+                if p_type == PT_LOAD:
+                    loads.append((p_vaddr, p_offset, p_filesz))
+                elif p_type == PT_DYNAMIC:
+                    dynamic = (p_offset, p_filesz)
+            if dynamic is None:
+                return None
+
+            f.seek(dynamic[0])
+            dyn_data = f.read(dynamic[1])
+            dyn_format = endian + ("qQ" if is_64 else "iI")
+            dyn_size = struct.calcsize(dyn_format)
+            strtab = soname_offset = None
+            for pos in range(0, len(dyn_data) - dyn_size + 1, dyn_size):
+                tag, value = struct.unpack(dyn_format, dyn_data[pos : pos + dyn_size])
+                if tag == DT_NULL:
+                    break
+                if tag == DT_STRTAB:
+                    strtab = value
+                elif tag == DT_SONAME:
+                    soname_offset = value
+            if strtab is None or soname_offset is None:
+                return None
+
+            # DT_STRTAB 是虚拟地址，需要通过 PT_LOAD 段换算为文件偏移
+            for vaddr, offset, filesz in loads:
+                if vaddr <= strtab < vaddr + filesz:
+                    f.seek(strtab - vaddr + offset + soname_offset)
+                    soname = f.read(256).split(b"\0", 1)[0].decode("utf-8", "replace")
+                    break
+            else:
+                return None
+    except (OSError, struct.error):
+        return None
+
+    if not soname:
+        return None
+    return soname, _get_cache_flags(is_64, e_machine, e_flags), endian == "<"
+
+
+def _get_cache_flags(is_64, machine, e_flags):
+    flags = FLAG_ELF_LIBC6
+    if machine == EM_X86_64:
+        flags |= FLAG_X8664_LIB64 if is_64 else FLAG_X8664_LIBX32
+    elif machine == EM_AARCH64 and is_64:
+        flags |= FLAG_AARCH64_LIB64
+    elif machine == EM_PPC64 and is_64:
+        flags |= FLAG_POWERPC_LIB64
+    elif machine == EM_S390 and is_64:
+        flags |= FLAG_S390_LIB64
+    elif machine == EM_ARM:
+        if e_flags & EF_ARM_ABI_FLOAT_HARD:
+            flags |= FLAG_ARM_LIBHF
+        elif e_flags & EF_ARM_ABI_FLOAT_SOFT:
+            flags |= FLAG_ARM_LIBSF
+    elif machine == EM_RISCV:
+        if e_flags & EF_RISCV_FLOAT_ABI == EF_RISCV_FLOAT_ABI_DOUBLE:
+            flags |= FLAG_RISCV_FLOAT_ABI_DOUBLE
+        elif e_flags & EF_RISCV_FLOAT_ABI == 0:
+            flags |= FLAG_RISCV_FLOAT_ABI_SOFT
+    elif machine == EM_LOONGARCH:
+        if e_flags & EF_LARCH_ABI_MODIFIER_MASK == EF_LARCH_ABI_DOUBLE_FLOAT:
+            flags |= FLAG_LARCH_FLOAT_ABI_DOUBLE
+        else:
+            flags |= FLAG_LARCH_FLOAT_ABI_SOFT
+    return flags
+
+
+def _in_rootfs(rootfs, path):
+    return Path(rootfs) / str(path).lstrip("/")
+
+
+def read_ld_so_conf(rootfs, conf_path="/" + LD_SO_CONF, _visited=None):
+    """解析 $ROOTFS 中的 ld.so.conf（支持 include），返回镜像内的目录列表"""
+    _visited = _visited if _visited is not None else set()
+    conf_file = _in_rootfs(rootfs, conf_path)
+    if conf_path in _visited or not conf_file.is_file():
+        return []
+    _visited.add(conf_path)
+
+    dirs = []
+    for line in conf_file.read_text(encoding="utf-8", errors="replace").splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line or line.startswith("hwcap "):
+            continue
+        if line.startswith("include "):
+            for pattern in line.split()[1:]:
+                if not pattern.startswith("/"):
+                    pattern = os.path.join(os.path.dirname(conf_path), pattern)
+                matches = sorted(glob.glob(_in_rootfs(rootfs, pattern).as_posix()))
+                for match in matches:
+                    include_path = "/" + Path(match).relative_to(rootfs).as_posix()
+                    dirs.extend(read_ld_so_conf(rootfs, include_path, _visited))
+            continue
+        # 兼容旧格式 "dir=TYPE" 与以逗号/空白分隔的目录列表
+        for item in line.replace(",", " ").split():
+            dirs.append(item.split("=", 1)[0].rstrip("/") or "/")
+    return dirs
+
+
+def _dl_cache_libcmp_key(name):
+    # glibc _dl_cache_libcmp：数字串按数值比较，且数字排在非数字字符之后
+    key = []
+    pos = 0
+    while pos < len(name):
+        if name[pos].isdigit():
+            end = pos
+            while end < len(name) and name[end].isdigit():
+                end += 1
+            key.append((1, int(name[pos:end])))
+            pos = end
+        else:
+            key.append((0, ord(name[pos])))
+            pos += 1
+    return key
+
+
+def scan_libraries(rootfs, dirs, create_links=True):
+    """
+    扫描镜像中的库目录，返回 ([(soname, flags, 镜像内路径)], 是否为小端序)
+
+    与 ldconfig 相同，create_links 为 True 时会为缺失的 SONAME 创建符号链接
+    """
+    rootfs = Path(rootfs)
+    entries = {}
+    little_endian = None
+    for lib_dir in dirs:
+        real_dir = _in_rootfs(rootfs, lib_dir)
+        if not real_dir.is_dir():
+            continue
+        try:
+            names = sorted(os.listdir(real_dir))
+        except OSError:
+            continue
+        for name in names:
+            if not name.startswith(("lib", "ld")) or ".so" not in name:
+                continue
+            real_path = real_dir / name
+            # 符号链接的目标也必须位于镜像内
+            if real_path.is_symlink():
+                target = os.readlink(real_path)
+                if os.path.isabs(target):
+                    real_path = _in_rootfs(rootfs, target)
+            if not real_path.is_file():
+                continue
+            info = read_elf_soname(real_path)
+            if info is None:
+                continue
+            soname, flags, is_little = info
+            if little_endian is None:
+                little_endian = is_little
+            soname_link = real_dir / soname
+            if create_links and soname != name and not os.path.lexists(soname_link):
+                os.symlink(name, soname_link)
+            if not os.path.lexists(soname_link):
+                continue
+            names = [soname]
+            # 与新版 ldconfig 一致，开发用的链接名（libfoo.so -> libfoo.so.1）也写入缓存
+            if (
+                soname.startswith(name + ".")
+                and name.endswith(".so")
+                and (real_dir / name).is_symlink()
+            ):
+                names.append(name)
+            for cache_name in names:
+                key = (cache_name, flags)
+                if key not in entries:
+                    entries[key] = f"{lib_dir.rstrip('/')}/{cache_name}"
+    libraries = [(soname, flags, path) for (soname, flags), path in entries.items()]
+    return libraries, little_endian is not False
+
+
+def build_ld_so_cache(libraries, little_endian=True):
+    """按 glibc 新格式（glibc-ld.so.cache1.1）生成 ld.so.cache 内容"""
+    # ldconfig 按 _dl_cache_libcmp 降序排列，动态链接器依赖该顺序进行二分查找
+    libraries = sorted(
+        libraries,
+        key=lambda lib: (_dl_cache_libcmp_key(lib[0]), lib[1]),
+        reverse=True,
+    )
+    endian = "<" if little_endian else ">"
+    header = struct.Struct(endian + _CACHE_HEADER.format[1:])
+    entry = struct.Struct(endian + _CACHE_ENTRY.format[1:])
+
+    strings = bytearray()
+    string_offsets = {}
+    string_base = header.size + entry.size * len(libraries)
+
+    def _add_string(value):
+        if value not in string_offsets:
+            string_offsets[value] = string_base + len(strings)
+            strings.extend(value.encode("utf-8") + b"\0")
+        return string_offsets[value]
+
+    entries = bytearray()
+    for soname, flags, path in libraries:
+        entries.extend(entry.pack(flags, _add_string(soname), _add_string(path), 0, 0))
+
+    return (
+        header.pack(
+            CACHE_MAGIC_NEW,
+            CACHE_VERSION_NEW,
+            len(libraries),
+            len(strings),
+            CACHE_FLAGS_ENDIAN_LITTLE if little_endian else CACHE_FLAGS_ENDIAN_BIG,
+            0,
+        )
+        + bytes(entries)
+        + bytes(strings)
+    )
+
+
+def generate_ld_so_cache(rootfs, create_links=True):
+    """在宿主机上为 $ROOTFS 生成 /etc/ld.so.cache，替代在仿真环境中运行 ldconfig"""
+    rootfs = Path(rootfs)
+    dirs = []
+    for lib_dir in [*read_ld_so_conf(rootfs), *SYSTEM_LIBRARY_DIRS]:
+        if lib_dir not in dirs:
+            dirs.append(lib_dir)
+    libraries, little_endian = scan_libraries(rootfs, dirs, create_links=create_links)
+    if not libraries:
+        c_warning("no shared library found in $ROOTFS, ld.so.cache not generated")
+        return 0
+
+    cache_path = _in_rootfs(rootfs, "/" + LD_SO_CACHE)
+    tmp_path = cache_path.with_name(cache_path.name + "~")
+    tmp_path.write_bytes(build_ld_so_cache(libraries, little_endian))
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, cache_path)
+    c_info(f"$ROOTFS/{LD_SO_CACHE} generated ({len(libraries)} entries)")
+    return len(libraries)
@@ -0,0 +1,251 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+from resources import get_usage_context, get_usage_records
+
+# 每次运行的指标：各处理阶段的耗时（来自 resources 中的阶段记录）、计数器与单文件操作的延迟直方图，
+# 可写出为 JSON 或 Prometheus textfile（node_exporter 的 textfile collector）格式
+
+METRICS_FORMATS = ("json", "prometheus")
+METRICS_PREFIX = "postoverlay"
+# 单个文件复制/删除的延迟直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+_COUNTER_HELP = {
+    "files_copied": "Number of overlay files copied into the rootfs.",
+    "bytes_copied": "Number of bytes copied from the overlay into the rootfs.",
+    "files_removed": "Number of paths removed from the rootfs.",
+    "errors": "Number of failed operations.",
+    "subprocesses": "Number of external commands executed.",
+}
+_HISTOGRAM_HELP = {
+    "copy_duration_seconds": "Latency of copying a single overlay file.",
+    "remove_duration_seconds": "Latency of removing a single path from the rootfs.",
+}
+
+_counters = {}
+_histograms = {}
+_metrics_lock = threading.Lock()
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc_counter(name, value=1, **labels):
+    """计数器加 value，计数器按当前镜像（以及 labels）区分"""
+    key = (name, get_usage_context(), _labels_key(labels))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value):
+    """记录一次延迟（秒）"""
+    key = (name, get_usage_context())
+    with _metrics_lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {
+                "buckets": [0] * len(LATENCY_BUCKETS),
+                "sum": 0.0,
+                "count": 0,
+            }
+        index = bisect_left(LATENCY_BUCKETS, value)
+        if index < len(LATENCY_BUCKETS):
+            histogram["buckets"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+@contextmanager
+def time_operation(name):
+    """统计一次操作的耗时并记录到直方图 name 中"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def get_metrics(reset=False):
+    """获取计数器与直方图的快照（可序列化，用于从批量处理的工作进程中传回）"""
+    with _metrics_lock:
+        snapshot = {
+            "counters": [
+                [name, image, list(map(list, labels)), value]
+                for (name, image, labels), value in _counters.items()
+            ],
+            "histograms": [
+                [name, image, dict(histogram, buckets=list(histogram["buckets"]))]
+                for (name, image), histogram in _histograms.items()
+            ],
+        }
+        if reset:
+            _counters.clear()
+            _histograms.clear()
+    return snapshot
+
+
+def merge_metrics(snapshot):
+    """合并其他进程中的指标快照"""
+    with _metrics_lock:
+        for name, image, labels, value in snapshot["counters"]:
+            key = (name, image, tuple(map(tuple, labels)))
+            _counters[key] = _counters.get(key, 0) + value
+        for name, image, histogram in snapshot["histograms"]:
+            current = _histograms.setdefault(
+                (name, image),
+                {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0},
+            )
+            current["buckets"] = [
+                a + b for a, b in zip(current["buckets"], histogram["buckets"])
+            ]
+            current["sum"] += histogram["sum"]
+            current["count"] += histogram["count"]
+
+
+def _collect():
+    """汇总阶段耗时、子进程数量、计数器与直方图，按镜像组织"""
+    images = {}
+
+    def _image(image):
+        return images.setdefault(
+            image, {"phases": {}, "counters": {}, "histograms": {}}
+        )
+
+    for record in get_usage_records():
+        entry = _image(record["image"])
+        if record["kind"] == "phase":
+            # 同名阶段（如多个同名脚本）累加
+            entry["phases"][record["name"]] = entry["phases"].get(
+                record["name"], 0.0
+            ) + (record["wall"] or 0.0)
+        elif record["kind"] == "command":
+            entry["counters"][("subprocesses", ())] = (
+                entry["counters"].get(("subprocesses", ()), 0) + 1
+            )
+    with _metrics_lock:
+        for (name, image, labels), value in _counters.items():
+            counters = _image(image)["counters"]
+            counters[(name, labels)] = counters.get((name, labels), 0) + value
+        for (name, image), histogram in _histograms.items():
+            _image(image)["histograms"][name] = dict(
+                histogram, buckets=list(histogram["buckets"])
+            )
+    return images
+
+
+def format_metrics_json(images):
+    report = {
+        "version": 1,
+        "timestamp": time.time(),
+        "latency_buckets": list(LATENCY_BUCKETS),
+        "images": [
+            {
+                "image": image,
+                "phases": entry["phases"],
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(entry["counters"].items())
+                ],
+                "histograms": entry["histograms"],
+            }
+            for image, entry in images.items()
+        ],
+    }
+    return json.dumps(report, indent=2)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    labels = [(key, value) for key, value in labels if value is not None]
+    if not labels:
+        return ""
+    return (
+        "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels) + "}"
+    )
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_metrics_prometheus(images):
+    lines = []
+    prefix = METRICS_PREFIX
+
+    lines += [
+        f"# HELP {prefix}_last_run_timestamp_seconds Time when the metrics were written.",
+        f"# TYPE {prefix}_last_run_timestamp_seconds gauge",
+        f"{prefix}_last_run_timestamp_seconds {time.time():.3f}",
+        f"# HELP {prefix}_phase_duration_seconds Wall time of each processing phase.",
+        f"# TYPE {prefix}_phase_duration_seconds gauge",
+    ]
+    for image, entry in images.items():
+        for phase, wall in entry["phases"].items():
+            labels = _format_labels([("image", image), ("phase", phase)])
+            lines.append(f"{prefix}_phase_duration_seconds{labels} {wall:.6f}")
+
+    counter_names = sorted(
+        {name for entry in images.values() for name, _ in entry["counters"]}
+    )
+    for name in counter_names:
+        metric = f"{prefix}_{name}_total"
+        lines.append(f"# HELP {metric} {_COUNTER_HELP.get(name, name)}")
+        lines.append(f"# TYPE {metric} counter")
+        for image, entry in images.items():
+            for (counter_name, labels), value in sorted(entry["counters"].items()):
+                if counter_name == name:
+                    label_text = _format_labels([("image", image), *labels])
+                    lines.append(f"{metric}{label_text} {_format_value(value)}")
+
+    histogram_names = sorted(
+        {name for entry in images.values() for name in entry["histograms"]}
+    )
+    for name in histogram_names:
+        metric = f"{prefix}_{name}"
+        lines.append(f"# HELP {metric} {_HISTOGRAM_HELP.get(name, name)}")
+        lines.append(f"# TYPE {metric} histogram")
+        for image, entry in images.items():
+            histogram = entry["histograms"].get(name)
+            if histogram is None:
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                cumulative += count
+                labels = _format_labels([("image", image), ("le", repr(bound))])
+                lines.append(f"{metric}_bucket{labels} {cumulative}")
+            labels = _format_labels([("image", image), ("le", "+Inf")])
+            lines.append(f"{metric}_bucket{labels} {histogram['count']}")
+            labels = _format_labels([("image", image)])
+            lines.append(f"{metric}_sum{labels} {histogram['sum']:.6f}")
+            lines.append(f"{metric}_count{labels} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def guess_metrics_format(metrics_path):
+    """根据文件后缀猜测指标格式：.prom 为 Prometheus textfile，其余为 JSON"""
+    return "prometheus" if Path(metrics_path).suffix.lower() == ".prom" else "json"
+
+
+def write_metrics(metrics_path, fmt=None):
+    """将本次运行的指标写入文件（先写临时文件再替换，textfile collector 不会读到写了一半的文件）"""
+    metrics_path = Path(metrics_path)
+    fmt = fmt or guess_metrics_format(metrics_path)
+    images = _collect()
+    if fmt == "prometheus":
+        content = format_metrics_prometheus(images)
+    else:
+        content = format_metrics_json(images)
+    tmp_path = metrics_path.with_name(f".{metrics_path.name}.{os.getpid()}~")
+    tmp_path.write_text(content, encoding="utf-8")
+    os.replace(tmp_path, metrics_path)
+    return metrics_path
@@ -1,30 +1,59 @@
+import os
+import time
 import uuid
 from pathlib import Path
 
-from utils import run_command, c_warning, c_error, c_info
+from image import read_ext_superblock
+from privileged import PrivilegedOperationError, run_privileged
+from utils import c_shell_command, c_warning, c_error, c_info
 
 _probe_filename = f".__postoverlay__probe__{uuid.uuid4().hex}__"
 
 
-def validate_rootfs_image(image_path):
-    """验证是否为有效的根文件系统镜像文件"""
+def validate_rootfs_image(image_path, offset=0):
+    """验证是否为有效的根文件系统镜像文件（offset 处存在 ext2/3/4 超级块）"""
     image_path = Path(image_path)
-    # 检查文件类型
+    superblock = read_ext_superblock(image_path, offset)
+    if superblock is None:
+        return False
+    c_info(
+        f"ext filesystem found at offset {offset}: {superblock['blocks_count']} blocks "
+        f"of {superblock['block_size']} bytes"
+    )
+    return True
+
+
+def count_available_loop_devices():
+    """
+    统计当前可用的 loop 设备数量
+
+    已绑定后端文件的 loop 设备视为占用；存在 /dev/loop-control 时内核可按需创建新设备，
+    此时上限由 loop 模块的 max_loop 参数决定（0 表示不限制，返回 None）
+    """
+    sys_block = Path("/sys/block")
+    loop_devices = list(sys_block.glob("loop[0-9]*")) if sys_block.is_dir() else []
+    used = sum(1 for dev in loop_devices if (dev / "loop" / "backing_file").exists())
+
+    if not Path("/dev/loop-control").exists():
+        return len(loop_devices) - used
+
+    max_loop_param = Path("/sys/module/loop/parameters/max_loop")
     try:
-        ext4_symbol = "ext4 filesystem"
-        ext2_symbol = "ext2 filesystem"
-        _, output, _, exception = run_command(
-            ["file", "-b", image_path.absolute().as_posix()]
-        )
+        max_loop = int(max_loop_param.read_text().strip())
+    except (OSError, ValueError):
+        max_loop = 0
+    if max_loop <= 0:
+        return None
+    return max(max_loop, len(loop_devices)) - used
 
-        if exception is not None:
-            raise exception
 
-        if ext4_symbol in output or ext2_symbol in output:
-            return True
-        return False
-    except Exception as e:
-        raise e
+def get_batch_workers(jobs, image_count):
+    """计算批量处理的工作进程数，受 CPU 数量与可用 loop 设备数量限制"""
+    workers = min(jobs or os.cpu_count() or 1, image_count)
+    loop_devices = count_available_loop_devices()
+    if loop_devices is not None:
+        workers = min(workers, loop_devices)
+    return max(workers, 1)
 
 
 def create_mount_probe_file(mount_point):
@@ -74,20 +103,32 @@ def is_rootfs_image_mounted(mount_point):
     return not probe_file.exists()
 
 
-def mount_rootfs_image(image_path, mount_point):
-    """挂载根文件系统镜像到指定目录"""
+def mount_rootfs_image(image_path, mount_point, offset=0, sizelimit=None):
+    """挂载根文件系统镜像到指定目录，offset/sizelimit 用于挂载磁盘镜像中的分区"""
     mount_point = Path(mount_point)
     image_path = Path(image_path)
     if not mount_point.is_dir():
         mount_point.mkdir(parents=True, exist_ok=True)
     create_mount_probe_file(mount_point)
+    mount_options = "loop"
+    if offset:
+        mount_options += f",offset={offset}"
+    if sizelimit:
+        mount_options += f",sizelimit={sizelimit}"
     c_info("executing mount command...")
-    _, _, _, exception = run_command(
-        ["sudo", "mount", "-o", "loop", image_path.as_posix(), mount_point.as_posix()]
+    _run_privileged_operations(
+        [
+            {
+                "op": "mount",
+                "args": {
+                    "options": mount_options,
+                    "source": image_path.as_posix(),
+                    "target": mount_point.as_posix(),
+                },
+            },
+            {"op": "chmod", "args": {"mode": "777", "paths": [mount_point.as_posix()]}},
+        ]
     )
-    _, _, _, exception = run_command(["sudo", "chmod", "777", mount_point.as_posix()])
-    if exception is not None:
-        raise exception
 
 
 def unmount_rootfs_image(mount_point):
@@ -97,10 +138,87 @@ def unmount_rootfs_image(mount_point):
         c_warning(f"mount point does not exist: {mount_point.absolute().as_posix()}")
         return
 
-    _, _, _, exception = run_command(
-        ["sudo", "umount", "-l", mount_point.absolute().as_posix()]
-    )
-    remove_mount_probe_file(mount_point)
+    try:
+        _run_privileged_operations(
+            [
+                {
+                    "op": "umount",
+                    "args": {"lazy": True, "target": mount_point.absolute().as_posix()},
+                }
+            ]
+        )
+    finally:
+        remove_mount_probe_file(mount_point)
+
+
+def _run_privileged_operations(operations):
+    """通过特权辅助进程批量执行操作并显示结果，操作无法执行时抛出 PrivilegedOperationError"""
+    results = run_privileged(operations)
+    error = None
+    for result in results:
+        c_shell_command(
+            result.get("command") or result["op"],
+            stdout=result["stdout"],
+            stderr=result["stderr"] or result["error"],
+            return_code=result["return_code"],
+        )
+        if result["error"] and error is None:
+            error = PrivilegedOperationError(
+                f"{result['op']} failed: {result['error']}"
+            )
+    if error is not None:
+        raise error
+    return results
+
 
-    if exception is not None:
-        raise exception
+def _read_loop_attr(loop_dir, name):
+    try:
+        return int((loop_dir / name).read_text().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def get_image_loop_devices(image_path, offset=None, sizelimit=None):
+    """
+    获取当前以 image_path 为后端文件的 loop 设备列表
+
+    指定 offset 时只返回 offset/sizelimit 与之相同的设备（即挂载该分区时创建的设备），
+    同一磁盘镜像中其他分区的 loop 设备不计入
+    """
+    image_path = os.path.realpath(image_path)
+    devices = []
+    for backing_file in Path("/sys/block").glob("loop[0-9]*/loop/backing_file"):
+        try:
+            if backing_file.read_text().strip() != image_path:
+                continue
+        except OSError:
+            continue
+        loop_dir = backing_file.parent
+        if offset is not None and (
+            _read_loop_attr(loop_dir, "offset") != offset
+            or _read_loop_attr(loop_dir, "sizelimit") != (sizelimit or 0)
+        ):
+            continue
+        devices.append(f"/dev/{loop_dir.parent.name}")
+    return devices
+
+
+def wait_for_image_release(
+    image_path, offset=None, sizelimit=None, timeout=60, interval=0.2
+):
+    """
+    等待镜像文件（offset/sizelimit 指定的分区）关联的 loop 设备被释放，超时返回 False
+
+    `umount -l` 返回时文件系统可能仍在回写，loop 设备自动释放后镜像内容才是最终状态
+    """
+    deadline = time.monotonic() + timeout
+    devices = get_image_loop_devices(image_path, offset, sizelimit)
+    if devices:
+        c_info(f"waiting for {', '.join(devices)} to be released...")
+    while devices:
+        if time.monotonic() > deadline:
+            c_warning(f"loop device(s) still attached to {image_path}: {devices}")
+            return False
+        time.sleep(interval)
+        devices = get_image_loop_devices(image_path, offset, sizelimit)
+    return True
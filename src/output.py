@@ -0,0 +1,372 @@
+import gzip
+import lzma
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+from image import get_image_size, iter_chunks, iter_data_ranges, read_image_range
+from utils import c_info, c_success
+
+OUTPUT_FORMATS = ("gzip", "xz", "zstd", "sparse")
+# 各压缩格式可用的压缩级别范围（含两端），sparse 不压缩
+COMPRESS_LEVEL_RANGES = {"gzip": (0, 9), "xz": (0, 9), "zstd": (1, 22)}
+
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+
+_OUTPUT_SUFFIXES = {
+    ".gz": "gzip",
+    ".gzip": "gzip",
+    ".xz": "xz",
+    ".zst": "zstd",
+    ".zstd": "zstd",
+    ".simg": "sparse",
+    ".sparse": "sparse",
+}
+
+# Android sparse image 格式常量
+SPARSE_HEADER_MAGIC = 0xED26FF3A
+SPARSE_BLOCK_SIZE = 4096
+SPARSE_CHUNK_RAW = 0xCAC1
+SPARSE_CHUNK_FILL = 0xCAC2
+SPARSE_CHUNK_DONT_CARE = 0xCAC3
+_SPARSE_HEADER = struct.Struct("<IHHHHIIII")
+_SPARSE_CHUNK_HEADER = struct.Struct("<HHII")
+
+
+def guess_output_format(output_path):
+    """根据输出文件后缀推断输出格式"""
+    return _OUTPUT_SUFFIXES.get(Path(output_path).suffix.lower())
+
+
+def get_output_path(output, image_path):
+    """生成镜像对应的输出文件路径，`{name}` 将被替换为镜像文件名"""
+    return Path(str(output).replace("{name}", Path(image_path).name))
+
+
+def is_zstd_available():
+    """检查是否可以进行 zstd 压缩（zstandard 模块或 zstd 命令）"""
+    try:
+        import zstandard  # noqa: F401
+
+        return True
+    except ImportError:
+        return bool(shutil.which("zstd"))
+
+
+@contextmanager
+def _open_output(output_path):
+    """
+    在输出文件所在目录中打开一个临时文件用于写入，成功后再替换为输出文件
+
+    写入失败时删除临时文件，不会留下不完整的输出文件
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=output_path.parent, prefix=f".{output_path.name}.", suffix=".tmp"
+    )
+    try:
+        # mkstemp 创建的文件权限为 0600，改为与 open() 新建的文件一致
+        umask = os.umask(0)
+        os.umask(umask)
+        os.fchmod(fd, 0o666 & ~umask)
+        with os.fdopen(fd, "wb") as out:
+            yield out
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _compress_bytes(data, fmt, level):
+    if fmt == "gzip":
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if fmt == "xz":
+        return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+    if fmt == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            return subprocess.run(
+                ["zstd", "-q", "-c", f"-{level}"],
+                input=data,
+                stdout=subprocess.PIPE,
+                check=True,
+            ).stdout
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError(f"unsupported compression format: {fmt}")
+
+
+def _compress_chunk(image_path, offset, length, fmt, level):
+    """压缩镜像中的一个区间，返回一个独立的 gzip member / xz stream / zstd frame"""
+    return _compress_bytes(read_image_range(image_path, offset, length), fmt, level)
+
+
+def _sparse_chunk(image_path, offset, length, end):
+    """将镜像中的一个数据区间转换为 sparse chunk 列表 [(type, blocks, payload)]，end 之后的部分视为 0"""
+    data = read_image_range(image_path, offset, min(length, end - offset))
+    if len(data) % SPARSE_BLOCK_SIZE:
+        data += b"\0" * (SPARSE_BLOCK_SIZE - len(data) % SPARSE_BLOCK_SIZE)
+
+    chunks = []
+    raw_start = None
+    for pos in range(0, len(data), SPARSE_BLOCK_SIZE):
+        block = data[pos : pos + SPARSE_BLOCK_SIZE]
+        pattern = block[:4]
+        if block == pattern * (SPARSE_BLOCK_SIZE // 4):
+            if raw_start is not None:
+                chunks.append(
+                    (
+                        SPARSE_CHUNK_RAW,
+                        (pos - raw_start) // SPARSE_BLOCK_SIZE,
+                        data[raw_start:pos],
+                    )
+                )
+                raw_start = None
+            if (
+                chunks
+                and chunks[-1][0] == SPARSE_CHUNK_FILL
+                and chunks[-1][2] == pattern
+            ):
+                chunks[-1] = (SPARSE_CHUNK_FILL, chunks[-1][1] + 1, pattern)
+            else:
+                chunks.append((SPARSE_CHUNK_FILL, 1, pattern))
+        elif raw_start is None:
+            raw_start = pos
+    if raw_start is not None:
+        chunks.append(
+            (
+                SPARSE_CHUNK_RAW,
+                (len(data) - raw_start) // SPARSE_BLOCK_SIZE,
+                data[raw_start:],
+            )
+        )
+    return chunks
+
+
+def _ordered_results(executor, func, tasks, jobs):
+    """按提交顺序返回并行任务的结果，同时限制在途任务数量以控制内存占用"""
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(func, *task))
+        if len(pending) >= jobs * 2:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def write_compressed_image(
+    image_path,
+    output_path,
+    fmt="gzip",
+    level=6,
+    jobs=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    offset=0,
+    size=None,
+):
+    """
+    将镜像文件（或其中 offset 起 size 字节的区间）按块并行压缩为 gzip/xz/zstd 流
+
+    每个块被压缩为独立的 member/stream/frame 并按顺序拼接，标准解压工具可直接解压；
+    完全位于空洞中的块不读取镜像，直接复用预先压缩好的全零块
+    """
+    image_path = Path(image_path)
+    output_path = Path(output_path)
+    jobs = jobs or os.cpu_count() or 1
+    image_size = get_image_size(image_path) - offset if size is None else size
+    data_ranges = list(iter_data_ranges(image_path, offset, offset + image_size))
+
+    zero_chunks = {}
+
+    def _zero_chunk(length):
+        if length not in zero_chunks:
+            zero_chunks[length] = _compress_bytes(b"\0" * length, fmt, level)
+        return zero_chunks[length]
+
+    c_info(
+        f"compressing {image_path} -> {output_path} ({fmt}, {jobs} worker(s), "
+        f"{len(data_ranges)} data range(s))"
+    )
+    # 在这里导入，--help 等不需要加载 multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    written = 0
+    range_index = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor, _open_output(
+        output_path
+    ) as out:
+        pending = deque()
+        for chunk_offset, length in iter_chunks(
+            offset, offset + image_size, chunk_size
+        ):
+            # 跳过已经位于当前块之前的数据区间
+            while (
+                range_index < len(data_ranges)
+                and sum(data_ranges[range_index]) <= chunk_offset
+            ):
+                range_index += 1
+            if (
+                range_index < len(data_ranges)
+                and data_ranges[range_index][0] < chunk_offset + length
+            ):
+                pending.append(
+                    executor.submit(
+                        _compress_chunk, image_path, chunk_offset, length, fmt, level
+                    )
+                )
+            else:
+                pending.append(_zero_chunk(length))
+            if len(pending) >= jobs * 2:
+                written += _write_pending(out, pending.popleft())
+        while pending:
+            written += _write_pending(out, pending.popleft())
+
+    c_success(f"{output_path} written ({written} bytes from {image_size} bytes)")
+    return output_path
+
+
+def _write_pending(out, item):
+    data = item if isinstance(item, bytes) else item.result()
+    out.write(data)
+    return len(data)
+
+
+def write_sparse_image(
+    image_path,
+    output_path,
+    jobs=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    offset=0,
+    size=None,
+):
+    """
+    将镜像文件（或其中 offset 起 size 字节的区间）转换为 Android sparse image
+
+    空洞写为 DONT_CARE，内容重复的块写为 FILL，其余写为 RAW；数据区间在进程池中并行扫描
+    """
+    image_path = Path(image_path)
+    output_path = Path(output_path)
+    jobs = jobs or os.cpu_count() or 1
+    image_size = get_image_size(image_path) - offset if size is None else size
+    image_end = offset + image_size
+    total_blocks = -(-image_size // SPARSE_BLOCK_SIZE)
+
+    # 数据区间向块边界（相对于 offset）对齐并合并
+    tasks = []
+    last_end = offset
+    for start, length in iter_data_ranges(image_path, offset, image_end):
+        relative_start = start - offset
+        block_start = max(
+            offset + relative_start - relative_start % SPARSE_BLOCK_SIZE, last_end
+        )
+        block_end = (
+            offset
+            + min(
+                -(-(relative_start + length) // SPARSE_BLOCK_SIZE),
+                total_blocks,
+            )
+            * SPARSE_BLOCK_SIZE
+        )
+        if block_end <= block_start:
+            continue
+        tasks.extend(iter_chunks(block_start, block_end, chunk_size))
+        last_end = block_end
+
+    c_info(
+        f"converting {image_path} -> {output_path} (sparse, {jobs} worker(s), "
+        f"{len(tasks)} chunk(s))"
+    )
+    from concurrent.futures import ProcessPoolExecutor
+
+    total_chunks = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor, _open_output(
+        output_path
+    ) as out:
+        out.write(b"\0" * _SPARSE_HEADER.size)
+        cursor = offset
+
+        def _write_chunk(chunk_type, blocks, payload):
+            out.write(
+                _SPARSE_CHUNK_HEADER.pack(
+                    chunk_type,
+                    0,
+                    blocks,
+                    _SPARSE_CHUNK_HEADER.size + len(payload),
+                )
+            )
+            out.write(payload)
+
+        results = _ordered_results(
+            executor,
+            _sparse_chunk,
+            (
+                (image_path, chunk_offset, length, image_end)
+                for chunk_offset, length in tasks
+            ),
+            jobs,
+        )
+        for (chunk_offset, length), chunks in zip(tasks, results):
+            if chunk_offset > cursor:
+                _write_chunk(
+                    SPARSE_CHUNK_DONT_CARE,
+                    (chunk_offset - cursor) // SPARSE_BLOCK_SIZE,
+                    b"",
+                )
+                total_chunks += 1
+            for chunk in chunks:
+                _write_chunk(*chunk)
+                total_chunks += 1
+            cursor = chunk_offset + length
+
+        if cursor < offset + total_blocks * SPARSE_BLOCK_SIZE:
+            _write_chunk(
+                SPARSE_CHUNK_DONT_CARE,
+                total_blocks - (cursor - offset) // SPARSE_BLOCK_SIZE,
+                b"",
+            )
+            total_chunks += 1
+
+        out.seek(0)
+        out.write(
+            _SPARSE_HEADER.pack(
+                SPARSE_HEADER_MAGIC,
+                1,
+                0,
+                _SPARSE_HEADER.size,
+                _SPARSE_CHUNK_HEADER.size,
+                SPARSE_BLOCK_SIZE,
+                total_blocks,
+                total_chunks,
+                0,
+            )
+        )
+
+    c_success(
+        f"{output_path} written ({total_chunks} chunk(s), {total_blocks} block(s))"
+    )
+    return output_path
+
+
+def write_output_image(
+    image_path, output_path, fmt=None, level=6, jobs=None, offset=0, size=None
+):
+    """按指定格式输出镜像文件（或其中 offset 起 size 字节的区间）"""
+    fmt = fmt or guess_output_format(output_path)
+    if fmt == "sparse":
+        return write_sparse_image(
+            image_path, output_path, jobs=jobs, offset=offset, size=size
+        )
+    return write_compressed_image(
+        image_path,
+        output_path,
+        fmt=fmt,
+        level=level,
+        jobs=jobs,
+        offset=offset,
+        size=size,
+    )
@@ -1,9 +1,16 @@
+import hashlib
 import os
 import shutil
+import stat
+from collections import namedtuple
 from pathlib import Path
 
+from metrics import inc_counter, time_operation
 from utils import c_info, c_error
 
+# 预先计算的 overlay 执行计划，可在多个镜像之间共享
+OverlayPlan = namedtuple("OverlayPlan", ["overlay_dir", "entries", "digest", "remove"])
+
 
 def do_overlay_copy(
     mount_point, overlay_dir, src_path, preserve_perm=True, preserve_owner=False
@@ -56,13 +63,19 @@ def apply_overlay(
     preserve_perm=True,
     preserve_owner=False,
     print_message=True,
+    entries=None,
 ):
+    """将 overlay 目录中的文件复制到挂载点，返回 (复制的文件数, [(复制失败的文件, 错误信息)])"""
     overlay_dir = Path(overlay_dir)
-    for src_root, dirs, files in os.walk(overlay_dir):
-        # 复制文件
-        for file in files:
-            src_path = Path(src_root) / file
-            try:
+    if entries is None:
+        entries = scan_overlay(overlay_dir)
+    copied = 0
+    failed = []
+    # 复制文件
+    for entry in entries:
+        src_path = overlay_dir / entry
+        try:
+            with time_operation("copy_duration_seconds"):
                 do_overlay_copy(
                     mount_point=mount_point,
                     overlay_dir=overlay_dir,
@@ -70,8 +83,119 @@ def apply_overlay(
                     preserve_perm=preserve_perm,
                     preserve_owner=preserve_owner,
                 )
-            except Exception as e:
-                c_error(f"failed to copy: {src_path.as_posix()}: {e}", print_message)
+            inc_counter("files_copied")
+            inc_counter("bytes_copied", os.stat(src_path).st_size)
+            copied += 1
+        except Exception as e:
+            inc_counter("errors", operation="copy")
+            failed.append((entry, str(e)))
+            c_error(f"failed to copy: {src_path.as_posix()}: {e}", print_message)
+    return copied, failed
+
+
+def apply_remove(mount_point, remove_list):
+    """删除 rootfs 中的文件/目录，返回 (已删除的路径, 不存在的路径, [(删除失败的路径, 错误信息)])"""
+    removed = []
+    missing = []
+    failed = []
+    for file_path in remove_list or []:
+        if not file_path:
+            continue
+
+        display_path = f"$ROOTFS/{file_path.strip().lstrip('/')}"
+        c_info(f"[remove_operation]removing {display_path}...[/remove_operation]")
+
+        real_path = Path(mount_point) / file_path.strip().lstrip("/")
+        if not real_path.exists():
+            c_info(
+                f"[remove_operation]{display_path} not found, skipped[/remove_operation]"
+            )
+            missing.append(file_path)
+            continue
+        try:
+            is_dir = real_path.is_dir()
+            with time_operation("remove_duration_seconds"):
+                if is_dir:
+                    shutil.rmtree(real_path)
+                else:
+                    real_path.unlink()
+            inc_counter("files_removed")
+            removed.append(file_path)
+            c_info(
+                f"[remove_operation]{'directory' if is_dir else 'file'}{display_path} removed[/remove_operation]"
+            )
+        except Exception as e:
+            inc_counter("errors", operation="remove")
+            failed.append((file_path, str(e)))
+            c_error(f"failed to remove {file_path}: {e}")
+    return removed, missing, failed
+
+
+def scan_overlay(overlay_dir):
+    """扫描 overlay 目录，返回所有待复制文件相对于 overlay 目录的路径"""
+    overlay_dir = Path(overlay_dir)
+    entries = []
+    for src_root, dirs, files in os.walk(overlay_dir):
+        dirs.sort()
+        for file in sorted(files):
+            entries.append((Path(src_root) / file).relative_to(overlay_dir).as_posix())
+    return entries
+
+
+def hash_overlay(overlay_dir, entries):
+    """
+    计算 overlay 内容摘要（路径、权限与文件内容）
+
+    不跟随符号链接（rootfs 中的绝对链接在宿主机上通常是悬空的），符号链接只计入链接目标；
+    只读取普通文件的内容，FIFO、设备文件等只计入其类型与设备号
+    """
+    overlay_dir = Path(overlay_dir)
+    digest = hashlib.sha256()
+    for entry in entries:
+        src_path = overlay_dir / entry
+        st = os.lstat(src_path)
+        digest.update(entry.encode("utf-8") + b"\0")
+        digest.update(oct(st.st_mode).encode("ascii") + b"\0")
+        if stat.S_ISLNK(st.st_mode):
+            digest.update(os.fsencode(os.readlink(src_path)))
+        elif stat.S_ISREG(st.st_mode):
+            with open(src_path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+        else:
+            digest.update(str(st.st_rdev).encode("ascii"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def compile_remove_list(remove_list):
+    """规范化待删除项目列表：去除首尾空白与开头的 '/'，过滤空行并去重"""
+    compiled = []
+    for item in remove_list or []:
+        item = (item or "").strip().lstrip("/")
+        if item and item not in compiled:
+            compiled.append(item)
+    return compiled
+
+
+def build_overlay_plan(overlay_dir, remove_list=None):
+    """扫描并计算 overlay 目录摘要、编译删除列表，生成可共享的 OverlayPlan"""
+    entries = []
+    digest = None
+    if overlay_dir:
+        overlay_dir = Path(overlay_dir)
+        c_info(f"scanning overlay directory: {overlay_dir}")
+        entries = scan_overlay(overlay_dir)
+        digest = hash_overlay(overlay_dir, entries)
+        c_info(
+            f"{len(entries)} file(s) found in overlay directory, digest: {digest[:12]}"
+        )
+    return OverlayPlan(
+        overlay_dir=overlay_dir or None,
+        entries=entries,
+        digest=digest,
+        remove=compile_remove_list(remove_list),
+    )
 
 
 def parse_remove_list(file_path):
@@ -0,0 +1,195 @@
+import re
+import struct
+import uuid
+from collections import namedtuple
+from pathlib import Path
+
+from image import get_image_size, read_ext_superblock, read_image_range
+
+SECTOR_SIZE = 512
+GPT_SIGNATURE = b"EFI PART"
+MBR_SIGNATURE = b"\x55\xaa"
+MBR_PROTECTIVE_TYPE = 0xEE
+MBR_EXTENDED_TYPES = (0x05, 0x0F, 0x85)
+
+# 磁盘镜像中的一个分区，offset/size 以字节为单位
+Partition = namedtuple("Partition", ["number", "offset", "size", "type", "label"])
+
+# 解析后的 rootfs 参数：镜像文件路径与文件系统所在的字节区间
+RootfsImage = namedtuple("RootfsImage", ["spec", "path", "offset", "size", "partition"])
+
+_PART_NUMBER_PATTERN = re.compile(r"^(?:part|p)?(\d+)$", re.IGNORECASE)
+
+
+class PartitionNotFoundError(LookupError):
+    pass
+
+
+def _read_mbr_entries(image_path, lba):
+    sector = read_image_range(image_path, lba * SECTOR_SIZE, SECTOR_SIZE)
+    if len(sector) < SECTOR_SIZE or sector[510:512] != MBR_SIGNATURE:
+        return None
+    entries = []
+    for index in range(4):
+        entry = sector[446 + index * 16 : 446 + (index + 1) * 16]
+        part_type = entry[4]
+        start_lba, sectors = struct.unpack("<II", entry[8:16])
+        if part_type == 0 or sectors == 0:
+            continue
+        entries.append((index, part_type, start_lba, sectors))
+    return entries
+
+
+def read_mbr_partitions(image_path):
+    """解析 MBR 分区表（包括扩展分区中的逻辑分区）"""
+    entries = _read_mbr_entries(image_path, 0)
+    if entries is None:
+        return []
+    partitions = []
+    for index, part_type, start_lba, sectors in entries:
+        if part_type in MBR_EXTENDED_TYPES:
+            partitions.extend(_read_logical_partitions(image_path, start_lba))
+            continue
+        partitions.append(
+            Partition(
+                number=index + 1,
+                offset=start_lba * SECTOR_SIZE,
+                size=sectors * SECTOR_SIZE,
+                type=f"0x{part_type:02x}",
+                label=None,
+            )
+        )
+    return sorted(partitions, key=lambda p: p.number)
+
+
+def _read_logical_partitions(image_path, extended_lba):
+    partitions = []
+    ebr_lba = extended_lba
+    number = 5
+    # EBR 链表，防止损坏的分区表形成环
+    visited = set()
+    while ebr_lba not in visited:
+        visited.add(ebr_lba)
+        entries = _read_mbr_entries(image_path, ebr_lba)
+        if not entries:
+            break
+        next_lba = None
+        for _, part_type, start_lba, sectors in entries:
+            if part_type in MBR_EXTENDED_TYPES:
+                next_lba = extended_lba + start_lba
+                continue
+            partitions.append(
+                Partition(
+                    number=number,
+                    offset=(ebr_lba + start_lba) * SECTOR_SIZE,
+                    size=sectors * SECTOR_SIZE,
+                    type=f"0x{part_type:02x}",
+                    label=None,
+                )
+            )
+            number += 1
+        if next_lba is None:
+            break
+        ebr_lba = next_lba
+    return partitions
+
+
+def read_gpt_partitions(image_path):
+    """解析 GPT 分区表，依次尝试 512 与 4096 字节的逻辑扇区大小"""
+    for sector_size in (SECTOR_SIZE, 4096):
+        header = read_image_range(image_path, sector_size, 92)
+        if header[:8] != GPT_SIGNATURE:
+            continue
+        entries_lba, entries_count, entry_size = struct.unpack("<QII", header[72:88])
+        table = read_image_range(
+            image_path, entries_lba * sector_size, entries_count * entry_size
+        )
+        partitions = []
+        for index in range(entries_count):
+            entry = table[index * entry_size : (index + 1) * entry_size]
+            if len(entry) < 128 or entry[:16] == b"\0" * 16:
+                continue
+            first_lba, last_lba = struct.unpack("<QQ", entry[32:48])
+            name = entry[56:128].decode("utf-16-le", errors="replace").split("\0")[0]
+            partitions.append(
+                Partition(
+                    number=index + 1,
+                    offset=first_lba * sector_size,
+                    size=(last_lba - first_lba + 1) * sector_size,
+                    type=str(uuid.UUID(bytes_le=entry[:16])),
+                    label=name or None,
+                )
+            )
+        return partitions
+    return []
+
+
+def read_partition_table(image_path):
+    """读取磁盘镜像的分区表，存在保护性 MBR 时按 GPT 解析"""
+    entries = _read_mbr_entries(image_path, 0)
+    if entries and any(e[1] == MBR_PROTECTIVE_TYPE for e in entries):
+        return read_gpt_partitions(image_path)
+    return read_mbr_partitions(image_path)
+
+
+def split_rootfs_spec(spec):
+    """
+    拆分 rootfs 参数为 (镜像路径, 分区选择器)
+
+    支持 `disk.img`、`disk.img:partN` 与 `disk.img:<分区名或文件系统卷标>`，
+    当参数本身就是一个已存在的文件时不做拆分
+    """
+    spec = str(spec)
+    if Path(spec).is_file() or ":" not in spec:
+        return Path(spec), None
+    path, selector = spec.rsplit(":", 1)
+    return Path(path), selector
+
+
+def find_partition(image_path, selector):
+    """根据分区号或名称（GPT 分区名/ext 文件系统卷标）查找分区"""
+    partitions = read_partition_table(image_path)
+    if not partitions:
+        raise PartitionNotFoundError(f"no partition table found in {image_path}")
+
+    match = _PART_NUMBER_PATTERN.match(selector)
+    if match:
+        number = int(match.group(1))
+        for partition in partitions:
+            if partition.number == number:
+                return partition
+        raise PartitionNotFoundError(f"partition {number} not found in {image_path}")
+
+    for partition in partitions:
+        if partition.label == selector:
+            return partition
+    for partition in partitions:
+        superblock = read_ext_superblock(image_path, partition.offset)
+        if superblock and superblock["volume_name"] == selector:
+            return partition._replace(label=selector)
+    raise PartitionNotFoundError(
+        f"partition labeled `{selector}` not found in {image_path}"
+    )
+
+
+def resolve_rootfs(spec):
+    """将 rootfs 参数解析为 RootfsImage"""
+    path, selector = split_rootfs_spec(spec)
+    if not path.is_file():
+        raise FileNotFoundError(f"rootfs image not found: {path}")
+    if selector is None:
+        return RootfsImage(
+            spec=str(spec),
+            path=path,
+            offset=0,
+            size=get_image_size(path),
+            partition=None,
+        )
+    partition = find_partition(path, selector)
+    return RootfsImage(
+        spec=str(spec),
+        path=path,
+        offset=partition.offset,
+        size=partition.size,
+        partition=partition,
+    )
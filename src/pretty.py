@@ -1,54 +1,84 @@
+import heapq
+import json
+import os
+import re
+import stat
 import sys
+import threading
 import traceback
 from pathlib import Path
 
-from rich import box
-from rich.console import Console, Group
-from rich.panel import Panel
-from rich.progress import (
-    Progress,
-    BarColumn,
-    TextColumn,
-    TimeRemainingColumn,
-    TimeElapsedColumn,
-    SpinnerColumn,
-)
-from rich.syntax import Syntax
-from rich.text import Text
-from rich.theme import Theme
-from rich.tree import Tree
-
+# rich（以及 pygments）只在第一次需要渲染时才导入，--help 与纯文本输出不需要加载它们
 
 # 主题配色方案
-_theme = Theme(
-    {
-        # 消息级别样式
-        "info": "bold #4FC3F7",  # 浅蓝色
-        "success": "bold #66BB6A",  # 浅绿色
-        "warning": "bold #FFD54F",  # 琥珀色
-        "error": "bold #EF5350",  # 红色
-        "debug": "italic #B0BEC5",  # 灰色调试信息
-        "remove_operation": "bold #FFD54F on #004D40",
-        "add_operation": "bold #66BB6A on #004D40",
-        "overlay_operation": "bold #E0F7FA on #004D40",
-        # Shell相关样式
-        "source_code": "bold #E0F7FA",  # 青色文字/深青背景
-        "shell_output": "#E0F7FA on #004D40",  # 青色文字/深绿背景
-        "shell_prompt": "#80DEEA",  # 浅青色
-        # 进度条样式
-        "progress_bar": "#00897B",  # 青色进度条
-        "progress_text": "bold #4DB6AC",  # 进度文本
-        "progress_complete": "bold #66BB6A",  # 完成状态
-        "progress_error": "bold #EF5350",  # 错误状态
-        # 目录树样式
-        "tree_dir": "bold #4FC3F7",  # 目录样式
-        "tree_file": "#E0F7FA",  # 文件样式
-        "tree_special": "#FFD54F",  # 特殊文件样式
-        "tree_size": "italic #90A4AE",  # 文件大小样式
-    }
-)
-
-_console = Console(theme=_theme)
+_theme_styles = {
+    # 消息级别样式
+    "info": "bold #4FC3F7",  # 浅蓝色
+    "success": "bold #66BB6A",  # 浅绿色
+    "warning": "bold #FFD54F",  # 琥珀色
+    "error": "bold #EF5350",  # 红色
+    "debug": "italic #B0BEC5",  # 灰色调试信息
+    "remove_operation": "bold #FFD54F on #004D40",
+    "add_operation": "bold #66BB6A on #004D40",
+    "overlay_operation": "bold #E0F7FA on #004D40",
+    # Shell相关样式
+    "source_code": "bold #E0F7FA",  # 青色文字/深青背景
+    "shell_output": "#E0F7FA on #004D40",  # 青色文字/深绿背景
+    "shell_prompt": "#80DEEA",  # 浅青色
+    # 进度条样式
+    "progress_bar": "#00897B",  # 青色进度条
+    "progress_text": "bold #4DB6AC",  # 进度文本
+    "progress_complete": "bold #66BB6A",  # 完成状态
+    "progress_error": "bold #EF5350",  # 错误状态
+    # 目录树样式
+    "tree_dir": "bold #4FC3F7",  # 目录样式
+    "tree_file": "#E0F7FA",  # 文件样式
+    "tree_special": "#FFD54F",  # 特殊文件样式
+    "tree_size": "italic #90A4AE",  # 文件大小样式
+}
+
+_console = None
+# None 表示根据 stdout 是否为终端自动选择
+_plain_output = None
+_plain_lock = threading.Lock()
+# 纯文本输出时去掉消息中的主题样式标记
+_markup_pattern = re.compile(r"\[/?(?:%s)\]" % "|".join(_theme_styles))
+
+
+def _get_console():
+    global _console
+    if _console is None:
+        from rich.console import Console
+        from rich.theme import Theme
+
+        _console = Console(theme=Theme(_theme_styles))
+    return _console
+
+
+def set_plain_output(plain=True):
+    """设置是否使用纯文本输出，None 表示 stdout 不是终端时自动使用纯文本输出"""
+    global _plain_output
+    _plain_output = plain
+
+
+def is_plain_output():
+    if _plain_output is not None:
+        return _plain_output
+    return not sys.stdout.isatty()
+
+
+def _print_plain(text="", markup=True):
+    text = str(text)
+    if markup:
+        text = _markup_pattern.sub("", text)
+    with _plain_lock:
+        sys.stdout.write(f"{text}\n")
+        sys.stdout.flush()
+
+
+def _indent(text, prefix="  "):
+    return "\n".join(prefix + line for line in text.splitlines())
+
 
 # ======================
 # 文件类型图标映射
@@ -57,6 +87,7 @@ _console = Console(theme=_theme)
 FILE_ICONS = {
     # 目录
     "dir": "📁",
+    "link": "🔗",
     # 编程语言文件
     "py": "📜",
     "js": "📜",
@@ -127,6 +158,8 @@ FILE_ICONS = {
 }
 
 _common_panel_width = 100
+# 目录树中每个目录默认最多显示的条目数
+DEFAULT_TREE_ENTRY_LIMIT = 50
 
 
 def set_common_panel_width(width):
@@ -137,31 +170,54 @@ def set_common_panel_width(width):
 
 def print_info(msg, icon=""):
     """打印信息消息"""
-    _console.print(f"{icon} [info]INFO:[/info] {msg}".lstrip())
+    if is_plain_output():
+        _print_plain(f"{icon} INFO: {msg}".lstrip())
+        return
+    _get_console().print(f"{icon} [info]INFO:[/info] {msg}".lstrip())
 
 
 def print_success(msg, icon=""):
     """打印成功消息"""
-    _console.print(f"{icon} [success]SUCCESS:[/success] {msg}".lstrip())
+    if is_plain_output():
+        _print_plain(f"{icon} SUCCESS: {msg}".lstrip())
+        return
+    _get_console().print(f"{icon} [success]SUCCESS:[/success] {msg}".lstrip())
 
 
 def print_warning(msg, icon=""):
     """打印警告消息"""
-    _console.print(f"{icon} [warning]WARNING:[/warning] {msg}".lstrip())
+    if is_plain_output():
+        _print_plain(f"{icon} WARNING: {msg}".lstrip())
+        return
+    _get_console().print(f"{icon} [warning]WARNING:[/warning] {msg}".lstrip())
 
 
 def print_error(msg, icon=""):
     """打印错误消息"""
-    _console.print(f"{icon} [error]ERROR:[/error] {msg}".lstrip())
+    if is_plain_output():
+        _print_plain(f"{icon} ERROR: {msg}".lstrip())
+        return
+    _get_console().print(f"{icon} [error]ERROR:[/error] {msg}".lstrip())
 
 
 def print_debug(msg, icon=""):
     """打印调试信息"""
-    _console.print(f"{icon} [debug]DEBUG:[/debug] {msg}".lstrip())
+    if is_plain_output():
+        _print_plain(f"{icon} DEBUG: {msg}".lstrip())
+        return
+    _get_console().print(f"{icon} [debug]DEBUG:[/debug] {msg}".lstrip())
 
 
 def print_source_code(code, lexer_name, title=""):
     """美观地打印执行的Shell代码"""
+    if is_plain_output():
+        _print_plain(f"--- {title}".rstrip())
+        _print_plain(_indent(code), markup=False)
+        return
+    from rich import box
+    from rich.panel import Panel
+    from rich.syntax import Syntax
+
     syntax = Syntax(
         code,
         lexer_name,
@@ -182,7 +238,7 @@ def print_source_code(code, lexer_name, title=""):
         expand=False,
         width=_common_panel_width,
     )
-    _console.print(panel)
+    _get_console().print(panel)
 
 
 def print_shell_code(code, title="Executing Shell Command"):
@@ -194,6 +250,12 @@ def print_shell_output(output, title="Command Output", success=True):
     """美观地打印Shell命令输出"""
     style = "success" if success else "error"
     icon = "✅" if success else "❌"
+    if is_plain_output():
+        _print_plain(f"--- {title} ({'ok' if success else 'failed'})")
+        _print_plain(_indent(output), markup=False)
+        return
+    from rich import box
+    from rich.panel import Panel
 
     panel = Panel(
         output,
@@ -206,12 +268,26 @@ def print_shell_output(output, title="Command Output", success=True):
         expand=False,
         width=_common_panel_width,
     )
-    _console.print(panel)
+    _get_console().print(panel)
+
+
+def print_stream_line(line, stream="stdout"):
+    """实时打印命令输出的一行"""
+    if is_plain_output():
+        _print_plain(f"  {line}", markup=False)
+        return
+    style = "shell_prompt" if stream == "stdout" else "warning"
+    _get_console().print(
+        f"  {line}", style=style, markup=False, highlight=False, soft_wrap=True
+    )
 
 
 def print_separator(title="Shell Command Execution"):
     """打印分隔符"""
-    _console.rule(
+    if is_plain_output():
+        _print_plain(f"==== {title} ====")
+        return
+    _get_console().rule(
         f"[reverse][blink]⚡[/blink] {title} ⚡[/reverse]",
         style="#00897B",
         align="center",
@@ -227,11 +303,11 @@ def print_shell_command(
     command_panel_title="Command",
     output_panel_title="Output",
     error_panel_title="Error Output",
+    resource_usage=None,
 ):
     """
-    在单个面板中显示 Shell 命令及其执行结果
+    在单个面板中显示 Shell 命令及其执行结果，resource_usage 显示在面板底部
     """
-
     command = command.strip()
     if not command:
         return
@@ -242,6 +318,26 @@ def print_shell_command(
     if return_code is None:
         return_code = 0
 
+    if is_plain_output():
+        first_line, _, rest = command.partition("\n")
+        _print_plain(f"$ {first_line}", markup=False)
+        if rest:
+            _print_plain(_indent(rest, "> "), markup=False)
+        if stdout:
+            _print_plain(_indent(stdout), markup=False)
+        if stderr:
+            _print_plain(_indent(stderr, "  ! "), markup=False)
+        status = f"[exit {return_code}]"
+        _print_plain(f"{status} {resource_usage}" if resource_usage else status)
+        return
+
+    from rich import box
+    from rich.console import Group
+    from rich.panel import Panel
+    from rich.syntax import Syntax
+
+    subtitle = f"[dim]{resource_usage}[/dim]" if resource_usage else None
+
     # 创建命令部分
     command_panel = Panel(
         Syntax(command, "bash", theme="monokai", line_numbers=False),
@@ -254,7 +350,8 @@ def print_shell_command(
 
     if not stdout and not stderr:
         command_panel.box = box.ROUNDED
-        _console.print(command_panel)
+        command_panel.subtitle = subtitle
+        _get_console().print(command_panel)
         return
 
     success = (not stderr.strip()) and (return_code == 0)
@@ -294,23 +391,178 @@ def print_shell_command(
     main_panel = Panel(
         command_group,
         title=f"[bold]{title}[/bold]",
+        subtitle=subtitle,
         border_style="green" if success else "red",
         box=box.ROUNDED,
         padding=(1, 1),
         width=_common_panel_width,
     )
 
-    _console.print(main_panel)
+    _get_console().print(main_panel)
+
+
+def print_table(columns, rows, title="Summary"):
+    """打印表格"""
+    if is_plain_output():
+        _print_plain_table(columns, rows, title)
+        return
+    from rich import box
+    from rich.table import Table
+
+    table = Table(
+        title=f"[shell_prompt]{title}[/shell_prompt]",
+        border_style="#00897B",
+        box=box.ROUNDED,
+        header_style="bold #4FC3F7",
+        width=_common_panel_width,
+    )
+    for column in columns:
+        table.add_column(column)
+    for row in rows:
+        table.add_row(*[str(cell) for cell in row])
+    _get_console().print(table)
+
+
+def _print_plain_table(columns, rows, title):
+    rows = [[_markup_pattern.sub("", str(cell)) for cell in row] for row in rows]
+    widths = [
+        max([len(column), *[len(row[i]) for row in rows if i < len(row)]])
+        for i, column in enumerate(columns)
+    ]
+    _print_plain(f"--- {title}")
+    for row in [list(columns), *rows]:
+        _print_plain(
+            "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        )
+
+
+def _format_size(size):
+    """将字节数转换为更友好的格式"""
+    if size < 1024:
+        return f"{size}B"
+    if size < 1024 * 1024:
+        return f"{size/1024:.1f}KB"
+    if size < 1024 * 1024 * 1024:
+        return f"{size/(1024*1024):.1f}MB"
+    return f"{size/(1024*1024*1024):.1f}GB"
+
+
+def _entry_stat(entry):
+    # DirEntry 会缓存 lstat 的结果，同一条目只产生一次系统调用
+    try:
+        return entry.stat(follow_symlinks=False)
+    except OSError:
+        return None
+
+
+def _entry_sort_key(entry):
+    try:
+        is_dir = entry.is_dir(follow_symlinks=False)
+    except OSError:
+        is_dir = False
+    return not is_dir, entry.name.lower()
+
+
+def _entry_size(entry, root_dev):
+    """条目占用的大小，目录为其下所有文件大小之和（不跟随符号链接，不跨越文件系统）"""
+    st = _entry_stat(entry)
+    if st is None:
+        return 0
+    if stat.S_ISDIR(st.st_mode):
+        return _dir_size(entry.path, root_dev) if st.st_dev == root_dev else 0
+    return st.st_size if stat.S_ISREG(st.st_mode) else 0
+
+
+def _dir_size(path, root_dev):
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                total += _entry_size(entry, root_dev)
+    except OSError:
+        pass
+    return total
 
 
-def print_file_tree(start_dir=".", depth=2, title="Directory Structure"):
-    """显示美观的目录树结构"""
+def _walk_file_tree(path, emit, max_depth, limit, root_dev, current_depth=0):
+    """
+    遍历目录并按显示顺序产生事件，返回目录的总大小
+
+    事件依次为 ("dir", name, depth)、目录内容、("end", name, size, depth)；目录内容为
+    ("file", entry, stat, depth)、("more", count, size, depth)、("depth_limit", depth) 或 ("error", message, depth)。
+    每个目录只显示排序后的前 limit 个条目，其余条目汇总为一行
+    """
+    emit("dir", path.name or path.as_posix(), current_depth)
+    total = 0
+    try:
+        with os.scandir(path) as iterator:
+            entries = list(iterator)
+    except PermissionError:
+        entries = None
+        emit("error", "Permission denied", current_depth + 1)
+    except OSError as e:
+        entries = None
+        emit("error", str(e), current_depth + 1)
+
+    if entries is not None and current_depth >= max_depth:
+        # 达到最大深度时不再显示内容，但仍统计大小
+        total = sum(_entry_size(entry, root_dev) for entry in entries)
+        if entries:
+            emit("depth_limit", current_depth + 1)
+    elif entries is not None:
+        # 只对需要显示的条目排序
+        if limit and len(entries) > limit:
+            shown = heapq.nsmallest(limit, entries, key=_entry_sort_key)
+            shown_names = {entry.name for entry in shown}
+            omitted = [entry for entry in entries if entry.name not in shown_names]
+        else:
+            shown = sorted(entries, key=_entry_sort_key)
+            omitted = []
+        for entry in shown:
+            st = _entry_stat(entry)
+            if st is not None and stat.S_ISDIR(st.st_mode) and st.st_dev == root_dev:
+                total += _walk_file_tree(
+                    Path(entry.path),
+                    emit,
+                    max_depth,
+                    limit,
+                    root_dev,
+                    current_depth + 1,
+                )
+            else:
+                emit("file", entry, st, current_depth + 1)
+                if st is not None and stat.S_ISREG(st.st_mode):
+                    total += st.st_size
+        if omitted:
+            omitted_size = sum(_entry_size(entry, root_dev) for entry in omitted)
+            total += omitted_size
+            emit("more", len(omitted), omitted_size, current_depth + 1)
+
+    emit("end", path.name or path.as_posix(), total, current_depth)
+    return total
+
+
+def print_file_tree(
+    start_dir=".",
+    depth=2,
+    title="Directory Structure",
+    limit=DEFAULT_TREE_ENTRY_LIMIT,
+):
+    """显示美观的目录树结构，目录显示其下所有文件的总大小，每个目录最多显示 limit 个条目"""
     # 获取绝对路径
     start_path = Path(start_dir).resolve()
 
+    if is_plain_output():
+        _print_plain(f"--- {title} - {start_path}")
+        _print_plain(format_file_tree(start_path, depth, limit), markup=False)
+        return
+    root_dev = os.lstat(start_path).st_dev
+    from rich import box
+    from rich.panel import Panel
+
     # 创建目录树面板
     tree_panel = Panel(
-        _generate_file_tree(start_path, depth),
+        _generate_file_tree(start_path, depth, limit, root_dev),
         title=f"[tree_dir]{title}[/tree_dir] - [tree_file]{start_path}[/tree_file]",
         title_align="left",
         style="tree_dir",
@@ -321,89 +573,208 @@ def print_file_tree(start_dir=".", depth=2, title="Directory Structure"):
         width=_common_panel_width,
     )
 
-    _console.print(tree_panel)
+    _get_console().print(tree_panel)
 
 
-def _generate_file_tree(path, max_depth, current_depth=0):
-    """递归生成目录树结构"""
-    # 创建根节点
-    name = path.name + ("/" if path.is_dir() else "")
-    tree = Tree(
-        f"[tree_dir]{_get_file_icon(path)} {name}[/tree_dir]", guide_style="dim #546E7A"
-    )
-
-    # 达到最大深度时停止递归
-    if current_depth >= max_depth:
-        tree.add("[italic #90A4AE]... depth limit reached[/italic #90A4AE]")
-        return tree
-
-    # 处理目录
-    if path.is_dir():
-        try:
-            # 获取目录内容并按字母顺序排序
-            items = sorted(
-                path.iterdir(), key=lambda p: (not p.is_dir(), p.name.lower())
+def format_file_tree(start_dir=".", depth=2, limit=DEFAULT_TREE_ENTRY_LIMIT):
+    """以缩进的纯文本格式返回目录树"""
+    start_path = Path(start_dir).resolve()
+    root_dev = os.lstat(start_path).st_dev
+    return "\n".join(_generate_plain_file_tree(start_path, depth, limit, root_dev))
+
+
+def _generate_file_tree(path, max_depth, limit, root_dev):
+    """生成 rich 目录树结构"""
+    from rich.markup import escape
+    from rich.tree import Tree
+
+    nodes = []
+
+    def _emit(event, *args):
+        if event == "dir":
+            name, current_depth = args
+            label = f"[tree_dir]{FILE_ICONS['dir']} {escape(name)}/[/tree_dir]"
+            if nodes:
+                nodes.append(nodes[-1].add(label))
+            else:
+                nodes.append(Tree(label, guide_style="dim #546E7A"))
+        elif event == "end":
+            name, size, current_depth = args
+            node = nodes.pop() if len(nodes) > 1 else nodes[-1]
+            node.label = f"{node.label} [tree_size]({_format_size(size)})[/tree_size]"
+        elif event == "file":
+            entry, st, current_depth = args
+            nodes[-1].add(_get_file_label(entry, st))
+        elif event == "more":
+            count, size, current_depth = args
+            nodes[-1].add(
+                f"[italic #90A4AE]... {count} more ({_format_size(size)})[/italic #90A4AE]"
             )
+        elif event == "depth_limit":
+            nodes[-1].add("[italic #90A4AE]... depth limit reached[/italic #90A4AE]")
+        elif event == "error":
+            message, current_depth = args
+            if message == "Permission denied":
+                nodes[-1].add("[tree_special]🔒 Permission denied[/tree_special]")
+            else:
+                nodes[-1].add(f"[error]⚠ Error: {escape(message)}[/error]")
+
+    _walk_file_tree(path, _emit, max_depth, limit, root_dev)
+    return nodes[0]
+
+
+def _generate_plain_file_tree(path, max_depth, limit, root_dev):
+    """生成缩进的纯文本目录树，返回各行"""
+    # 目录的大小在遍历完其内容后才知道，每个目录的行先暂存，结束时再加上目录行
+    stack = []
+
+    def _emit(event, *args):
+        indent = "  " * args[-1]
+        if event == "dir":
+            stack.append([])
+        elif event == "end":
+            name, size, _ = args
+            lines = [f"{indent}{name}/ ({_format_size(size)})", *stack.pop()]
+            if stack:
+                stack[-1].extend(lines)
+            else:
+                stack.append(lines)
+        elif event == "file":
+            entry, st, _ = args
+            stack[-1].append(f"{indent}{_get_file_label(entry, st, markup=False)}")
+        elif event == "more":
+            count, size, _ = args
+            stack[-1].append(f"{indent}... {count} more ({_format_size(size)})")
+        elif event == "depth_limit":
+            stack[-1].append(f"{indent}... depth limit reached")
+        elif event == "error":
+            stack[-1].append(f"{indent}Error: {args[0]}")
+
+    _walk_file_tree(path, _emit, max_depth, limit, root_dev)
+    return stack[0]
+
+
+def write_file_tree_json(start_dir, out, depth=2, limit=DEFAULT_TREE_ENTRY_LIMIT):
+    """
+    以 JSON 格式将目录树流式写入 out，不在内存中构建整棵树
 
-            for item in items:
-                if item.is_dir():
-                    # 递归添加子目录
-                    tree.add(_generate_file_tree(item, max_depth, current_depth + 1))
-                else:
-                    # 添加文件
-                    file_label = _get_file_label(item)
-                    tree.add(file_label)
-        except PermissionError:
-            tree.add("[tree_special]🔒 Permission denied[/tree_special]")
-        except Exception as e:
-            tree.add(f"[error]⚠ Error: {str(e)}[/error]")
-
-    return tree
-
-
-def _get_file_icon(path):
+    目录节点为 {"name", "type": "dir", "children", "omitted", "omitted_size", "size"}，size 在子节点之后写出；
+    其他节点为 {"name", "type", "size"}，符号链接另有 "target"
+    """
+    start_path = Path(start_dir).resolve()
+    root_dev = os.lstat(start_path).st_dev
+    # 每层记录是否已写出子节点（用于逗号）与被省略的条目
+    stack = []
+
+    def _separator():
+        if stack:
+            if stack[-1]["written"]:
+                out.write(", ")
+            stack[-1]["written"] = True
+
+    def _emit(event, *args):
+        if event == "dir":
+            _separator()
+            out.write(f'{{"name": {json.dumps(args[0])}, "type": "dir", "children": [')
+            stack.append(
+                {"written": False, "omitted": 0, "omitted_size": 0, "error": None}
+            )
+        elif event == "end":
+            state = stack.pop()
+            out.write(
+                f'], "omitted": {state["omitted"]}, "omitted_size": {state["omitted_size"]}, '
+                f'"truncated": {json.dumps(state.get("truncated", False))}, '
+                f'"error": {json.dumps(state["error"])}, "size": {args[1]}}}'
+            )
+        elif event == "file":
+            entry, st, _ = args
+            node = {"name": entry.name, "type": _entry_type(st), "size": 0}
+            if st is not None and stat.S_ISREG(st.st_mode):
+                node["size"] = st.st_size
+            if st is not None and stat.S_ISLNK(st.st_mode):
+                node["target"] = _read_link(entry)
+            _separator()
+            out.write(json.dumps(node))
+        elif event == "more":
+            stack[-1]["omitted"], stack[-1]["omitted_size"] = args[0], args[1]
+        elif event == "depth_limit":
+            stack[-1]["truncated"] = True
+        elif event == "error":
+            stack[-1]["error"] = args[0]
+
+    _walk_file_tree(start_path, _emit, depth, limit, root_dev)
+    out.write("\n")
+    out.flush()
+
+
+def _entry_type(st):
+    if st is None:
+        return "unknown"
+    if stat.S_ISDIR(st.st_mode):
+        return "dir"
+    if stat.S_ISREG(st.st_mode):
+        return "file"
+    if stat.S_ISLNK(st.st_mode):
+        return "symlink"
+    return "special"
+
+
+def _read_link(entry):
+    try:
+        return os.readlink(entry.path)
+    except OSError:
+        return None
+
+
+def _get_file_icon(name, st=None):
     """根据文件类型获取对应的图标"""
-    if path.is_dir():
+    if st is not None and stat.S_ISDIR(st.st_mode):
         return FILE_ICONS["dir"]
+    if st is not None and stat.S_ISLNK(st.st_mode):
+        return FILE_ICONS["link"]
 
     # 获取文件扩展名
-    ext = path.suffix.lstrip(".").lower()
+    lower_name = name.lower()
+    ext = lower_name.rpartition(".")[2] if "." in lower_name.lstrip(".") else ""
 
     # 特殊文件名处理
-    if path.name.lower() == "dockerfile":
+    if lower_name == "dockerfile":
         return FILE_ICONS["dockerfile"]
-    if path.name.lower() == "makefile":
+    if lower_name == "makefile":
         return FILE_ICONS["makefile"]
-    if path.name.lower().startswith(".gitignore"):
+    if lower_name.startswith(".gitignore"):
         return FILE_ICONS["gitignore"]
-    if "license" in path.name.lower():
+    if "license" in lower_name:
         return FILE_ICONS["license"]
 
     # 返回对应扩展名的图标，没有则返回默认图标
     return FILE_ICONS.get(ext, FILE_ICONS["default"])
 
 
-def _get_file_label(path):
-    """获取文件的完整标签（图标+名称+大小）"""
+def _get_file_label(entry, st=None, markup=True):
+    """获取文件的完整标签（图标+名称+大小），st 为 DirEntry 缓存的 lstat 结果"""
     # 文件图标
-    icon = _get_file_icon(path)
-
-    # 文件大小（如果是文件）
+    icon = _get_file_icon(entry.name, st)
+    if not markup:
+        label = f"{icon} {entry.name}"
+        if st is not None and stat.S_ISREG(st.st_mode):
+            label += f" ({_format_size(st.st_size)})"
+        elif st is not None and stat.S_ISLNK(st.st_mode):
+            label += f" -> {_read_link(entry) or '?'}"
+        return label
+    from rich.markup import escape
+
+    # 文件大小（如果是普通文件）
     size_str = ""
-    if path.is_file():
-        size = path.stat().st_size
-        # 转换为更友好的格式
-        if size < 1024:
-            size_str = f" [tree_size]({size}B)[/tree_size]"
-        elif size < 1024 * 1024:
-            size_str = f" [tree_size]({size/1024:.1f}KB)[/tree_size]"
-        else:
-            size_str = f" [tree_size]({size/(1024*1024):.1f}MB)[/tree_size]"
+    if st is not None and stat.S_ISREG(st.st_mode):
+        size_str = f" [tree_size]({_format_size(st.st_size)})[/tree_size]"
+    elif st is not None and stat.S_ISLNK(st.st_mode):
+        size_str = f" [tree_size]-> {escape(_read_link(entry) or '?')}[/tree_size]"
 
     # 文件名样式
-    file_style = "tree_special" if path.name.startswith(".") else "tree_file"
+    file_style = "tree_special" if entry.name.startswith(".") else "tree_file"
 
-    return f"{icon} [{file_style}]{path.name}[/{file_style}]{size_str}"
+    return f"{icon} [{file_style}]{escape(entry.name)}[/{file_style}]{size_str}"
 
 
 def print_exception_info(exception=None):
@@ -415,7 +786,12 @@ def print_exception_info(exception=None):
         # 处理当前异常
         exc_type, exc_value, exc_traceback = sys.exc_info()
         if exc_type is None:
-            _console.print("[bold red]No active exception to print[/bold red]")
+            if is_plain_output():
+                _print_plain("No active exception to print")
+            else:
+                _get_console().print(
+                    "[bold red]No active exception to print[/bold red]"
+                )
             return
     else:
         # 处理指定的异常对象
@@ -433,6 +809,17 @@ def print_exception_info(exception=None):
     line_no = tb.lineno
     func_name = tb.name
 
+    if is_plain_output():
+        _print_plain(
+            f"EXCEPTION: {exc_name}: {exc_msg} "
+            f"({file_name}:{line_no} in {func_name}())",
+            markup=False,
+        )
+        return
+    from rich import box
+    from rich.panel import Panel
+    from rich.text import Text
+
     # 构建异常信息文本
     error_text = Text()
     error_text.append(" EXCEPTION ", style="bold white on red")
@@ -463,13 +850,22 @@ def print_exception_info(exception=None):
         width=_common_panel_width,
     )
 
-    _console.print(panel)
+    _get_console().print(panel)
 
 
 class ProgressManager:
     """进度条管理器"""
 
     def __init__(self):
+        from rich.progress import (
+            Progress,
+            BarColumn,
+            TextColumn,
+            TimeRemainingColumn,
+            TimeElapsedColumn,
+            SpinnerColumn,
+        )
+
         self.progress = Progress(
             SpinnerColumn("dots", style="progress_text"),
             TextColumn("[progress_text]{task.description}[/progress_text]"),
@@ -482,7 +878,7 @@ class ProgressManager:
             TextColumn("[progress_text]{task.percentage:>3.0f}%[/progress_text]"),
             TimeRemainingColumn(),
             TimeElapsedColumn(),
-            console=_console,
+            console=_get_console(),
             expand=True,
         )
         self.task_ids = {}
@@ -528,6 +924,13 @@ class ProgressManager:
 
 def print_header(title, version="1.0.0"):
     """打印应用标题头 - 带版本号"""
+    if is_plain_output():
+        _print_plain(f"{title} v{version}")
+        return
+    from rich import box
+    from rich.panel import Panel
+    from rich.text import Text
+
     header = Text()
     header.append("✨ ", style="bold #FFD54F")
     header.append(title, style="bold #4FC3F7")
@@ -544,12 +947,19 @@ def print_header(title, version="1.0.0"):
         subtitle_align="right",
         width=_common_panel_width,
     )
-    _console.print(panel)
-    _console.print()
+    _get_console().print(panel)
+    _get_console().print()
 
 
 def print_footer(message="All tasks completed!"):
     """打印应用底部信息 - 带成功状态"""
+    if is_plain_output():
+        _print_plain(message)
+        return
+    from rich import box
+    from rich.panel import Panel
+    from rich.text import Text
+
     footer = Text()
     footer.append("🎉 ", style="bold #66BB6A")
     footer.append(message, style="bold #66BB6A")
@@ -563,12 +973,19 @@ def print_footer(message="All tasks completed!"):
         padding=(1, 4),
         width=_common_panel_width,
     )
-    _console.print("\n")
-    _console.print(panel)
+    _get_console().print("\n")
+    _get_console().print(panel)
 
 
 def print_quote(text, author=None):
     """打印引用文本"""
+    if is_plain_output():
+        _print_plain(f"{text}\n    -- {author}" if author else text, markup=False)
+        return
+    from rich import box
+    from rich.panel import Panel
+    from rich.text import Text
+
     content = Text(text, style="italic #B0BEC5", justify="center")
     if author:
         content.append("\n\n— " + author, style="bold #90A4AE")
@@ -581,7 +998,7 @@ def print_quote(text, author=None):
         padding=(1, 4),
         width=_common_panel_width,
     )
-    _console.print(panel)
+    _get_console().print(panel)
 
 
 # if __name__ == "__main__":
@@ -0,0 +1,406 @@
+import atexit
+import json
+import os
+import shlex
+import shutil
+import signal
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+# 特权辅助进程：只通过 sudo 启动一次，之后的挂载、卸载等特权操作以 JSON 行的形式经 unix socket 批量提交，
+# 避免每条命令都重新执行 sudo 的 PAM/策略检查（以及中途的密码提示）。当前进程已是 root 时直接在进程内执行。
+# 辅助进程中只加载本模块，因此本模块只能导入标准库
+
+PRIVILEGED_OPERATIONS = ("losetup", "mount", "umount", "chown", "chmod", "mknod")
+_MKNOD_TYPES = {"c": stat.S_IFCHR, "b": stat.S_IFBLK, "p": stat.S_IFIFO}
+# 启动辅助进程的进程把 socket 路径写入环境变量，工作进程（无论 fork 还是 spawn）连接同一个辅助进程
+_SOCKET_ENV = "POSTOVERLAY_PRIVILEGED_SOCKET"
+_helper = None
+_helper_lock = threading.Lock()
+
+
+class PrivilegedOperationError(RuntimeError):
+    pass
+
+
+def _path_list(args):
+    paths = args["paths"]
+    if isinstance(paths, str):
+        paths = [paths]
+    return [Path(p) for p in paths]
+
+
+def _op_losetup(args):
+    if args.get("detach"):
+        return ["losetup", "--detach", str(args["detach"])]
+    command = ["losetup", "--find", "--show"]
+    if args.get("offset"):
+        command += ["--offset", str(int(args["offset"]))]
+    if args.get("sizelimit"):
+        command += ["--sizelimit", str(int(args["sizelimit"]))]
+    if args.get("read_only"):
+        command.append("--read-only")
+    return command + [str(args["image"])]
+
+
+def _op_mount(args):
+    command = ["mount"]
+    if args.get("type"):
+        command += ["-t", str(args["type"])]
+    if args.get("options"):
+        command += ["-o", str(args["options"])]
+    return command + [str(args["source"]), str(args["target"])]
+
+
+def _op_umount(args):
+    command = ["umount"]
+    if args.get("lazy"):
+        command.append("-l")
+    return command + [str(args["target"])]
+
+
+def _op_chown(args):
+    chown = os.chown if args.get("follow_symlinks", True) else os.lchown
+    for path in _path_list(args):
+        chown(path, int(args.get("uid", -1)), int(args.get("gid", -1)))
+
+
+def _op_chmod(args):
+    mode = int(args["mode"], 8) if isinstance(args["mode"], str) else int(args["mode"])
+    for path in _path_list(args):
+        os.chmod(path, mode)
+
+
+def _op_mknod(args):
+    node_type = _MKNOD_TYPES[args.get("type", "c")]
+    device = 0
+    if node_type != stat.S_IFIFO:
+        device = os.makedev(int(args["major"]), int(args["minor"]))
+    os.mknod(args["path"], int(args.get("mode", 0o600)) | node_type, device)
+
+
+# 需要外部命令的操作返回命令行，其余操作直接在辅助进程中通过系统调用完成
+_OPERATIONS = {
+    "losetup": _op_losetup,
+    "mount": _op_mount,
+    "umount": _op_umount,
+    "chown": _op_chown,
+    "chmod": _op_chmod,
+    "mknod": _op_mknod,
+}
+
+
+def _shlex_join(args):
+    return " ".join(shlex.quote(str(arg)) for arg in args)
+
+
+def _exec_command(argv):
+    """辅助进程中执行命令，返回值与 utils.exec_command 相同"""
+    try:
+        completed = subprocess.run(
+            argv,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            encoding="utf-8",
+            errors="replace",
+        )
+    except OSError as e:
+        return -1, None, None, e
+    return completed.returncode, completed.stdout, completed.stderr, None
+
+
+def describe_operation(op, args):
+    """将操作格式化为等价的 shell 命令，用于显示"""
+    if op in ("losetup", "mount", "umount"):
+        return _shlex_join(_OPERATIONS[op](args))
+    if op == "chown":
+        owner = f"{args.get('uid', '')}:{args.get('gid', '')}"
+        flag = [] if args.get("follow_symlinks", True) else ["-h"]
+        return _shlex_join(["chown", *flag, owner, *map(str, _path_list(args))])
+    if op == "chmod":
+        mode = args["mode"] if isinstance(args["mode"], str) else f"{args['mode']:o}"
+        return _shlex_join(["chmod", mode, *map(str, _path_list(args))])
+    if op == "mknod":
+        node = [args.get("type", "c")]
+        if node[0] != "p":
+            node += [str(args["major"]), str(args["minor"])]
+        mode = f"{int(args.get('mode', 0o600)):o}"
+        return _shlex_join(["mknod", "-m", mode, str(args["path"]), *node])
+    return op
+
+
+def _execute_operation(op, args, exec_command):
+    """执行一个白名单中的操作，返回结构化的结果"""
+    result = {
+        "op": op,
+        "return_code": -1,
+        "stdout": None,
+        "stderr": None,
+        "error": None,
+    }
+    if op not in _OPERATIONS:
+        result["error"] = f"operation not allowed: {op}"
+        return result
+    try:
+        result["command"] = describe_operation(op, args)
+        command = _OPERATIONS[op](args)
+    except (KeyError, TypeError, ValueError) as e:
+        result["error"] = f"invalid arguments for {op}: {e!r}"
+        return result
+    except OSError as e:
+        result["error"] = str(e)
+        return result
+    if command is None:
+        result["return_code"] = 0
+        return result
+    ret_code, stdout, stderr, exc = exec_command(command)
+    result.update(return_code=ret_code, stdout=stdout, stderr=stderr)
+    if exc is not None:
+        result["error"] = str(exc)
+    return result
+
+
+def execute_batch(operations, stop_on_error=True, exec_command=_exec_command):
+    """
+    依次执行一批操作，stop_on_error 为 True 时某个操作失败后不再执行后续操作
+
+    exec_command 用于执行需要外部命令的操作，在进程内执行时传入 utils.exec_command 以记录资源占用
+    """
+    results = []
+    for operation in operations:
+        result = _execute_operation(
+            operation.get("op"), operation.get("args") or {}, exec_command
+        )
+        results.append(result)
+        if stop_on_error and (result["error"] or result["return_code"] != 0):
+            break
+    return results
+
+
+def serve(stdin=None, stdout=None):
+    """辅助进程主循环：每行读取一个请求 {"id", "ops", "stop_on_error"}，每行返回一个 {"id", "results"}"""
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    for line in stdin:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            results = execute_batch(
+                request["ops"], stop_on_error=request.get("stop_on_error", True)
+            )
+            response = {"id": request.get("id"), "results": results}
+        except (KeyError, TypeError, ValueError) as e:
+            response = {"id": None, "error": f"invalid request: {e!r}"}
+        stdout.write(json.dumps(response) + "\n")
+        stdout.flush()
+    return 0
+
+
+def _serve_connection(connection):
+    with connection, connection.makefile(
+        "r", encoding="utf-8"
+    ) as reader, connection.makefile("w", encoding="utf-8") as writer:
+        serve(reader, writer)
+
+
+def serve_socket(socket_path, owner_uid):
+    """
+    在 socket_path 上监听并为每个连接执行 serve()，只有 owner_uid 可以连接
+
+    准备好后向 stdout 输出一行 `ready`；stdin 关闭（启动它的进程退出）时结束
+    """
+    # 中断信号由启动它的进程处理，辅助进程需要留下来执行清理时的卸载操作
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    os.chown(socket_path, owner_uid, -1)
+    os.chmod(socket_path, 0o600)
+    server.listen()
+
+    def accept():
+        while True:
+            connection, _ = server.accept()
+            threading.Thread(
+                target=_serve_connection, args=(connection,), daemon=True
+            ).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    sys.stdout.write("ready\n")
+    sys.stdout.flush()
+    for _ in sys.stdin:
+        pass
+    server.close()
+    os.unlink(socket_path)
+    return 0
+
+
+class PrivilegedHelper:
+    """
+    特权辅助进程的客户端
+
+    非 root 时通过 sudo 启动一次辅助进程（可能在此时提示输入密码），之后所有请求都经 unix socket 提交。
+    socket 路径通过环境变量传给工作进程，工作进程各自建立连接而不再启动新的辅助进程；
+    辅助进程在 stdin 管道关闭（启动它的进程及继承该管道的工作进程都退出）时结束。root 时直接在进程内执行
+    """
+
+    def __init__(self):
+        self._process = None
+        self._socket_dir = None
+        self._connection = None
+        self._reader = None
+        self._writer = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    @property
+    def in_process(self):
+        return os.geteuid() == 0 or shutil.which("sudo") is None
+
+    def _reset_after_fork(self):
+        # fork 出的工作进程继承了父进程的连接，不能与父进程共用，重新连接同一个辅助进程
+        if self._pid is not None and self._pid != os.getpid():
+            self._process = None
+            self._socket_dir = None
+            self._connection = None
+            self._reader = None
+            self._writer = None
+            self._pid = None
+
+    def _spawn(self):
+        self._socket_dir = tempfile.mkdtemp(prefix="postoverlay-privileged-")
+        socket_path = os.path.join(self._socket_dir, "helper.sock")
+        # 只把本模块所在目录（或 zipapp）加入 sys.path，辅助进程不需要加载命令行与其余模块
+        bootstrap = (
+            "import sys; sys.path.insert(0, sys.argv[1]); import privileged; "
+            "sys.exit(privileged.serve_socket(sys.argv[2], int(sys.argv[3])))"
+        )
+        self._process = subprocess.Popen(
+            [
+                "sudo",
+                sys.executable,
+                "-c",
+                bootstrap,
+                Path(__file__).resolve().parent.as_posix(),
+                socket_path,
+                str(os.getuid()),
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            encoding="utf-8",
+        )
+        if self._process.stdout.readline().strip() != "ready":
+            self._process.wait()
+            self._process = None
+            os.rmdir(self._socket_dir)
+            self._socket_dir = None
+            raise PrivilegedOperationError(
+                "privileged helper failed to start (sudo failed?)"
+            )
+        os.environ[_SOCKET_ENV] = socket_path
+        atexit.register(self.close)
+        return socket_path
+
+    def start(self):
+        """启动（或连接到已由父进程启动的）辅助进程，批量处理前在父进程中调用以便工作进程共用"""
+        with self._lock:
+            self._start()
+
+    def _start(self):
+        self._reset_after_fork()
+        if self._connection is not None or self.in_process:
+            return
+        socket_path = os.environ.get(_SOCKET_ENV) or self._spawn()
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(socket_path)
+        except OSError as e:
+            connection.close()
+            raise PrivilegedOperationError(
+                f"failed to connect to privileged helper: {e}"
+            ) from e
+        self._connection = connection
+        self._reader = connection.makefile("r", encoding="utf-8")
+        self._writer = connection.makefile("w", encoding="utf-8")
+        self._pid = os.getpid()
+
+    def execute(self, operations, stop_on_error=True):
+        """批量提交操作 [{"op": ..., "args": {...}}]，返回每个操作的结果"""
+        operations = list(operations)
+        for operation in operations:
+            if operation.get("op") not in PRIVILEGED_OPERATIONS:
+                raise PrivilegedOperationError(
+                    f"operation not allowed: {operation.get('op')}"
+                )
+        with self._lock:
+            self._start()
+            if self._connection is None:
+                # 在这里导入，辅助进程中不需要加载 utils（及其依赖的输出与资源统计模块）
+                from utils import exec_command
+
+                return execute_batch(
+                    operations, stop_on_error=stop_on_error, exec_command=exec_command
+                )
+            self._next_id += 1
+            request = {
+                "id": self._next_id,
+                "ops": operations,
+                "stop_on_error": stop_on_error,
+            }
+            try:
+                self._writer.write(json.dumps(request) + "\n")
+                self._writer.flush()
+                line = self._reader.readline()
+            except OSError as e:
+                raise PrivilegedOperationError(f"privileged helper failed: {e}") from e
+            if not line:
+                self._disconnect()
+                raise PrivilegedOperationError("privileged helper exited unexpectedly")
+            response = json.loads(line)
+            if response.get("error"):
+                raise PrivilegedOperationError(response["error"])
+            return response["results"]
+
+    def _disconnect(self):
+        if self._connection is None:
+            return
+        self._reader.close()
+        self._writer.close()
+        self._connection.close()
+        self._connection = None
+        self._reader = None
+        self._writer = None
+
+    def close(self):
+        with self._lock:
+            self._reset_after_fork()
+            self._disconnect()
+            if self._process is None:
+                return
+            os.environ.pop(_SOCKET_ENV, None)
+            self._process.stdin.close()
+            self._process.wait()
+            self._process.stdout.close()
+            self._process = None
+            os.rmdir(self._socket_dir)
+            self._socket_dir = None
+
+
+def get_privileged_helper():
+    """获取当前进程共享的特权辅助进程客户端"""
+    global _helper
+    with _helper_lock:
+        if _helper is None:
+            _helper = PrivilegedHelper()
+        return _helper
+
+
+def run_privileged(operations, stop_on_error=True):
+    """通过共享的特权辅助进程批量执行操作"""
+    return get_privileged_helper().execute(operations, stop_on_error=stop_on_error)
@@ -0,0 +1,219 @@
+import io
+import os
+import re
+from pathlib import Path
+
+# --profile 的实现：每个处理阶段（resources.measure_phase）使用独立的 cProfile，阶段之外的代码记录在 "main" 中，
+# 因此汇总中的每一项都可以标注其所属阶段。cProfile 只统计主线程，工作线程/进程中的代码不在统计范围内。
+# cProfile/pstats/tracemalloc 只在启用 --profile 时导入
+
+DEFAULT_PROFILE_TOP = 20
+MAIN_PHASE = "main"
+# tracemalloc 记录的调用栈深度
+_TRACEMALLOC_FRAMES = 10
+
+_state = {
+    "pid": None,
+    "profiles": {},
+    "stack": [],
+    "memory": False,
+    "allocations": {},
+}
+
+
+def is_profiling():
+    # 批量处理的工作进程由 fork 创建，会继承这里的状态，只在启动 profiling 的进程中生效
+    return _state["pid"] == os.getpid()
+
+
+def _enable_profile(phase):
+    import cProfile
+
+    profiles = _state["profiles"]
+    if phase not in profiles:
+        profiles[phase] = cProfile.Profile()
+    profiles[phase].enable()
+
+
+def _take_snapshot():
+    import tracemalloc
+
+    # 不统计 tracemalloc 自身与导入机制的内存分配
+    return tracemalloc.take_snapshot().filter_traces(
+        [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ]
+    )
+
+
+def enter_phase(name):
+    """进入一个处理阶段，之后的调用记录到该阶段的 profile 中"""
+    if not is_profiling():
+        return
+    # 先停止上一层的 profile，快照的耗时不计入任何阶段
+    _state["profiles"][_state["stack"][-1][0]].disable()
+    snapshot = _take_snapshot() if _state["memory"] else None
+    _state["stack"].append((name, snapshot))
+    _enable_profile(name)
+
+
+def exit_phase():
+    """离开当前阶段，恢复上一层阶段的 profile，并记录该阶段内存分配的变化"""
+    if not is_profiling() or len(_state["stack"]) <= 1:
+        return
+    name, before = _state["stack"].pop()
+    _state["profiles"][name].disable()
+    if before is not None:
+        stats = _take_snapshot().compare_to(before, "lineno")
+        allocations = _state["allocations"].setdefault(name, {})
+        for stat in stats:
+            frame = stat.traceback[0]
+            location = f"{frame.filename}:{frame.lineno}"
+            size, count = allocations.get(location, (0, 0))
+            allocations[location] = (size + stat.size_diff, count + stat.count_diff)
+    _state["profiles"][_state["stack"][-1][0]].enable()
+
+
+def _phase_slug(phase):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", phase).strip("_") or "phase"
+
+
+def _top_functions(phase, stats, top):
+    rows = []
+    for (filename, lineno, function), (
+        _,
+        ncalls,
+        tottime,
+        cumtime,
+        _,
+    ) in stats.stats.items():
+        rows.append(
+            (
+                phase,
+                f"{Path(filename).name}:{lineno}({function})",
+                ncalls,
+                tottime,
+                cumtime,
+            )
+        )
+    rows.sort(key=lambda row: row[4], reverse=True)
+    return rows[:top]
+
+
+def _format_size(size):
+    sign = "-" if size < 0 else ""
+    size = abs(size)
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return (
+                f"{sign}{size:.0f}{unit}" if unit == "B" else f"{sign}{size:.1f}{unit}"
+            )
+        size /= 1024
+    return f"{sign}{size:.1f}GiB"
+
+
+def run_profiled(func, prof_path, memory=False, top=DEFAULT_PROFILE_TOP):
+    """
+    在 cProfile（以及 memory 为 True 时的 tracemalloc）下执行 func，返回 func 的返回值
+
+    结束后将所有阶段合并写入 prof_path，各阶段另写入 <prof_path 去掉后缀>.<阶段>.prof；
+    按累计耗时与内存分配排序的前 top 项（标注所属阶段）写入 <prof_path>.txt 并输出
+    """
+    import tracemalloc
+
+    from utils import c_info, c_table
+
+    prof_path = Path(prof_path)
+    _state.update(pid=os.getpid(), profiles={}, stack=[], memory=memory, allocations={})
+    if memory:
+        tracemalloc.start(_TRACEMALLOC_FRAMES)
+    _state["stack"].append((MAIN_PHASE, None))
+    _enable_profile(MAIN_PHASE)
+    try:
+        return func()
+    finally:
+        # 异常退出时可能仍有未结束的阶段
+        while len(_state["stack"]) > 1:
+            exit_phase()
+        _state["profiles"][MAIN_PHASE].disable()
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+        if memory:
+            tracemalloc.stop()
+        _state["pid"] = None
+        _write_profile(prof_path, top, peak, c_info, c_table)
+
+
+def _write_profile(prof_path, top, peak, c_info, c_table):
+    import pstats
+
+    prof_path.parent.mkdir(parents=True, exist_ok=True)
+    # pstats.Stats 会取走 Profile 中的数据，每个阶段只转换一次
+    phase_stats = {}
+    for phase, profile in _state["profiles"].items():
+        stats = pstats.Stats(profile, stream=io.StringIO())
+        if not stats.stats:
+            continue
+        phase_stats[phase] = stats
+        if len(_state["profiles"]) > 1:
+            stats.dump_stats(
+                prof_path.with_name(f"{prof_path.stem}.{_phase_slug(phase)}.prof")
+            )
+    if not phase_stats:
+        return
+    combined = pstats.Stats(stream=io.StringIO())
+    for stats in phase_stats.values():
+        combined.add(stats)
+    combined.dump_stats(prof_path)
+
+    time_rows = sorted(
+        (
+            row
+            for phase, stats in phase_stats.items()
+            for row in _top_functions(phase, stats, top)
+        ),
+        key=lambda row: row[4],
+        reverse=True,
+    )[:top]
+    time_rows = [
+        [phase, location, ncalls, f"{tottime:.3f}s", f"{cumtime:.3f}s"]
+        for phase, location, ncalls, tottime, cumtime in time_rows
+    ]
+    time_columns = ["Phase", "Function", "Calls", "Total", "Cumulative"]
+    c_table(time_columns, time_rows, title=f"Profile - top {top} by cumulative time")
+    lines = [
+        "# cumulative time",
+        "\t".join(time_columns),
+        *["\t".join(map(str, row)) for row in time_rows],
+    ]
+
+    if peak is not None:
+        allocation_rows = sorted(
+            (
+                [phase, location, size, count]
+                for phase, allocations in _state["allocations"].items()
+                for location, (size, count) in allocations.items()
+            ),
+            key=lambda row: abs(row[2]),
+            reverse=True,
+        )[:top]
+        allocation_rows = [
+            [phase, location, _format_size(size), count]
+            for phase, location, size, count in allocation_rows
+        ]
+        allocation_columns = ["Phase", "Location", "Size", "Blocks"]
+        c_table(
+            allocation_columns,
+            allocation_rows,
+            title=f"Profile - top {top} by allocation (peak {_format_size(peak)})",
+        )
+        lines += [
+            "",
+            f"# allocation (peak {_format_size(peak)})",
+            "\t".join(allocation_columns),
+            *["\t".join(map(str, row)) for row in allocation_rows],
+        ]
+
+    summary_path = prof_path.with_name(prof_path.name + ".txt")
+    summary_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    c_info(f"profile written: {prof_path} (summary: {summary_path})")
@@ -1,7 +1,12 @@
+import functools
+import os
 import shutil
+from pathlib import Path
 
 from utils import run_command
 
+BINFMT_MISC_DIR = Path("/proc/sys/fs/binfmt_misc")
+
 
 def is_qemu_user_static_installed(qemu_bin="qemu-aarch64-static"):
     """检查是否已安装 QEMU 用户模式静态二进制文件"""
@@ -28,3 +33,55 @@ def install_qemu_user_static(*args, **kwargs):
         )
     else:
         raise NotImplementedError(f"unsupported distro: {distro_id}")
+
+
+def read_binfmt_entries(binfmt_dir=BINFMT_MISC_DIR):
+    """读取 binfmt_misc 中注册的解释器，返回 {名称: {"enabled", "interpreter", "flags"}}"""
+    binfmt_dir = Path(binfmt_dir)
+    entries = {}
+    if not binfmt_dir.is_dir():
+        return entries
+    for entry_file in binfmt_dir.iterdir():
+        if entry_file.name in ("register", "status"):
+            continue
+        try:
+            lines = entry_file.read_text().splitlines()
+        except OSError:
+            continue
+        entry = {"enabled": False, "interpreter": None, "flags": ""}
+        for line in lines:
+            if line == "enabled":
+                entry["enabled"] = True
+            elif line.startswith("interpreter "):
+                entry["interpreter"] = line.split(" ", 1)[1].strip()
+            elif line.startswith("flags:"):
+                entry["flags"] = line.split(":", 1)[1].strip()
+        entries[entry_file.name] = entry
+    return entries
+
+
+@functools.lru_cache(maxsize=None)
+def find_binfmt_entry(qemu_bin):
+    """查找 qemu_bin 对应的 binfmt_misc 注册项（结果会被缓存），未注册时返回 None"""
+    host_qemu_path = shutil.which(qemu_bin)
+    host_qemu_path = os.path.realpath(host_qemu_path) if host_qemu_path else None
+    qemu_name = Path(qemu_bin).name
+    for name, entry in read_binfmt_entries().items():
+        interpreter = entry["interpreter"]
+        if not entry["enabled"] or not interpreter:
+            continue
+        if (host_qemu_path and os.path.realpath(interpreter) == host_qemu_path) or Path(
+            interpreter
+        ).name == qemu_name:
+            return dict(entry, name=name)
+    return None
+
+
+def is_qemu_fix_binary(qemu_bin):
+    """
+    检查 qemu_bin 是否以 F（fix-binary）标志注册到 binfmt_misc
+
+    带有 F 标志时内核在注册时就已打开解释器，chroot 环境中无需提供 qemu 二进制文件
+    """
+    entry = find_binfmt_entry(qemu_bin)
+    return entry is not None and "F" in entry["flags"]
@@ -0,0 +1,250 @@
+import json
+import os
+import resource
+import select
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+
+from profiling import enter_phase, exit_phase
+
+# 一次命令执行或一个处理阶段的资源占用
+# max_rss 单位为 KiB；read_bytes/write_bytes 为实际落盘的 I/O（/proc/<pid>/io），不可用时为 None
+ResourceUsage = namedtuple(
+    "ResourceUsage",
+    ["wall", "user_cpu", "sys_cpu", "max_rss", "read_bytes", "write_bytes"],
+)
+
+_WAIT_POLL_INTERVAL = 0.05
+
+_records = []
+_records_lock = threading.Lock()
+_context = {"image": None}
+_local = threading.local()
+
+
+def read_proc_io(pid="self"):
+    """读取 /proc/<pid>/io 中的 read_bytes/write_bytes，无权限或不支持时返回 (None, None)"""
+    try:
+        content = Path(f"/proc/{pid}/io").read_text(encoding="ascii")
+    except OSError:
+        return None, None
+    counters = {}
+    for line in content.splitlines():
+        key, _, value = line.partition(":")
+        counters[key.strip()] = int(value)
+    return counters.get("read_bytes"), counters.get("write_bytes")
+
+
+def _wait_exited(pid, timeout):
+    """等待子进程退出但不回收（WNOWAIT），超时返回 False"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    pidfd = None
+    if hasattr(os, "pidfd_open"):
+        try:
+            pidfd = os.pidfd_open(pid)
+        except OSError:
+            pidfd = None
+    try:
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                remaining = 0
+            if pidfd is not None:
+                select.select([pidfd], [], [], remaining)
+            result = os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT | os.WNOHANG)
+            if result is not None:
+                return True
+            if remaining == 0:
+                return False
+            if pidfd is None:
+                time.sleep(min(_WAIT_POLL_INTERVAL, remaining or _WAIT_POLL_INTERVAL))
+    finally:
+        if pidfd is not None:
+            os.close(pidfd)
+
+
+def wait_process(process, timeout=None, started=None):
+    """
+    等待 Popen 进程结束并统计其资源占用，返回 (return_code, ResourceUsage)
+
+    进程退出后先通过 waitid(WNOWAIT) 读取僵尸进程的 /proc/<pid>/io（包含其已回收的子进程），
+    再通过 wait4 回收进程并获得 rusage。超时抛出 subprocess.TimeoutExpired，进程不会被回收
+    """
+    if process.returncode is not None:
+        return process.returncode, None
+    if not _wait_exited(process.pid, timeout):
+        raise subprocess.TimeoutExpired(process.args, timeout)
+    read_bytes, write_bytes = read_proc_io(process.pid)
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    usage = ResourceUsage(
+        wall=None if started is None else time.monotonic() - started,
+        user_cpu=rusage.ru_utime,
+        sys_cpu=rusage.ru_stime,
+        max_rss=rusage.ru_maxrss,
+        read_bytes=read_bytes,
+        write_bytes=write_bytes,
+    )
+    return process.returncode, usage
+
+
+def set_usage_context(image=None):
+    """设置后续记录所属的镜像"""
+    _context["image"] = image
+
+
+def get_usage_context():
+    """获取当前记录所属的镜像"""
+    return _context["image"]
+
+
+def record_usage(kind, name, usage, return_code=None, status=None):
+    """
+    记录一次资源占用，并作为当前线程最近一次命令的资源占用
+
+    status 默认根据 return_code 为 ok 或 failed；超时被终止的命令为 timeout，被中断的为 killed。无法统计时 usage 为 None，
+    此时仍然记录（各项资源为 null），报告中不会遗漏失败的命令
+    """
+    if kind == "command":
+        _local.last_usage = usage
+    if status is None:
+        status = "ok" if return_code in (None, 0) else "failed"
+    fields = dict.fromkeys(ResourceUsage._fields) if usage is None else usage._asdict()
+    with _records_lock:
+        _records.append(
+            {
+                "image": _context["image"],
+                "kind": kind,
+                "name": name,
+                "return_code": return_code,
+                "status": status,
+                **fields,
+            }
+        )
+
+
+def take_last_usage():
+    """取出当前线程最近一次命令的资源占用（只能取一次）"""
+    usage = getattr(_local, "last_usage", None)
+    _local.last_usage = None
+    return usage
+
+
+def get_usage_records(reset=False):
+    with _records_lock:
+        records = list(_records)
+        if reset:
+            _records.clear()
+    return records
+
+
+def extend_usage_records(records):
+    """合并其他进程（批量处理的工作进程）中的记录"""
+    with _records_lock:
+        _records.extend(records)
+
+
+def _sum_usage(self_usage, children_usage):
+    return (
+        self_usage.ru_utime + children_usage.ru_utime,
+        self_usage.ru_stime + children_usage.ru_stime,
+    )
+
+
+@contextmanager
+def measure_phase(name):
+    """
+    统计一个处理阶段（如 overlay 复制）的资源占用
+
+    CPU 时间为 RUSAGE_SELF 与 RUSAGE_CHILDREN 的增量，I/O 为 /proc/self/io 的增量，
+    max_rss 为进程启动以来到阶段结束时本进程与子进程的内存峰值（累计值，不是该阶段的峰值）。启用 --profile 时阶段内的调用单独统计
+    """
+    enter_phase(name)
+    started = time.monotonic()
+    user_before, sys_before = _sum_usage(
+        resource.getrusage(resource.RUSAGE_SELF),
+        resource.getrusage(resource.RUSAGE_CHILDREN),
+    )
+    read_before, write_before = read_proc_io()
+    try:
+        yield
+    finally:
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        user_after, sys_after = _sum_usage(self_usage, children_usage)
+        read_after, write_after = read_proc_io()
+        record_usage(
+            "phase",
+            name,
+            ResourceUsage(
+                wall=time.monotonic() - started,
+                user_cpu=user_after - user_before,
+                sys_cpu=sys_after - sys_before,
+                max_rss=max(self_usage.ru_maxrss, children_usage.ru_maxrss),
+                read_bytes=None if read_before is None else read_after - read_before,
+                write_bytes=(
+                    None if write_before is None else write_after - write_before
+                ),
+            ),
+        )
+        exit_phase()
+
+
+def _format_bytes(size):
+    if size is None:
+        return "n/a"
+    if size < 1024:
+        return f"{size} B"
+    for unit in ("KiB", "MiB", "GiB"):
+        size /= 1024
+        if size < 1024 or unit == "GiB":
+            return f"{size:.1f} {unit}"
+
+
+def format_usage_columns(usage):
+    """将资源占用格式化为 [wall, cpu, max rss, io] 四列文本"""
+    return [
+        "n/a" if usage.wall is None else f"{usage.wall:.2f}s",
+        f"{usage.user_cpu:.2f}s usr/{usage.sys_cpu:.2f}s sys",
+        _format_bytes(usage.max_rss * 1024),
+        f"{_format_bytes(usage.read_bytes)} r/{_format_bytes(usage.write_bytes)} w",
+    ]
+
+
+def format_usage(usage):
+    """将资源占用格式化为一行文本"""
+    if usage is None:
+        return ""
+    wall, cpu, max_rss, io = format_usage_columns(usage)
+    return f"wall {wall} | cpu {cpu} | rss {max_rss} | io {io}"
+
+
+def get_phase_usages(image=None):
+    """获取镜像各处理阶段的资源占用 [(name, ResourceUsage)]"""
+    return [
+        (record["name"], ResourceUsage(*[record[f] for f in ResourceUsage._fields]))
+        for record in get_usage_records()
+        if record["kind"] == "phase" and record["image"] == image
+    ]
+
+
+def write_usage_report(report_path):
+    """将所有记录写入 JSON 格式的资源占用报告"""
+    report_path = Path(report_path)
+    report = {
+        "version": 1,
+        "notes": {
+            "max_rss": "KiB; for commands the peak of the command, for phases the "
+            "cumulative peak of the process and its children up to the end of "
+            "the phase (not a per-phase value)",
+            "status": "ok, failed, timeout or killed; resources are null when the "
+            "command could not be measured",
+        },
+        "records": get_usage_records(),
+    }
+    report_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return report_path
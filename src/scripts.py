@@ -1,9 +1,72 @@
 import os
+import re
+import secrets
+import shlex
 import shutil
 import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
 from pathlib import Path
 
-from utils import bash_exec, c_warning, c_info, c_shell_command
+from metrics import inc_counter
+from mount import _run_privileged_operations
+from privileged import PrivilegedOperationError
+from qemu import find_binfmt_entry, is_qemu_fix_binary
+from utils import (
+    bash_exec,
+    c_error,
+    c_warning,
+    c_info,
+    c_shell_command,
+    c_table,
+)
+
+_DEPENDS_PATTERN = re.compile(r"^#\s*depends\s*:(.*)$", re.IGNORECASE)
+# 与 run-parts 相同，忽略隐藏文件、备份文件与包管理器遗留的文件
+_SCRIPT_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.-]*$")
+_IGNORED_SCRIPT_SUFFIXES = (
+    "~",
+    ".bak",
+    ".orig",
+    ".rej",
+    ".swp",
+    ".disabled",
+    ".dpkg-old",
+    ".dpkg-new",
+    ".dpkg-dist",
+)
+
+# 脚本目录中的一个步骤，depends 为其依赖的步骤名称
+ScriptStep = namedtuple("ScriptStep", ["name", "path", "depends"])
+
+# 步骤的执行结果，status 为 ok/failed/skipped
+StepResult = namedtuple(
+    "StepResult",
+    ["name", "status", "ret_code", "elapsed", "stdout", "stderr", "exc"],
+)
+
+
+class ScriptExecutionError(RuntimeError):
+    pass
+
+
+def check_script_result(result, name="script", raise_error=False):
+    """检查脚本执行结果，执行失败时输出错误信息，raise_error 为 True 时抛出 ScriptExecutionError"""
+    if result is None:
+        return True
+    ret_code, _, _, exc = result
+    if exc is None and ret_code == 0:
+        return True
+    inc_counter("errors", operation="script")
+    if exc is not None:
+        c_error(f"{name} failed: {exc}")
+    else:
+        c_error(f"{name} failed with exit code {ret_code}")
+    if raise_error:
+        raise ScriptExecutionError(f"{name} failed")
+    return False
 
 
 def chroot_mount(mount_point, *args, **kwargs):
@@ -31,32 +94,158 @@ def chroot_mount(mount_point, *args, **kwargs):
     return ret_code, stdout, stderr, exc
 
 
-def setup_qemu_for_chroot(mount_point, qemu_bin):
+QEMU_MODE_FIX_BINARY = "fix-binary"
+QEMU_MODE_BIND = "bind"
+QEMU_MODE_BIND_PLACEHOLDER = "bind-placeholder"
+QEMU_MODE_COPY = "copy"
+# qemu 在私有命名空间中 bind-mount，宿主机上只需要（可能创建的）挂载目标
+QEMU_MODE_NAMESPACE = "namespace"
+QEMU_MODE_NAMESPACE_PLACEHOLDER = "namespace-placeholder"
+
+
+def get_qemu_target_path(mount_point, qemu_bin):
+    # 优先使用 binfmt_misc 中注册的解释器路径，内核在 chroot 中按该路径查找解释器
+    entry = find_binfmt_entry(qemu_bin)
+    if entry is not None and entry["interpreter"]:
+        return mount_point / entry["interpreter"].lstrip("/")
+    return mount_point / "usr/bin" / qemu_bin
+
+
+QemuSetup = namedtuple("QemuSetup", ["mode", "created_dirs"])
+
+
+def _make_parent_dirs(path, mount_point):
+    """创建 path 的上级目录，返回新创建的目录（由深到浅），清理时按该顺序删除"""
+    created = []
+    parent = path.parent
+    while parent != mount_point and not parent.exists():
+        created.append(parent)
+        parent = parent.parent
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return created
+
+
+def _bind_mount_qemu(host_qemu_path, target_qemu_path, display_path):
+    """通过特权辅助进程只读 bind-mount qemu，失败时返回 False"""
+    try:
+        _run_privileged_operations(
+            [
+                {
+                    "op": "mount",
+                    "args": {
+                        "options": "bind",
+                        "source": host_qemu_path,
+                        "target": target_qemu_path.as_posix(),
+                    },
+                }
+            ]
+        )
+    except PrivilegedOperationError:
+        return False
+    try:
+        _run_privileged_operations(
+            [
+                {
+                    "op": "mount",
+                    "args": {
+                        "options": "remount,bind,ro",
+                        "source": host_qemu_path,
+                        "target": target_qemu_path.as_posix(),
+                    },
+                }
+            ]
+        )
+        return True
+    except PrivilegedOperationError:
+        # 不能以可写方式暴露宿主机的 qemu 二进制文件
+        c_warning(f"failed to remount {display_path} read-only, unmounting it")
+        _unmount_qemu(target_qemu_path)
+        return False
+
+
+def _unmount_qemu(target_qemu_path):
+    _run_privileged_operations(
+        [{"op": "umount", "args": {"target": target_qemu_path.as_posix()}}]
+    )
+
+
+def setup_qemu_for_chroot(mount_point, qemu_bin, mode=None, namespace=False):
     """
     为 chroot 环境设置 QEMU 仿真
+
+    qemu 以 F（fix-binary）标志注册到 binfmt_misc 时无需任何操作；否则将宿主机的 qemu 二进制文件
+    只读 bind-mount 到 $ROOTFS 中，bind-mount 失败时才退化为复制。namespace 为 True 时 bind-mount
+    在脚本的私有命名空间中进行，这里只准备挂载目标。返回 QemuSetup(实际采用的方式, 在镜像中新创建的目录)
     """
-    c_info(f"copying {qemu_bin} to $ROOTFS/usr/bin/")
     mount_point = Path(mount_point)
+    if mode is None and is_qemu_fix_binary(qemu_bin):
+        mode = QEMU_MODE_FIX_BINARY
+    if mode == QEMU_MODE_FIX_BINARY:
+        c_info(f"{qemu_bin} is registered with fix-binary flag, skip qemu provisioning")
+        return QemuSetup(mode, [])
+
     host_qemu_path = shutil.which(qemu_bin)
-    target_qemu_dir = mount_point / "usr/bin"
-    target_qemu_dir.mkdir(parents=True, exist_ok=True)
-    target_qemu_path = target_qemu_dir / qemu_bin
+    target_qemu_path = get_qemu_target_path(mount_point, qemu_bin)
+    display_path = f"$ROOTFS/{target_qemu_path.relative_to(mount_point).as_posix()}"
+    created_dirs = _make_parent_dirs(target_qemu_path, mount_point)
+
+    if namespace or mode in (QEMU_MODE_NAMESPACE, QEMU_MODE_NAMESPACE_PLACEHOLDER):
+        c_info(
+            f"{qemu_bin} will be bind-mounted to {display_path} inside the namespace"
+        )
+        if target_qemu_path.exists():
+            return QemuSetup(QEMU_MODE_NAMESPACE, created_dirs)
+        target_qemu_path.touch()
+        return QemuSetup(QEMU_MODE_NAMESPACE_PLACEHOLDER, created_dirs)
 
+    if mode in (None, QEMU_MODE_BIND, QEMU_MODE_BIND_PLACEHOLDER):
+        c_info(f"bind-mounting {qemu_bin} to {display_path} (read-only)")
+        # bind-mount 需要一个已存在的挂载目标
+        placeholder = not target_qemu_path.exists()
+        if placeholder:
+            target_qemu_path.touch()
+        if _bind_mount_qemu(host_qemu_path, target_qemu_path, display_path):
+            mode = QEMU_MODE_BIND_PLACEHOLDER if placeholder else QEMU_MODE_BIND
+            return QemuSetup(mode, created_dirs)
+        c_warning(f"failed to bind-mount {qemu_bin}, falling back to copying it")
+        if placeholder and target_qemu_path.exists():
+            target_qemu_path.unlink()
+
+    c_info(f"copying {qemu_bin} to {display_path}")
     # 复制 QEMU 静态二进制文件
     shutil.copy2(host_qemu_path, target_qemu_path)
-    os.chmod(target_qemu_path, 0o777)
+    os.chmod(target_qemu_path, 0o755)
+    return QemuSetup(QEMU_MODE_COPY, created_dirs)
 
 
-def cleanup_qemu_for_chroot(mount_point, qemu_bin):
+def cleanup_qemu_for_chroot(
+    mount_point, qemu_bin, mode=QEMU_MODE_COPY, created_dirs=()
+):
     """
-    清理 chroot 环境的 QEMU 仿真设置
+    清理 chroot 环境的 QEMU 仿真设置，并删除设置时在镜像中新创建的（仍为空的）目录
+
+    mode 为 None（尚未完成设置）时不做任何操作，避免删除镜像中原有的 qemu 二进制文件
     """
     mount_point = Path(mount_point)
-    target_qemu_dir = mount_point / "usr/bin"
-    target_qemu_path = target_qemu_dir / qemu_bin
-    c_info(f"removing {qemu_bin} from $ROOTFS/usr/bin/")
-    if target_qemu_path.exists():
+    if mode in (None, QEMU_MODE_FIX_BINARY):
+        return
+    target_qemu_path = get_qemu_target_path(mount_point, qemu_bin)
+    display_path = f"$ROOTFS/{target_qemu_path.relative_to(mount_point).as_posix()}"
+    if mode in (QEMU_MODE_BIND, QEMU_MODE_BIND_PLACEHOLDER):
+        c_info(f"unmounting {qemu_bin} from {display_path}")
+        _unmount_qemu(target_qemu_path)
+    if mode == QEMU_MODE_NAMESPACE_PLACEHOLDER:
+        c_info(f"removing placeholder of {qemu_bin} from {display_path}")
+    elif mode in (QEMU_MODE_BIND_PLACEHOLDER, QEMU_MODE_COPY):
+        c_info(f"removing {qemu_bin} from {display_path}")
+    if mode not in (QEMU_MODE_BIND, QEMU_MODE_NAMESPACE) and target_qemu_path.exists():
         target_qemu_path.unlink()
+    for directory in created_dirs:
+        try:
+            directory.rmdir()
+        except OSError as e:
+            # 脚本可能在其中创建了文件，此时保留目录
+            c_warning(f"failed to remove directory {directory}: {e}")
 
 
 def chroot_umount(mount_point, *args, **kwargs):
@@ -83,11 +272,82 @@ def chroot_umount(mount_point, *args, **kwargs):
     return ret_code, stdout, stderr, exc
 
 
+_NAMESPACE_ENV = "POSTOVERLAY_NAMESPACE_TOKEN"
+
+
+@lru_cache(maxsize=None)
+def is_namespace_available():
+    """检查能否通过 unshare 创建私有的 mount 与 PID 命名空间"""
+    if not shutil.which("unshare"):
+        return False
+    ret_code, _, _, exc = bash_exec(
+        "unshare --mount --propagation private --pid --fork true", mode="string"
+    )
+    return exc is None and ret_code == 0
+
+
+def get_namespace_prelude(mount_point, qemu_bin=None):
+    """
+    生成在私有命名空间中执行脚本的前置代码
+
+    脚本通过 unshare 在新的 mount/PID 命名空间中重新执行自身，随后在命名空间内挂载 proc、sys、dev、run
+    （以及只读 bind-mount 的 qemu）。命名空间中的最后一个进程退出时，内核会一次性回收所有挂载并终止残留进程，
+    宿主机的挂载表不受影响。是否已在命名空间中通过每次生成的随机令牌判断，
+    不会被调用者环境中继承的同名变量误导而在宿主机上挂载
+    """
+    rootfs = shlex.quote(Path(mount_point).as_posix())
+    token = secrets.token_hex(16)
+    lines = [
+        f'if [ "${_NAMESPACE_ENV}" != "{token}" ]; then',
+        f'    {_NAMESPACE_ENV}={token} exec unshare --mount --propagation private --pid --fork --kill-child "$0" "$@"',
+        "fi",
+        f"unset {_NAMESPACE_ENV}",
+        f"mount -t proc proc {rootfs}/proc || exit $?",
+        f"mount -t sysfs sysfs {rootfs}/sys || exit $?",
+        f"mount --rbind /dev {rootfs}/dev || exit $?",
+        f"mount --bind /run {rootfs}/run || exit $?",
+    ]
+    if qemu_bin:
+        host_qemu_path = shlex.quote(shutil.which(qemu_bin) or qemu_bin)
+        target_qemu_path = shlex.quote(
+            get_qemu_target_path(Path(mount_point), qemu_bin).as_posix()
+        )
+        lines.extend(
+            [
+                f"mount --bind {host_qemu_path} {target_qemu_path} || exit $?",
+                f"mount -o remount,bind,ro {target_qemu_path} || exit $?",
+            ]
+        )
+    return "\n".join(lines) + "\n"
+
+
+def _copy_script_to_rootfs(mount_point, script_path):
+    """将脚本复制到 $ROOTFS/tmp 中，返回 (宿主机上的路径, chroot 中的路径, 新建的 tmp 目录或 None)"""
+    tmp_dir = mount_point / "tmp"
+    created_dir = None
+    # tmp 为（可能指向宿主机的）符号链接时改用根目录
+    if tmp_dir.is_symlink():
+        tmp_dir = mount_point
+    elif not tmp_dir.exists():
+        tmp_dir.mkdir(mode=0o1777)
+        created_dir = tmp_dir
+    fd, host_path = tempfile.mkstemp(
+        dir=tmp_dir, prefix="postoverlay-", suffix=f"-{script_path.name}"
+    )
+    with os.fdopen(fd, "wb") as f:
+        f.write(script_path.read_bytes())
+    os.chmod(host_path, 0o755)
+    host_path = Path(host_path)
+    return host_path, "/" + host_path.relative_to(mount_point).as_posix(), created_dir
+
+
 def chroot_exec(
     mount_point,
     script_path,
     encoding="utf-8",
     title="Script Execution",
+    output_panel_title="Command Output",
+    namespace_prelude=None,
     *args,
     **kwargs,
 ):
@@ -95,27 +355,36 @@ def chroot_exec(
     script_path = Path(script_path)
     script_content = script_path.read_text(encoding=encoding)
 
-    rootfs = mount_point.as_posix()
-
-    prepare_script = (
-        f"#!/bin/bash\n"
-        + f"chroot {rootfs} && echo 'chroot activated' || exit 1\n"
-        + f"#------------{script_path.as_posix()} start------------#\n"
-    )
+    rootfs = shlex.quote(mount_point.as_posix())
 
-    # 添加激活chroot的行
-    script_content = (
-        prepare_script
-        + script_content.strip()
-        + f"\n#------------{script_path.as_posix()} end-------------#\n"
-    )
     tmp_path = None
+    chroot_script_path = None
+    created_dir = None
     try:
-        # 将脚本内容写入临时文件
+        # 脚本复制到 $ROOTFS/tmp 中执行：遵循脚本自身的 shebang（没有时优先使用 /bin/bash），
+        # 标准输入为 /dev/null，脚本中读取标准输入的命令不会读到脚本内容
+        chroot_script_path, inner_path, created_dir = _copy_script_to_rootfs(
+            mount_point, script_path
+        )
+        inner_path = shlex.quote(inner_path)
+        if script_content.startswith("#!"):
+            chroot_command = f"chroot {rootfs} {inner_path}"
+        else:
+            chroot_command = (
+                f"chroot {rootfs} /bin/sh -c "
+                '\'if [ -x /bin/bash ]; then exec /bin/bash "$0"; else exec /bin/sh "$0"; fi\' '
+                f"{inner_path}"
+            )
+        wrapper_script = (
+            "#!/bin/bash\n"
+            + (namespace_prelude or "")
+            + f"{chroot_command} </dev/null || exit $?\n"
+        )
+        # 将包装脚本写入临时文件
         with tempfile.NamedTemporaryFile(
             mode="w", delete=False, encoding=encoding, suffix=".sh"
         ) as tmp:
-            tmp.write(script_content)
+            tmp.write(wrapper_script)
             tmp_path = tmp.name
         # 设置执行权限
         os.chmod(tmp_path, 0o777)
@@ -130,19 +399,310 @@ def chroot_exec(
         )
 
         c_shell_command(
-            command=script_content,
+            command=wrapper_script
+            + f"#------------{script_path.as_posix()} start------------#\n"
+            + script_content.strip()
+            + f"\n#------------{script_path.as_posix()} end-------------#\n",
             stdout=stdout,
             stderr=stderr,
             return_code=ret_code,
             tile=title,
+            output_panel_title=output_panel_title,
         )
         return ret_code, stdout, stderr, exc
     except BaseException as e:
         raise e
     finally:
-        # 删除临时文件
+        # 删除临时文件与复制到 rootfs 中的脚本
         if tmp_path and Path(tmp_path).exists():
             os.unlink(tmp_path)
+        if chroot_script_path is not None and chroot_script_path.exists():
+            chroot_script_path.unlink()
+        if created_dir is not None:
+            try:
+                created_dir.rmdir()
+            except OSError:
+                pass
+
+
+class ChrootSession:
+    """
+    chroot 会话
+
+    qemu 配置与 chroot 挂载在首次执行脚本时进行，之后会话中的所有脚本共享同一个 chroot 环境；
+    无论执行是否成功，退出会话时都只清理一次。namespace 为 True 时每个脚本都在独立的私有 mount/PID
+    命名空间中执行，chroot 所需的挂载只存在于该命名空间中，宿主机上不需要挂载与卸载；
+    系统不支持时退回到宿主机上的挂载
+    """
+
+    def __init__(self, mount_point, qemu_bin=None, namespace=False):
+        self.mount_point = Path(mount_point)
+        self.qemu_bin = qemu_bin
+        self.namespace = namespace
+        # qemu 配置方式在会话中只检测一次
+        self.qemu_mode = None
+        self.qemu_created_dirs = []
+        self.active = False
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def namespace_prelude(self):
+        """在私有命名空间中执行脚本的前置代码，未使用命名空间时为 None"""
+        if not self.active or not self.namespace:
+            return None
+        qemu_bin = None
+        if self.qemu_mode in (QEMU_MODE_NAMESPACE, QEMU_MODE_NAMESPACE_PLACEHOLDER):
+            qemu_bin = self.qemu_bin
+        return get_namespace_prelude(self.mount_point, qemu_bin=qemu_bin)
+
+    def open(self, *args, **kwargs):
+        """准备 chroot 环境，已准备时直接返回"""
+        if self.active:
+            return self
+        if self.closed:
+            raise RuntimeError("chroot session already closed")
+        if self.namespace and not is_namespace_available():
+            c_warning(
+                "private mount/pid namespaces are not available, "
+                "falling back to mounting the chroot environment on the host"
+            )
+            self.namespace = False
+        c_info(f"setting up chroot environment")
+        qemu_setup = setup_qemu_for_chroot(
+            mount_point=self.mount_point,
+            qemu_bin=self.qemu_bin,
+            mode=self.qemu_mode,
+            namespace=self.namespace,
+        )
+        # qemu 设置成功后才标记为激活，保证 chroot 挂载中途失败时也能被清理
+        self.qemu_mode = qemu_setup.mode
+        self.qemu_created_dirs = qemu_setup.created_dirs
+        self.active = True
+        if self.namespace:
+            c_info(
+                "chroot mounts will be set up in a private namespace for each script"
+            )
+        else:
+            chroot_mount(mount_point=self.mount_point, *args, **kwargs)
+        return self
+
+    def close(self, *args, **kwargs):
+        """清理 chroot 环境，多次调用时只执行一次"""
+        if self.closed:
+            return
+        self.closed = True
+        if not self.active:
+            return
+        self.active = False
+        try:
+            cleanup_qemu_for_chroot(
+                mount_point=self.mount_point,
+                qemu_bin=self.qemu_bin,
+                mode=self.qemu_mode,
+                created_dirs=self.qemu_created_dirs,
+            )
+        except BaseException as e:
+            c_warning(f"failed to cleanup qemu for chroot: {e}")
+
+        # 命名空间中的挂载已随命名空间一起被内核回收
+        if self.namespace:
+            return
+        try:
+            chroot_umount(mount_point=self.mount_point, *args, **kwargs)
+        except BaseException as e:
+            c_warning(f"failed to umount chroot: {e}")
+
+
+def _read_script_depends(script_path, encoding="utf-8"):
+    # 只在脚本开头的注释块中查找 `# depends:` 头部
+    for line in script_path.read_text(encoding=encoding).splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith("#"):
+            break
+        match = _DEPENDS_PATTERN.match(line)
+        if match:
+            return [d for d in re.split(r"[\s,]+", match.group(1).strip()) if d]
+    return None
+
+
+def _check_script_cycles(steps):
+    remaining = {step.name: set(step.depends) for step in steps}
+    while remaining:
+        ready = [name for name, depends in remaining.items() if not depends]
+        if not ready:
+            raise ValueError(
+                f"circular dependency between scripts: {', '.join(sorted(remaining))}"
+            )
+        for name in ready:
+            del remaining[name]
+        for depends in remaining.values():
+            depends.difference_update(ready)
+
+
+def load_script_dir(script_dir, encoding="utf-8"):
+    """
+    读取 run-parts 风格的脚本目录，返回按文件名排序的 ScriptStep 列表
+
+    带有 `# depends: a b` 头部的脚本只依赖列出的脚本（可省略后缀），没有该头部的脚本依赖排在它前面的脚本，
+    与 run-parts 顺序执行的语义一致。依赖不存在或存在环时抛出 ValueError
+    """
+    script_dir = Path(script_dir)
+    paths = [
+        path
+        for path in sorted(script_dir.iterdir())
+        if path.is_file()
+        and _SCRIPT_NAME_PATTERN.match(path.name)
+        and not path.name.endswith(_IGNORED_SCRIPT_SUFFIXES)
+    ]
+    names = {}
+    for path in paths:
+        names[path.name] = path.name
+        names.setdefault(path.stem, path.name)
+
+    steps = []
+    previous = None
+    for path in paths:
+        depends = _read_script_depends(path, encoding)
+        if depends is None:
+            depends = [previous] if previous else []
+        else:
+            for dependency in depends:
+                if dependency not in names:
+                    raise ValueError(
+                        f"{script_dir / path.name}: unknown dependency `{dependency}`"
+                    )
+            depends = [names[dependency] for dependency in depends]
+        steps.append(ScriptStep(name=path.name, path=path, depends=tuple(depends)))
+        previous = path.name
+    _check_script_cycles(steps)
+    return steps
+
+
+def _run_script_step(step, *args, **kwargs):
+    started = time.monotonic()
+    try:
+        result = execute_script(*args, script_path=step.path, **kwargs)
+    except Exception as e:
+        result = (-1, None, None, e)
+    elapsed = time.monotonic() - started
+    if result is None:
+        return StepResult(step.name, "ok", 0, elapsed, None, None, None)
+    ret_code, stdout, stderr, exc = result
+    status = "ok" if exc is None and ret_code == 0 else "failed"
+    return StepResult(step.name, status, ret_code, elapsed, stdout, stderr, exc)
+
+
+def execute_script_dir(
+    mount_point,
+    script_dir,
+    encoding="utf-8",
+    qemu_bin=None,
+    title="Script Execution",
+    session=None,
+    stream=False,
+    timeout=None,
+    jobs=None,
+):
+    """
+    按依赖关系并行执行脚本目录中的脚本，所有脚本共享同一个 chroot 会话
+
+    最多同时执行 jobs 个脚本；某个脚本失败后不再启动新的脚本，尚未执行的脚本被标记为 skipped。
+    执行结束后输出每个脚本的耗时与退出码，返回值与 execute_script 相同（取第一个失败的脚本）
+    """
+    script_dir = Path(script_dir)
+    steps = load_script_dir(script_dir, encoding=encoding)
+    if not steps:
+        c_warning(f"no script found in {script_dir}, nothing to execute")
+        return None
+    jobs = max(min(jobs or os.cpu_count() or 1, len(steps)), 1)
+    c_info(f"executing {len(steps)} script(s) in {script_dir} with {jobs} worker(s)")
+
+    owns_session = qemu_bin and session is None
+    if owns_session:
+        session = ChrootSession(mount_point, qemu_bin=qemu_bin)
+    results = {}
+    try:
+        # chroot 环境在启动工作线程前准备好，避免并发初始化
+        if qemu_bin:
+            session.open()
+        pending = {step.name: step for step in steps}
+        running = {}
+        failed = False
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            while pending or running:
+                for name, step in list(pending.items()):
+                    if failed or len(running) >= jobs:
+                        break
+                    if all(
+                        d in results and results[d].status == "ok" for d in step.depends
+                    ):
+                        del pending[name]
+                        future = executor.submit(
+                            _run_script_step,
+                            step,
+                            mount_point=mount_point,
+                            encoding=encoding,
+                            qemu_bin=qemu_bin,
+                            title=f"{title}: {step.name}",
+                            session=session,
+                            stream=stream,
+                            timeout=timeout,
+                        )
+                        running[future] = step
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    results[step.name] = future.result()
+                    failed = failed or results[step.name].status != "ok"
+    finally:
+        if owns_session:
+            session.close()
+
+    rows = []
+    first_failure = None
+    for step in steps:
+        result = results.get(step.name) or StepResult(
+            step.name, "skipped", None, 0.0, None, None, None
+        )
+        if result.status == "failed" and first_failure is None:
+            first_failure = result
+        status = {
+            "ok": "[success]OK[/success]",
+            "failed": "[error]FAILED[/error]",
+            "skipped": "[warning]SKIPPED[/warning]",
+        }[result.status]
+        rows.append(
+            [
+                step.name,
+                status,
+                "" if result.ret_code is None else result.ret_code,
+                f"{result.elapsed:.1f}s",
+                ", ".join(step.depends),
+            ]
+        )
+    c_table(
+        ["Script", "Status", "Exit Code", "Time", "Depends"],
+        rows,
+        title=f"{title} - {script_dir.as_posix()}",
+    )
+    if first_failure is not None:
+        return (
+            first_failure.ret_code,
+            first_failure.stdout,
+            first_failure.stderr,
+            first_failure.exc,
+        )
+    return 0, None, None, None
 
 
 def execute_script(
@@ -151,11 +711,35 @@ def execute_script(
     encoding="utf-8",
     qemu_bin=None,
     title="Script Execution",
+    session=None,
+    stream=False,
+    timeout=None,
+    jobs=None,
     *args,
     **kwargs,
 ):
+    """
+    执行脚本，指定 qemu_bin 时在 chroot 环境中执行
+
+    stream 为 True 时实时输出脚本的 stdout/stderr；timeout 为脚本的最长执行时间（秒），
+    超时后脚本所在的整个进程组会被终止。script_path 为目录时按依赖关系并行执行其中的脚本，
+    最多同时执行 jobs 个
+    """
     mount_point = Path(mount_point)
     script_path = Path(script_path)
+    if script_path.is_dir():
+        return execute_script_dir(
+            mount_point=mount_point,
+            script_dir=script_path,
+            encoding=encoding,
+            qemu_bin=qemu_bin,
+            title=title,
+            session=session,
+            stream=stream,
+            timeout=timeout,
+            jobs=jobs,
+        )
+    output_panel_title = "Command Output (tail)" if stream else "Command Output"
 
     if not qemu_bin:
         script_content = script_path.read_text(encoding=encoding).strip()
@@ -165,7 +749,12 @@ def execute_script(
 
         c_info(f"executing script in host environment: {script_path}")
         ret_code, stdout, stderr, exc = bash_exec(
-            script_path, mode="file", *args, **kwargs
+            script_path,
+            mode="file",
+            stream=stream,
+            timeout=timeout,
+            *args,
+            **kwargs,
         )
         c_shell_command(
             command=script_content,
@@ -173,31 +762,33 @@ def execute_script(
             stderr=stderr,
             return_code=ret_code,
             tile=title,
+            output_panel_title=output_panel_title,
         )
         return ret_code, stdout, stderr, exc
 
+    # 未提供会话时为本次执行创建临时会话
+    owns_session = session is None
+    if owns_session:
+        session = ChrootSession(mount_point, qemu_bin=qemu_bin)
     try:
-        c_info(f"setting up chroot environment")
-        # os.chmod(mount_point, 0o777)
-        setup_qemu_for_chroot(mount_point=mount_point, qemu_bin=qemu_bin)
-        chroot_mount(mount_point=mount_point, *args, **kwargs)
-        c_info(f"executing script in chroot environment")
+        session.open(*args, **kwargs)
+        if session.namespace:
+            c_info(f"executing script in chroot environment (private namespace)")
+        else:
+            c_info(f"executing script in chroot environment")
         return chroot_exec(
             mount_point=mount_point,
             script_path=script_path,
             encoding=encoding,
+            output_panel_title=output_panel_title,
+            namespace_prelude=session.namespace_prelude,
+            stream=stream,
+            timeout=timeout,
             *args,
             **kwargs,
         )
     except BaseException as e:
         raise e
     finally:
-        try:
-            cleanup_qemu_for_chroot(mount_point=mount_point, qemu_bin=qemu_bin)
-        except BaseException as e:
-            c_warning(f"failed to cleanup qemu for chroot: {e}")
-
-        try:
-            chroot_umount(mount_point=mount_point, *args, **kwargs)
-        except BaseException as e:
-            c_warning(f"failed to umount chroot: {e}")
+        if owns_session:
+            session.close(*args, **kwargs)
@@ -0,0 +1,204 @@
+import fcntl
+import os
+import shutil
+from pathlib import Path
+
+from image import get_image_size, iter_chunks, iter_data_ranges, read_image_range
+from utils import c_info, c_success, c_warning
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+
+SNAPSHOT_SUFFIX = ".postoverlay-snapshot"
+UNDO_BLOCK_SIZE = 1024 * 1024
+
+
+def reflink_clone(src_path, dest_path):
+    """通过 FICLONE 创建文件的 reflink 副本（写时复制），不支持时抛出 OSError"""
+    with open(src_path, "rb") as src, open(dest_path, "wb") as dest:
+        fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+    shutil.copystat(src_path, dest_path)
+
+
+def _punch_hole(fd, offset, length):
+    try:
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.fallocate.argtypes = [
+            ctypes.c_int,
+            ctypes.c_int,
+            ctypes.c_int64,
+            ctypes.c_int64,
+        ]
+        if (
+            libc.fallocate(
+                fd, FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE, offset, length
+            )
+            == 0
+        ):
+            return
+    except (OSError, AttributeError):
+        pass
+    os.pwrite(fd, b"\0" * length, offset)
+
+
+class ImageSnapshot:
+    """
+    镜像快照
+
+    优先使用 reflink 克隆镜像文件，回滚时将克隆再克隆回镜像文件；文件系统不支持 reflink 时，
+    退化为块级 undo 日志：仅保存镜像中的数据区间（保留空洞），回滚时只写回发生变化的块。
+    undo 日志不是写前复制，创建时复制全部数据、回滚时比较全部数据块，开销与数据量成正比
+
+    磁盘镜像中的分区（指定了 size）使用以偏移量区分的快照文件，回滚时只写回该分区的区间，
+    不影响同一磁盘镜像中其他分区的处理
+    """
+
+    def __init__(self, image_path, block_size=UNDO_BLOCK_SIZE, offset=0, size=None):
+        self.image_path = Path(image_path)
+        # undo 日志只记录并回滚 [offset, offset + size) 区间（如磁盘镜像中的一个分区）
+        self.offset = offset
+        self.size = size
+        partition_suffix = "" if size is None else f".{offset}"
+        self.snapshot_path = self.image_path.with_name(
+            self.image_path.name + partition_suffix + SNAPSHOT_SUFFIX
+        )
+        self.block_size = block_size
+        self.mode = None
+
+    def take(self):
+        """创建快照"""
+        if self.snapshot_path.exists():
+            c_warning(f"stale snapshot found, replacing: {self.snapshot_path}")
+            self.snapshot_path.unlink()
+        try:
+            reflink_clone(self.image_path, self.snapshot_path)
+            self.mode = "reflink"
+        except OSError as e:
+            c_info(f"reflink not available ({e}), falling back to undo log")
+            if self.snapshot_path.exists():
+                self.snapshot_path.unlink()
+            self._write_undo_log()
+            self.mode = "undo-log"
+        c_success(f"snapshot taken ({self.mode}): {self.snapshot_path}")
+        return self
+
+    def _range_end(self, image_size):
+        if self.size is None:
+            return image_size
+        return min(self.offset + self.size, image_size)
+
+    def _write_undo_log(self):
+        image_size = get_image_size(self.image_path)
+        with open(self.image_path, "rb") as src, open(self.snapshot_path, "wb") as dest:
+            dest.truncate(image_size)
+            for offset, length in iter_data_ranges(
+                self.image_path, self.offset, self._range_end(image_size)
+            ):
+                copied = 0
+                while copied < length:
+                    n = os.copy_file_range(
+                        src.fileno(),
+                        dest.fileno(),
+                        length - copied,
+                        offset + copied,
+                        offset + copied,
+                    )
+                    if n == 0:
+                        break
+                    copied += n
+        shutil.copystat(self.image_path, self.snapshot_path)
+
+    def rollback(self):
+        """将镜像回滚到快照状态"""
+        if self.mode is None or not self.snapshot_path.exists():
+            c_warning("no snapshot to roll back to")
+            return False
+        c_info(f"rolling back {self.image_path} from snapshot ({self.mode})...")
+        if self.mode == "reflink" and self.size is None:
+            self._restore_reflink()
+            restored = None
+        elif self.mode == "reflink":
+            # 克隆的是整个磁盘镜像，只写回本分区中发生变化的块
+            restored = self._restore_changed_blocks()
+            self.snapshot_path.unlink()
+        else:
+            restored = self._restore_changed_blocks()
+            self.snapshot_path.unlink()
+        self.mode = None
+        if restored is None:
+            c_success(f"{self.image_path} rolled back")
+        else:
+            c_success(f"{self.image_path} rolled back ({restored} block(s) restored)")
+        return True
+
+    def _restore_reflink(self):
+        # 将快照克隆回原有的镜像文件（而不是替换文件），保留其所有者、权限与硬链接
+        image_stat = os.stat(self.image_path)
+        snapshot_stat = os.stat(self.snapshot_path)
+        try:
+            with open(self.snapshot_path, "rb") as src, open(
+                self.image_path, "r+b"
+            ) as dest:
+                fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+        except OSError as e:
+            c_warning(f"failed to clone the snapshot back ({e}), replacing the image")
+            os.replace(self.snapshot_path, self.image_path)
+            os.chown(self.image_path, image_stat.st_uid, image_stat.st_gid)
+            return
+        os.utime(
+            self.image_path, ns=(snapshot_stat.st_atime_ns, snapshot_stat.st_mtime_ns)
+        )
+        self.snapshot_path.unlink()
+
+    def _restore_changed_blocks(self):
+        image_size = get_image_size(self.snapshot_path)
+        start, end = self.offset, self._range_end(image_size)
+        # 快照和当前镜像中任一方包含数据的区间都可能发生变化
+        ranges = sorted(
+            [
+                *iter_data_ranges(self.snapshot_path, start, end),
+                *iter_data_ranges(self.image_path, start, end),
+            ]
+        )
+        restored = 0
+        fd = os.open(self.image_path, os.O_RDWR)
+        try:
+            os.ftruncate(fd, image_size)
+            snapshot_data = list(iter_data_ranges(self.snapshot_path, start, end))
+            last_end = start
+            for range_start, size in ranges:
+                range_end = range_start + size
+                range_start = max(range_start, last_end)
+                if range_end <= range_start:
+                    continue
+                for offset, length in iter_chunks(
+                    range_start, range_end, self.block_size
+                ):
+                    original = read_image_range(self.snapshot_path, offset, length)
+                    current = read_image_range(self.image_path, offset, length)
+                    if original == current:
+                        continue
+                    restored += 1
+                    in_hole = not any(
+                        s < offset + length and offset < s + n for s, n in snapshot_data
+                    )
+                    if in_hole:
+                        _punch_hole(fd, offset, length)
+                    else:
+                        os.pwrite(fd, original, offset)
+                last_end = range_end
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return restored
+
+    def discard(self):
+        """删除快照"""
+        if self.snapshot_path.exists():
+            c_info(f"removing snapshot: {self.snapshot_path}")
+            self.snapshot_path.unlink()
+        self.mode = None
@@ -0,0 +1,279 @@
+import fcntl
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import time
+from pathlib import Path
+
+from image import get_image_size, iter_chunks, iter_data_ranges, read_image_range
+from utils import c_info, c_success, c_warning
+
+DEFAULT_STEP_CACHE_SIZE = 4096 * 1024 * 1024
+STEP_CACHE_INDEX = "index.json"
+_DIGEST_CHUNK_SIZE = 64 * 1024 * 1024
+_DELETIONS_MEMBER = ".postoverlay-deletions"
+
+
+def get_default_cache_dir():
+    """获取默认的步骤缓存目录（$XDG_CACHE_HOME/postoverlay/steps）"""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "postoverlay" / "steps"
+
+
+def _chunk_digest(image_path, offset, length):
+    return hashlib.sha256(read_image_range(image_path, offset, length)).digest()
+
+
+def hash_image(image_path, offset=0, size=None, jobs=None):
+    """
+    计算镜像（或其中 offset 起 size 字节的区间）内容的 SHA-256 摘要
+
+    镜像按固定大小分块并行计算，空洞按全 0 处理，因此摘要与镜像的稀疏布局无关
+    """
+    image_size = get_image_size(image_path) - offset if size is None else size
+    end = offset + image_size
+    data_ranges = list(iter_data_ranges(image_path, offset, end))
+    zero_digests = {}
+    chunks = []
+    for chunk_offset, length in iter_chunks(offset, end, _DIGEST_CHUNK_SIZE):
+        has_data = any(
+            start < chunk_offset + length and chunk_offset < start + n
+            for start, n in data_ranges
+        )
+        chunks.append((chunk_offset, length, has_data))
+
+    # 在这里导入，--help 等不需要加载 multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    digest = hashlib.sha256()
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as executor:
+        futures = [
+            (
+                executor.submit(_chunk_digest, image_path, chunk_offset, length)
+                if has_data
+                else None
+            )
+            for chunk_offset, length, has_data in chunks
+        ]
+        for (_, length, _), future in zip(chunks, futures):
+            if future is None:
+                if length not in zero_digests:
+                    zero_digests[length] = hashlib.sha256(b"\0" * length).digest()
+                digest.update(zero_digests[length])
+            else:
+                digest.update(future.result())
+    return digest.hexdigest()
+
+
+def hash_step(parent_key, definition, paths=()):
+    """计算步骤的缓存键：上一步骤的键、步骤定义与脚本内容（目录按文件名排序）的链式摘要"""
+    digest = hashlib.sha256()
+    digest.update((parent_key or "").encode("utf-8") + b"\0")
+    digest.update(json.dumps(definition, sort_keys=True).encode("utf-8") + b"\0")
+    for path in paths:
+        path = Path(path)
+        files = (
+            sorted(p for p in path.rglob("*") if p.is_file())
+            if path.is_dir()
+            else [path]
+        )
+        for file in files:
+            digest.update(
+                file.relative_to(path.parent).as_posix().encode("utf-8") + b"\0"
+            )
+            digest.update(file.read_bytes() + b"\0")
+    return digest.hexdigest()
+
+
+def scan_rootfs_state(mount_point):
+    """
+    记录 $ROOTFS 中所有文件的元数据，用于计算步骤产生的变更
+
+    返回 (state, foreign)，挂载在 $ROOTFS 中的其他文件系统（proc/dev 以及 bind-mount 的 qemu）记录在 foreign 中
+    """
+    mount_point = Path(mount_point)
+    root_dev = os.lstat(mount_point).st_dev
+    state = {}
+    foreign = set()
+    for dir_path, dir_names, file_names in os.walk(mount_point):
+        kept = []
+        for name in [*dir_names, *file_names]:
+            path = os.path.join(dir_path, name)
+            try:
+                st = os.lstat(path)
+            except FileNotFoundError:
+                continue
+            rel_path = os.path.relpath(path, mount_point)
+            if st.st_dev != root_dev:
+                foreign.add(rel_path)
+                continue
+            state[rel_path] = (
+                st.st_mode,
+                st.st_uid,
+                st.st_gid,
+                st.st_size,
+                st.st_mtime_ns,
+                st.st_ctime_ns,
+                st.st_ino,
+            )
+            if name in dir_names:
+                kept.append(name)
+        dir_names[:] = kept
+    return state, foreign
+
+
+def diff_rootfs_state(before, after):
+    """比较两次扫描结果，返回 (变更的路径, 删除的路径)"""
+    before_state, before_foreign = before
+    after_state, after_foreign = after
+    foreign = before_foreign | after_foreign
+
+    def _is_foreign(rel_path):
+        parts = rel_path.split(os.sep)
+        return any(os.sep.join(parts[:i]) in foreign for i in range(1, len(parts) + 1))
+
+    changed = [
+        rel_path
+        for rel_path, meta in after_state.items()
+        if before_state.get(rel_path) != meta
+    ]
+    deleted = [
+        rel_path
+        for rel_path in before_state
+        if rel_path not in after_state and not _is_foreign(rel_path)
+    ]
+    return sorted(changed), sorted(deleted)
+
+
+class StepCache:
+    """
+    内容寻址的步骤缓存
+
+    每个步骤的缓存键由上一步骤的键、步骤定义与脚本内容计算得到，缓存内容为步骤对 $ROOTFS 产生的变更
+    （变更文件的 tar 归档与删除列表）。命中时直接重放变更而不再执行脚本；缓存总大小超过上限时按最近使用时间淘汰。
+    tar 归档不保存扩展属性（如 file capabilities）
+    """
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_STEP_CACHE_SIZE):
+        self.cache_dir = Path(cache_dir) if cache_dir else get_default_cache_dir()
+        self.max_size = max_size
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _entry_path(self, key):
+        return self.cache_dir / f"{key}.tar"
+
+    def _update_index(self, update):
+        # 多个进程可能同时使用缓存，索引读写需要加锁
+        with open(self.cache_dir / (STEP_CACHE_INDEX + ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            index_path = self.cache_dir / STEP_CACHE_INDEX
+            try:
+                index = json.loads(index_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                index = {}
+            update(index)
+            tmp_path = index_path.with_name(index_path.name + "~")
+            tmp_path.write_text(json.dumps(index, indent=2), encoding="utf-8")
+            os.replace(tmp_path, index_path)
+
+    def replay(self, key, mount_point, name="step"):
+        """缓存命中时将步骤的变更重放到 $ROOTFS，返回是否命中"""
+        entry_path = self._entry_path(key)
+        if not entry_path.is_file():
+            return False
+        c_info(f"step cache hit for {name} ({key[:12]}), replaying changes...")
+        mount_point = Path(mount_point)
+        with tarfile.open(entry_path, "r") as tar:
+            members = tar.getmembers()
+            deletions = json.loads(
+                tar.extractfile(_DELETIONS_MEMBER).read().decode("utf-8")
+            )
+            for rel_path in reversed(deletions):
+                _remove_path(mount_point / rel_path)
+            members = [m for m in members if m.name != _DELETIONS_MEMBER]
+            for member in members:
+                target = mount_point / member.name
+                # 不能沿着已存在的符号链接写入，否则可能写到 $ROOTFS 之外
+                if os.path.lexists(target) and not (
+                    member.isdir() and target.is_dir() and not target.is_symlink()
+                ):
+                    _remove_path(target)
+            if hasattr(tarfile, "fully_trusted_filter"):
+                tar.extractall(
+                    mount_point,
+                    members=members,
+                    numeric_owner=True,
+                    filter="fully_trusted",
+                )
+            else:
+                tar.extractall(mount_point, members=members, numeric_owner=True)
+
+        def _touch(index):
+            if key in index:
+                index[key]["last_used"] = time.time()
+
+        self._update_index(_touch)
+        c_success(
+            f"{name} replayed from step cache "
+            f"({len(members)} changed, {len(deletions)} deleted)"
+        )
+        return True
+
+    def store(self, key, mount_point, before, name="step"):
+        """将步骤执行前后 $ROOTFS 的变更保存到缓存"""
+        mount_point = Path(mount_point)
+        changed, deleted = diff_rootfs_state(before, scan_rootfs_state(mount_point))
+        entry_path = self._entry_path(key)
+        tmp_path = entry_path.with_name(entry_path.name + f".{os.getpid()}~")
+        try:
+            with tarfile.open(tmp_path, "w", format=tarfile.PAX_FORMAT) as tar:
+                for rel_path in changed:
+                    tar.add(mount_point / rel_path, arcname=rel_path, recursive=False)
+                data = json.dumps(deleted).encode("utf-8")
+                info = tarfile.TarInfo(_DELETIONS_MEMBER)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+            os.replace(tmp_path, entry_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+        size = entry_path.stat().st_size
+
+        def _add(index):
+            index[key] = {"name": name, "size": size, "last_used": time.time()}
+            self._evict(index)
+
+        self._update_index(_add)
+        c_info(
+            f"{name} stored in step cache ({key[:12]}, "
+            f"{len(changed)} changed, {len(deleted)} deleted, {size} bytes)"
+        )
+
+    def _evict(self, index):
+        # 索引中不存在的缓存文件视为已被删除
+        for key in [k for k in index if not self._entry_path(k).is_file()]:
+            del index[key]
+        total = sum(entry["size"] for entry in index.values())
+        for key in sorted(index, key=lambda k: index[k]["last_used"]):
+            if total <= self.max_size:
+                break
+            c_info(f"evicting step cache entry {key[:12]} ({index[key]['name']})")
+            total -= index[key]["size"]
+            self._entry_path(key).unlink(missing_ok=True)
+            del index[key]
+
+
+def _remove_path(path):
+    try:
+        if path.is_dir() and not path.is_symlink():
+            shutil.rmtree(path)
+        else:
+            path.unlink()
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        c_warning(f"failed to remove {path}: {e}")
@@ -1,17 +1,60 @@
+import os
 import shlex
+import shutil
+import signal
 import subprocess
+import sys
+import threading
+import time
+from collections import deque
 from pathlib import Path
 
 from pretty import (
+    DEFAULT_TREE_ENTRY_LIMIT,
     print_exception_info,
     print_info,
     print_error,
     print_success,
     print_warning,
     print_debug,
+    format_file_tree,
     print_file_tree,
     print_shell_command,
+    print_stream_line,
+    print_table,
+    write_file_tree_json,
 )
+from resources import format_usage, record_usage, take_last_usage, wait_process
+
+# 流式输出时保留在内存中用于最终汇总面板的行数
+DEFAULT_TAIL_LINES = 200
+# 超时后先发送 SIGTERM，等待该时间后仍未退出则发送 SIGKILL
+KILL_GRACE_PERIOD = 5
+
+_log_file = None
+_log_lock = threading.Lock()
+
+
+def open_log_file(log_path):
+    """打开日志文件（追加模式，行缓冲）"""
+    global _log_file
+    close_log_file()
+    _log_file = open(log_path, "a", encoding="utf-8", buffering=1)
+
+
+def close_log_file():
+    global _log_file
+    if _log_file is not None:
+        _log_file.close()
+        _log_file = None
+
+
+def c_log(message):
+    """写入一行日志，未打开日志文件时忽略"""
+    if _log_file is None:
+        return
+    with _log_lock:
+        _log_file.write(f"{message}\n")
 
 
 def c_error(message, print_message=True):
@@ -50,14 +93,43 @@ def c_exception_info(exception=None, print_exception=True):
     print_exception_info(exception)
 
 
-def c_file_tree(start_dir, depth=1, title="Directory Structure", print_tree=True):
+def c_file_tree(
+    start_dir,
+    depth=1,
+    title="Directory Structure",
+    print_tree=True,
+    limit=DEFAULT_TREE_ENTRY_LIMIT,
+    tree_format="text",
+    output=None,
+):
+    """显示目录树，tree_format 为 json 时流式写入 output（未指定时写入 stdout）"""
     if not print_tree:
         return
     start_dir = Path(start_dir)
     if not start_dir.is_dir():
         c_error(f"{start_dir} is not a directory", print_message=True)
         return
-    print_file_tree(start_dir=start_dir, depth=depth, title=title)
+    if tree_format == "json":
+        if output is None:
+            write_file_tree_json(start_dir, sys.stdout, depth=depth, limit=limit)
+            return
+        with open(output, "w", encoding="utf-8") as f:
+            write_file_tree_json(start_dir, f, depth=depth, limit=limit)
+        c_info(f"file tree written to {output}")
+        return
+    if output is not None:
+        # 文本格式写入文件时使用纯文本输出
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(format_file_tree(start_dir, depth=depth, limit=limit) + "\n")
+        c_info(f"file tree written to {output}")
+        return
+    print_file_tree(start_dir=start_dir, depth=depth, title=title, limit=limit)
+
+
+def c_table(columns, rows, title="Summary", print_message=True):
+    if not print_message:
+        return
+    print_table(columns, rows, title=title)
 
 
 def c_shell_command(
@@ -70,7 +142,10 @@ def c_shell_command(
     output_panel_title="Command Output",
     error_panel_title="Error Output",
     print_command=True,
+    usage=None,
 ):
+    # 未指定时使用当前线程最近一次执行的命令的资源占用
+    usage = usage or take_last_usage()
     if not print_command:
         return
     print_shell_command(
@@ -82,6 +157,7 @@ def c_shell_command(
         command_panel_title=command_panel_title,
         output_panel_title=output_panel_title,
         error_panel_title=error_panel_title,
+        resource_usage=format_usage(usage),
     )
 
 
@@ -92,9 +168,13 @@ def bash_exec(
     encoding="utf-8",
     timeout=None,
     no_bash_exec=False,
+    stream=False,
+    tail_lines=DEFAULT_TAIL_LINES,
 ):
     if not script:
         return -1, None, None, ValueError("script not provided")
+    # 清除上一次执行的资源占用，避免显示在本次命令的面板中
+    take_last_usage()
 
     if mode not in ("string", "file"):
         raise ValueError("mode must be either 'string' or 'file'")
@@ -115,25 +195,203 @@ def bash_exec(
     if cwd:
         cwd = Path(cwd).as_posix()
 
-    try:
-        result = subprocess.run(
-            cmd,
-            cwd=cwd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            shell=False,
-            encoding=encoding,
-            errors="replace",
-            timeout=timeout,
+    if stream:
+        return stream_exec(
+            cmd, cwd=cwd, encoding=encoding, timeout=timeout, tail_lines=tail_lines
         )
-        return (
-            result.returncode,
-            result.stdout.strip(),
-            result.stderr.strip(),
-            None,
+
+    return _run_process(cmd, cwd=cwd, encoding=encoding, timeout=timeout)
+
+
+def exec_command(
+    argv,
+    cwd=None,
+    encoding="utf-8",
+    timeout=None,
+    stream=False,
+    tail_lines=DEFAULT_TAIL_LINES,
+):
+    """
+    直接执行参数列表形式的命令（不经过 bash -c），返回值与 bash_exec 相同
+
+    可执行文件预先在 PATH 中解析为绝对路径，使 subprocess 可以使用 posix_spawn/vfork 创建进程
+    """
+    take_last_usage()
+    argv = [str(arg) for arg in argv]
+    if not argv:
+        return -1, None, None, ValueError("command not provided")
+    executable = shutil.which(argv[0])
+    if executable is None:
+        return -1, None, None, FileNotFoundError(f"command not found: {argv[0]}")
+    argv = [executable, *argv[1:]]
+    if cwd:
+        cwd = Path(cwd).as_posix()
+    if stream:
+        return stream_exec(
+            argv, cwd=cwd, encoding=encoding, timeout=timeout, tail_lines=tail_lines
         )
+    # Python 创建的文件描述符默认不可继承，无需 close_fds，从而满足 posix_spawn 的使用条件
+    return _run_process(
+        argv, cwd=cwd, encoding=encoding, timeout=timeout, close_fds=False
+    )
+
+
+def _run_process(cmd, cwd=None, encoding="utf-8", timeout=None, close_fds=True):
+    started = time.monotonic()
+    # 指定超时时命令在独立的进程组中执行，超时后终止整个进程组（包括后台的子进程）；
+    # 未指定时不创建新的会话，使 subprocess 可以使用 posix_spawn
+    new_session = timeout is not None
+    process = subprocess.Popen(
+        cmd,
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        shell=False,
+        encoding=encoding,
+        errors="replace",
+        close_fds=close_fds,
+        start_new_session=new_session,
+    )
+    # 输出由读取线程收集，进程由 wait_process 回收以便统计资源占用
+    outputs = {}
+    readers = [
+        threading.Thread(
+            target=_read_stream, args=(process.stdout, "stdout", outputs), daemon=True
+        ),
+        threading.Thread(
+            target=_read_stream, args=(process.stderr, "stderr", outputs), daemon=True
+        ),
+    ]
+    for reader in readers:
+        reader.start()
+    try:
+        ret_code, usage = wait_process(process, timeout=timeout, started=started)
     except subprocess.TimeoutExpired as e:
+        usage = _kill_process_group(process, started)
+        record_usage("command", _describe_command(cmd), usage, -1, status="timeout")
         return -1, None, None, e
+    except BaseException:
+        if new_session:
+            usage = _kill_process_group(process, started)
+        else:
+            process.kill()
+            usage = wait_process(process, started=started)[1]
+        record_usage("command", _describe_command(cmd), usage, -1, status="killed")
+        raise
+    finally:
+        # 脱离进程组的后台进程可能一直持有管道，不无限等待读取线程
+        for reader in readers:
+            reader.join(timeout=KILL_GRACE_PERIOD)
+    record_usage("command", _describe_command(cmd), usage, ret_code)
+    return (
+        ret_code,
+        outputs.get("stdout", "").strip(),
+        outputs.get("stderr", "").strip(),
+        None,
+    )
+
+
+def _describe_command(cmd):
+    # bash -c 的脚本只保留第一行作为记录名称
+    return shlex_join(cmd).splitlines()[0][:200]
+
+
+def _read_stream(pipe, name, outputs):
+    outputs[name] = pipe.read()
+    pipe.close()
+
+
+def _pump_stream(pipe, name, tail):
+    for line in iter(pipe.readline, ""):
+        line = line.rstrip("\n")
+        tail.append(line)
+        print_stream_line(line, stream=name)
+        c_log(f"[{name}] {line}")
+    pipe.close()
+
+
+def _kill_process_group(process, started=None):
+    """终止整个进程组：先 SIGTERM，超时后 SIGKILL，返回被终止进程的资源占用（已被回收时为 None）"""
+    for sig, grace in ((signal.SIGTERM, KILL_GRACE_PERIOD), (signal.SIGKILL, None)):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            return None
+        try:
+            return wait_process(process, timeout=grace, started=started)[1]
+        except subprocess.TimeoutExpired:
+            continue
+
+
+def stream_exec(
+    cmd,
+    cwd=None,
+    encoding="utf-8",
+    timeout=None,
+    tail_lines=DEFAULT_TAIL_LINES,
+):
+    """
+    执行命令并实时输出 stdout/stderr
+
+    每一行在产生时即输出到控制台并写入日志，内存中只保留最后 tail_lines 行用于最终汇总；
+    命令在独立的进程组中执行，超时后整个进程组会被终止
+    """
+    c_log(f"[exec] {shlex_join(cmd)}")
+    started = time.monotonic()
+    process = subprocess.Popen(
+        cmd,
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        shell=False,
+        encoding=encoding,
+        errors="replace",
+        bufsize=1,
+        start_new_session=True,
+    )
+    stdout_tail = deque(maxlen=tail_lines)
+    stderr_tail = deque(maxlen=tail_lines)
+    pumps = [
+        threading.Thread(
+            target=_pump_stream,
+            args=(process.stdout, "stdout", stdout_tail),
+            daemon=True,
+        ),
+        threading.Thread(
+            target=_pump_stream,
+            args=(process.stderr, "stderr", stderr_tail),
+            daemon=True,
+        ),
+    ]
+    for pump in pumps:
+        pump.start()
+
+    exception = None
+    usage = None
+    try:
+        _, usage = wait_process(process, timeout=timeout, started=started)
+    except subprocess.TimeoutExpired as e:
+        c_log(f"[timeout] killing process group {process.pid} after {timeout}s")
+        usage = _kill_process_group(process, started)
+        exception = e
+    except BaseException:
+        usage = _kill_process_group(process, started)
+        record_usage("command", _describe_command(cmd), usage, -1, status="killed")
+        raise
+    finally:
+        for pump in pumps:
+            pump.join(timeout=KILL_GRACE_PERIOD)
+
+    ret_code = -1 if exception is not None else process.returncode
+    status = "timeout" if exception is not None else None
+    record_usage("command", _describe_command(cmd), usage, ret_code, status=status)
+    c_log(f"[exit] {ret_code}")
+    return (
+        ret_code,
+        "\n".join(stdout_tail).strip(),
+        "\n".join(stderr_tail).strip(),
+        exception,
+    )
 
 
 def shlex_join(args):
@@ -147,13 +405,21 @@ def run_command(
     timeout=None,
     print_command=True,
 ):
-    """执行 shell 命令并返回结果"""
-    if isinstance(command, (list, tuple)):
-        command = shlex_join(command)
+    """
+    执行命令并返回结果
 
-    ret_code, stdout, stderr, exception = bash_exec(
-        command, cwd=cwd, encoding=encoding, timeout=timeout
-    )
+    参数列表形式的命令直接执行，字符串形式的命令作为 shell 脚本通过 bash -c 执行；
+    面板中的命令均以 shell 形式显示
+    """
+    if isinstance(command, (list, tuple)):
+        ret_code, stdout, stderr, exception = exec_command(
+            command, cwd=cwd, encoding=encoding, timeout=timeout
+        )
+        command = shlex_join(str(arg) for arg in command)
+    else:
+        ret_code, stdout, stderr, exception = bash_exec(
+            command, cwd=cwd, encoding=encoding, timeout=timeout
+        )
 
     if print_command:
         c_shell_command(